@@ -1,9 +1,25 @@
-import React from 'react';
+import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
+import axios from 'axios';
 import { useAuth } from '../context/AuthContext';
 
+const CLASS_COLORS = {
+  Normal: '#28a745',
+  Cyst: '#ffc107',
+  Stone: '#dc3545',
+  Tumor: '#17a2b8'
+};
+
 const Dashboard = () => {
   const { user } = useAuth();
+  const [summary, setSummary] = useState(null);
+
+  useEffect(() => {
+    // Totals are kept up to date by the server, so this is one small request
+    axios.get('/api/results/summary')
+      .then((response) => setSummary(response.data))
+      .catch((error) => console.error('Error loading summary:', error));
+  }, []);
 
   return (
     <div>
@@ -53,6 +69,34 @@ const Dashboard = () => {
         </div>
       </div>
       
+      {summary && summary.total > 0 && (
+        <div className="card">
+          <h2 style={{ marginBottom: '8px', color: '#333' }}>Your Analyses</h2>
+          <p style={{ color: '#666', marginBottom: '24px' }}>
+            {summary.total} image(s) analyzed, most recently on {new Date(summary.last_analysis_at * 1000).toLocaleString()}
+          </p>
+          
+          <div style={{ 
+            display: 'grid', 
+            gridTemplateColumns: 'repeat(auto-fit, minmax(150px, 1fr))', 
+            gap: '16px'
+          }}>
+            {Object.entries(summary.class_counts).map(([label, count]) => (
+              <div key={label} style={{ 
+                padding: '16px', 
+                textAlign: 'center',
+                backgroundColor: '#f8f9fa', 
+                borderRadius: '8px',
+                borderTop: `4px solid ${CLASS_COLORS[label] || '#6c757d'}`
+              }}>
+                <div style={{ fontSize: '28px', fontWeight: 'bold', color: '#333' }}>{count}</div>
+                <div style={{ color: '#666' }}>{label}</div>
+              </div>
+            ))}
+          </div>
+        </div>
+      )}
+      
       <div className="card">
         <h2 style={{ marginBottom: '24px', color: '#333' }}>How It Works</h2>
         
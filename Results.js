@@ -1,21 +1,131 @@
 import React, { useState, useEffect } from 'react';
-import { Link } from 'react-router-dom';
+import { Link, useLocation } from 'react-router-dom';
+import axios from 'axios';
+import { toast } from 'react-toastify';
 import { Chart as ChartJS, ArcElement, Tooltip, Legend, CategoryScale, LinearScale, BarElement } from 'chart.js';
 import { Doughnut, Bar } from 'react-chartjs-2';
 
 ChartJS.register(ArcElement, Tooltip, Legend, CategoryScale, LinearScale, BarElement);
 
+const isFinished = (job) => job.status === 'completed' || job.status === 'failed';
+
+const PAGE_SIZE = 50;
+
+// One page of the prediction history, newest first
+const fetchPage = async (before = null) => {
+  const response = await axios.get('/api/results', { params: { limit: PAGE_SIZE, before } });
+  return response.data;
+};
+
 const Results = () => {
   const [results, setResults] = useState([]);
-  const [selectedResult, setSelectedResult] = useState(null);
+  const [nextBefore, setNextBefore] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [pendingJobs, setPendingJobs] = useState([]);
+  const [selectedId, setSelectedId] = useState(null);
+  const location = useLocation();
+  const submittedJobId = location.state?.jobId;
 
-  useEffect(() => {
-    const storedResults = JSON.parse(localStorage.getItem('analysisResults') || '[]');
-    setResults(storedResults);
-    if (storedResults.length > 0) {
-      setSelectedResult(storedResults[0]);
+  const selectedResult = results.find((result) => result.id === selectedId) || results[0] || null;
+
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const page = await fetchPage(nextBefore);
+      setResults((current) => [...current, ...page.results]);
+      setNextBefore(page.next_before);
+    } catch (error) {
+      console.error('Error loading results:', error);
+      toast.error('Could not load more results');
+    } finally {
+      setLoadingMore(false);
     }
-  }, []);
+  };
+
+  useEffect(() => {
+    let active = true;
+    // History now lives on the server; drop the copy older versions kept in the browser
+    localStorage.removeItem('analysisResults');
+
+    // Show the newest page, selecting the first result of ``jobId`` if it's on it
+    const refresh = async (jobId) => {
+      const page = await fetchPage();
+      if (!active) {
+        return;
+      }
+      setResults(page.results);
+      setNextBefore(page.next_before);
+      const fromJob = page.results.find((result) => result.job_id === jobId);
+      if (fromJob) {
+        setSelectedId(fromJob.id);
+      }
+    };
+
+    const finish = (job) => {
+      setPendingJobs((current) => current.filter((pending) => pending.id !== job.id));
+      if (job.status === 'failed') {
+        toast.error(`Analysis failed: ${job.error}`);
+        return;
+      }
+      if (job.result.study.failed_images > 0) {
+        toast.warning(`${job.result.study.failed_images} image(s) could not be processed`);
+      }
+      if (job.id === submittedJobId) {
+        toast.success('Analysis completed successfully!');
+      }
+      refresh(job.id).catch((error) => console.error('Error loading results:', error));
+    };
+
+    // Long-poll all the jobs with one request at a time until they finish (or the page is left)
+    const follow = async (jobs) => {
+      let ids = jobs.map((job) => job.id);
+      while (active && ids.length > 0) {
+        try {
+          const response = await axios.get('/api/jobs', { params: { ids: ids.join(','), wait: 25 } });
+          if (!active) {
+            return;
+          }
+          const polled = response.data.jobs;
+          const finished = polled.filter(isFinished);
+          // Jobs missing from the answer have expired
+          ids = polled.filter((job) => !isFinished(job)).map((job) => job.id);
+          setPendingJobs((current) => current
+            .filter((pending) => ids.includes(pending.id))
+            .map((pending) => polled.find((job) => job.id === pending.id)));
+          finished.forEach(finish);
+          // The server was too busy to wait: don't ask again straight away
+          const retryAfter = Number(response.headers['retry-after']);
+          if (retryAfter && finished.length === 0) {
+            await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
+          }
+        } catch (error) {
+          await new Promise((resolve) => setTimeout(resolve, 5000));
+        }
+      }
+    };
+
+    const load = async () => {
+      try {
+        const [, jobs] = await Promise.all([
+          refresh(submittedJobId),
+          axios.get('/api/jobs', { params: { active: 1 } })
+        ]);
+        if (!active) {
+          return;
+        }
+        setPendingJobs(jobs.data.jobs);
+        follow(jobs.data.jobs);
+      } catch (error) {
+        console.error('Error loading results:', error);
+        toast.error('Could not load your results');
+      }
+    };
+
+    load();
+    return () => {
+      active = false;
+    };
+  }, [submittedJobId]);
 
   const getPredictionColor = (prediction) => {
     switch (prediction) {
@@ -33,7 +143,7 @@ const Results = () => {
   };
 
   const formatDate = (timestamp) => {
-    return new Date(timestamp).toLocaleString();
+    return new Date(timestamp * 1000).toLocaleString();
   };
 
   const getDoughnutData = (result) => {
@@ -119,8 +229,29 @@ const Results = () => {
           </Link>
         </div>
 
+        {pendingJobs.map((job) => (
+          <div
+            key={job.id}
+            style={{
+              display: 'flex',
+              alignItems: 'center',
+              padding: '12px 16px',
+              marginBottom: '16px',
+              backgroundColor: '#f8f9ff',
+              border: '2px solid #e8ecff',
+              borderRadius: '8px'
+            }}
+          >
+            <div className="spinner" style={{ width: '20px', height: '20px', marginRight: '12px' }}></div>
+            <span style={{ color: '#333' }}>
+              {job.status === 'queued' ? 'Waiting to analyze' : 'Analyzing'} {job.progress.total} image(s)
+              {job.status === 'running' && ` (${job.progress.done}/${job.progress.total} done)`}
+            </span>
+          </div>
+        ))}
+
         {results.length === 0 ? (
-          <div style={{ textAlign: 'center', padding: '40px' }}>
+          pendingJobs.length === 0 && <div style={{ textAlign: 'center', padding: '40px' }}>
             <div style={{ fontSize: '48px', color: '#dee2e6', marginBottom: '16px' }}>
               📊
             </div>
@@ -138,10 +269,10 @@ const Results = () => {
             <div>
               <h3 style={{ marginBottom: '16px', color: '#333' }}>Previous Analyses</h3>
               <div style={{ maxHeight: '500px', overflowY: 'auto' }}>
-                {results.map((result, index) => (
+                {results.map((result) => (
                   <div
-                    key={index}
-                    onClick={() => setSelectedResult(result)}
+                    key={result.id}
+                    onClick={() => setSelectedId(result.id)}
                     style={{
                       padding: '16px',
                       border: `2px solid ${selectedResult === result ? '#667eea' : '#e9ecef'}`,
@@ -185,10 +316,20 @@ const Results = () => {
                       {result.filename}
                     </p>
                     <p style={{ fontSize: '12px', color: '#999', margin: 0 }}>
-                      {formatDate(result.timestamp)}
+                      {formatDate(result.created_at)}
                     </p>
                   </div>
                 ))}
+                {nextBefore && (
+                  <button
+                    onClick={loadMore}
+                    className="btn btn-secondary"
+                    style={{ width: '100%' }}
+                    disabled={loadingMore}
+                  >
+                    {loadingMore ? 'Loading...' : 'Load More'}
+                  </button>
+                )}
               </div>
             </div>
 
@@ -276,7 +417,7 @@ const Results = () => {
                         Analysis Date
                       </p>
                       <p style={{ margin: 0, fontWeight: '500' }}>
-                        {formatDate(selectedResult.timestamp)}
+                        {formatDate(selectedResult.created_at)}
                       </p>
                     </div>
                     <div>
@@ -284,7 +425,7 @@ const Results = () => {
                         Model Used
                       </p>
                       <p style={{ margin: 0, fontWeight: '500' }}>
-                        MobileNetV2
+                        {selectedResult.model_version}
                       </p>
                     </div>
                   </div>
@@ -5,36 +5,56 @@ import axios from 'axios';
 import { toast } from 'react-toastify';
 
 const Upload = () => {
-  const [uploadedFile, setUploadedFile] = useState(null);
+  const [uploadedFiles, setUploadedFiles] = useState([]);
   const [preview, setPreview] = useState(null);
   const [loading, setLoading] = useState(false);
   const navigate = useNavigate();
 
-  const onDrop = useCallback((acceptedFiles) => {
-    const file = acceptedFiles[0];
-    if (file) {
-      setUploadedFile(file);
-      
-      // Create preview
+  const onDrop = useCallback((acceptedFiles, fileRejections) => {
+    fileRejections.forEach(({ file, errors }) => toast.error(`${file.name}: ${errors[0].message}`));
+    if (acceptedFiles.length === 0) {
+      return;
+    }
+    setUploadedFiles(acceptedFiles);
+    
+    // Create preview from the first image (archives have none)
+    const firstImage = acceptedFiles.find((file) => file.type.startsWith('image/'));
+    if (firstImage) {
       const reader = new FileReader();
       reader.onload = () => {
         setPreview(reader.result);
       };
-      reader.readAsDataURL(file);
+      reader.readAsDataURL(firstImage);
+    } else {
+      setPreview(null);
     }
   }, []);
 
   const { getRootProps, getInputProps, isDragActive } = useDropzone({
     onDrop,
     accept: {
-      'image/*': ['.jpeg', '.jpg', '.png']
+      'image/*': ['.jpeg', '.jpg', '.png'],
+      'application/zip': ['.zip'],
+      'application/x-tar': ['.tar'],
+      'application/gzip': ['.tgz', '.tar.gz']
     },
-    multiple: false,
-    maxSize: 16 * 1024 * 1024 // 16MB
+    // The gzip type would also let in a plain .gz file, which the server can't read
+    validator: (file) => {
+      const name = file.name.toLowerCase();
+      if (name.endsWith('.gz') && !name.endsWith('.tar.gz')) {
+        return { code: 'not-a-tar-archive', message: 'Only .tar.gz archives of slices are supported' };
+      }
+      return null;
+    },
+    multiple: true,
+    maxSize: 256 * 1024 * 1024 // 256MB (single images are limited to 16MB by the server)
   });
 
+  const isBatch = uploadedFiles.length > 1 || uploadedFiles.some((file) => !file.type.startsWith('image/'));
+  const totalSize = uploadedFiles.reduce((sum, file) => sum + file.size, 0);
+
   const handleUpload = async () => {
-    if (!uploadedFile) {
+    if (uploadedFiles.length === 0) {
       toast.error('Please select a file first');
       return;
     }
@@ -42,28 +62,18 @@ const Upload = () => {
     setLoading(true);
     
     const formData = new FormData();
-    formData.append('image', uploadedFile);
+    uploadedFiles.forEach((file) => formData.append('images', file));
 
     try {
-      const response = await axios.post('/api/predict', formData, {
+      // The analysis runs as a job on the server; the results page follows it
+      const response = await axios.post('/api/jobs', formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
         },
       });
 
-      // Store result in localStorage for the results page
-      const result = {
-        ...response.data,
-        timestamp: new Date().toISOString(),
-        filename: uploadedFile.name
-      };
-      
-      const existingResults = JSON.parse(localStorage.getItem('analysisResults') || '[]');
-      existingResults.unshift(result);
-      localStorage.setItem('analysisResults', JSON.stringify(existingResults));
-
-      toast.success('Analysis completed successfully!');
-      navigate('/results');
+      toast.info('Upload complete, analysis started');
+      navigate('/results', { state: { jobId: response.data.id } });
       
     } catch (error) {
       console.error('Upload error:', error);
@@ -74,7 +84,7 @@ const Upload = () => {
   };
 
   const removeFile = () => {
-    setUploadedFile(null);
+    setUploadedFiles([]);
     setPreview(null);
   };
 
@@ -117,19 +127,19 @@ const Upload = () => {
                     📁
                   </div>
                   <p style={{ fontSize: '18px', color: '#667eea', marginBottom: '8px' }}>
-                    Drag & drop an image here
+                    Drag & drop images here
                   </p>
                   <p style={{ color: '#666', marginBottom: '16px' }}>
-                    or click to select a file
+                    or click to select one or more files
                   </p>
                   <p style={{ fontSize: '14px', color: '#999' }}>
-                    Supports: JPG, PNG, JPEG (Max: 16MB)
+                    Supports: JPG, PNG, JPEG (Max: 16MB each), or a ZIP/TAR of slices
                   </p>
                 </div>
               )}
             </div>
 
-            {uploadedFile && (
+            {uploadedFiles.length > 0 && (
               <div style={{ marginTop: '16px' }}>
                 <div style={{ 
                   display: 'flex', 
@@ -141,10 +151,10 @@ const Upload = () => {
                 }}>
                   <div>
                     <p style={{ margin: '0 0 4px 0', fontWeight: '500' }}>
-                      {uploadedFile.name}
+                      {uploadedFiles.length === 1 ? uploadedFiles[0].name : `${uploadedFiles.length} files selected`}
                     </p>
                     <p style={{ margin: 0, fontSize: '14px', color: '#666' }}>
-                      {(uploadedFile.size / 1024 / 1024).toFixed(2)} MB
+                      {(totalSize / 1024 / 1024).toFixed(2)} MB
                     </p>
                   </div>
                   <button
@@ -160,25 +170,29 @@ const Upload = () => {
           </div>
 
           <div>
-            {preview ? (
+            {uploadedFiles.length > 0 ? (
               <div>
-                <h3 style={{ marginBottom: '16px', color: '#333' }}>Image Preview</h3>
-                <div style={{ 
-                  border: '2px solid #e9ecef', 
-                  borderRadius: '12px', 
-                  overflow: 'hidden',
-                  marginBottom: '24px'
-                }}>
-                  <img
-                    src={preview}
-                    alt="Preview"
-                    style={{ 
-                      width: '100%', 
-                      height: 'auto', 
-                      display: 'block' 
-                    }}
-                  />
-                </div>
+                {preview && (
+                  <>
+                    <h3 style={{ marginBottom: '16px', color: '#333' }}>Image Preview</h3>
+                    <div style={{ 
+                      border: '2px solid #e9ecef', 
+                      borderRadius: '12px', 
+                      overflow: 'hidden',
+                      marginBottom: '24px'
+                    }}>
+                      <img
+                        src={preview}
+                        alt="Preview"
+                        style={{ 
+                          width: '100%', 
+                          height: 'auto', 
+                          display: 'block' 
+                        }}
+                      />
+                    </div>
+                  </>
+                )}
                 
                 <button
                   onClick={handleUpload}
@@ -189,10 +203,10 @@ const Upload = () => {
                   {loading ? (
                     <div style={{ display: 'flex', alignItems: 'center', justifyContent: 'center' }}>
                       <div className="spinner" style={{ width: '20px', height: '20px', marginRight: '8px' }}></div>
-                      Analyzing...
+                      Uploading...
                     </div>
                   ) : (
-                    'Analyze Image'
+                    isBatch ? `Analyze ${uploadedFiles.length > 1 ? uploadedFiles.length + ' Files' : 'Study'}` : 'Analyze Image'
                   )}
                 </button>
               </div>
@@ -246,7 +260,7 @@ const Upload = () => {
             <h4 style={{ color: '#667eea', marginBottom: '8px' }}>🔒 Privacy & Security</h4>
             <ul style={{ color: '#666', margin: 0, paddingLeft: '20px' }}>
               <li>Images are processed securely</li>
-              <li>No data is stored permanently</li>
+              <li>Uploaded images are not stored</li>
               <li>Results are for educational purposes only</li>
             </ul>
           </div>
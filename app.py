@@ -1,65 +1,338 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
+import io
 import os
+import time
+import uuid
 import numpy as np
-from PIL import Image
-import tensorflow as tf
 from datetime import timedelta
 import json
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import nullcontext
+
+from auth import HasherBusyError, PasswordHasher, RateLimiter
+from batching import MicroBatcher
+from decode_pool import DecodePool, plan_threads
+from history import open_result_store
+from inference import CLASS_LABELS, InferenceService
+from jobs import JobQueueFullError, describe_job, open_job_queue
+from metrics import MetricsRegistry
+from model_registry import ModelRegistry
+from prediction_cache import PredictionCache
+from profiling import RequestProfiler, valid_request_id
+from preprocessing import allocate_batch, preprocess_image
+from study import StudyAggregator, StudyUploadError, expand_uploads
+from user_store import UserExistsError, open_user_store
+
+class InMemoryUploadRequest(Request):
+    """Keep uploaded files in memory; werkzeug spools those over 500KB to temporary files
+
+    MAX_CONTENT_LENGTH bounds how much a request can buffer.
+    """
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
 
 app = Flask(__name__)
+app.request_class = InMemoryUploadRequest
 app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
 app.config['JWT_SECRET_KEY'] = 'jwt-secret-key-change-in-production'
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-
-# Ensure upload folder exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+app.config['MAX_IMAGE_SIZE'] = 16 * 1024 * 1024  # 16MB max file size per image
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 256 * 1024 * 1024))  # whole request, incl. batches
+app.config['BATCH_MAX_FILES'] = int(os.environ.get('BATCH_MAX_FILES', 500))
+app.config['BATCH_MAX_BYTES'] = int(os.environ.get('BATCH_MAX_BYTES', 256 * 1024 * 1024))  # all images of a batch, once unpacked
+app.config['BATCH_CHUNK_SIZE'] = int(os.environ.get('BATCH_CHUNK_SIZE', 32))
+# Decode workers and TensorFlow's op threads split this process's share of the
+# cores between them by default (SERVER_WORKERS is set by gunicorn.conf.py)
+CPU_COUNT = max(1, (os.cpu_count() or 4) // int(os.environ.get('SERVER_WORKERS', 1)))
+app.config['DECODE_POOL'] = os.environ.get('DECODE_POOL', 'thread')  # 'thread' or 'process'
+app.config['DECODE_WORKERS'] = int(os.environ.get('DECODE_WORKERS', max(1, CPU_COUNT // 4)))
+app.config['TF_INTRA_OP_THREADS'] = int(os.environ.get('TF_INTRA_OP_THREADS', max(1, CPU_COUNT - app.config['DECODE_WORKERS'])))
+app.config['TF_INTER_OP_THREADS'] = int(os.environ.get('TF_INTER_OP_THREADS', 0))  # 0 keeps TensorFlow's default
+app.config['BATCH_MAX_SIZE'] = int(os.environ.get('BATCH_MAX_SIZE', 16))
+app.config['BATCH_MAX_WAIT_MS'] = float(os.environ.get('BATCH_MAX_WAIT_MS', 10))
+app.config['PREDICT_TIMEOUT'] = float(os.environ.get('PREDICT_TIMEOUT', 30))
+app.config['MODEL_PATH'] = os.environ.get('MODEL_PATH', 'models/kidney_anomaly_model.h5')
+app.config['INFERENCE_BACKEND'] = os.environ.get('INFERENCE_BACKEND') or None  # 'keras', 'tflite' or 'onnx'; default from MODEL_PATH's extension
+app.config['INFERENCE_MODE'] = os.environ.get('INFERENCE_MODE', 'compiled')  # 'compiled' or 'eager' (keras backend)
+app.config['INFERENCE_XLA'] = os.environ.get('INFERENCE_XLA', '0') == '1'
+app.config['MODELS_DIR'] = os.environ.get('MODELS_DIR') or os.path.dirname(app.config['MODEL_PATH']) or '.'
+app.config['MODEL_SYNC_INTERVAL'] = float(os.environ.get('MODEL_SYNC_INTERVAL', 5))  # seconds between checks for activations by other workers
+app.config['USER_DB_URL'] = os.environ.get('USER_DB_URL', 'sqlite:///users.db')  # 'sqlite:///path.db' or 'postgresql://...'
+app.config['USER_DB_POOL_SIZE'] = int(os.environ.get('USER_DB_POOL_SIZE', 8))  # connections per worker process
+# Password hashes run on a few dedicated threads so login bursts can't starve predictions
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')  # werkzeug method incl. cost
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', max(1, CPU_COUNT // 4)))
+# Hashes allowed to wait; more get a 503. Waiting logins hold a request thread,
+# so keep workers + queue well below GUNICORN_THREADS
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', 2))
+app.config['LOGIN_RATE_PER_ACCOUNT'] = int(os.environ.get('LOGIN_RATE_PER_ACCOUNT', 10))  # attempts per LOGIN_RATE_PERIOD, 0 disables
+app.config['LOGIN_RATE_PER_IP'] = int(os.environ.get('LOGIN_RATE_PER_IP', 30))
+app.config['LOGIN_RATE_PERIOD'] = float(os.environ.get('LOGIN_RATE_PERIOD', 60))
+app.config['ADMIN_EMAILS'] = [email.strip() for email in os.environ.get('ADMIN_EMAILS', 'admin@example.com').split(',') if email.strip()]
+# When TensorFlow and the model are loaded: 'background' starts loading on a
+# thread at import, 'import' blocks the import until warmed up, 'lazy' waits for
+# the first prediction, and 'deferred' leaves it to the server (gunicorn does it
+# in each worker after fork, see gunicorn.conf.py)
+app.config['MODEL_INIT'] = os.environ.get('MODEL_INIT', 'background')
+app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))  # 0 disables the cache
+app.config['CACHE_TTL_SECONDS'] = float(os.environ.get('CACHE_TTL_SECONDS', 0))  # 0 means no expiry
+app.config['CACHE_DIR'] = os.environ.get('CACHE_DIR', '')  # empty keeps the cache in memory only
+app.config['CACHE_DISK_MAX_ENTRIES'] = int(os.environ.get('CACHE_DISK_MAX_ENTRIES', 100000))  # entries kept in CACHE_DIR
+# Directory where each worker process publishes its metrics so /metrics can sum
+# them (set by gunicorn.conf.py); empty reports this process only
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', '')
+# Profiling: admins send 'X-Profile: 1' to profile a request, and a
+# PROFILE_SAMPLE_RATE fraction of prediction requests is profiled at random
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # 0 disables sampling
+app.config['PROFILER'] = os.environ.get('PROFILER', 'cprofile')  # 'cprofile' or 'pyinstrument'
+# Asynchronous analyses (/api/jobs): run in the worker that accepted them, with
+# their status and results in a database every worker can read
+app.config['JOB_DB_URL'] = os.environ.get('JOB_DB_URL', 'sqlite:///jobs.db')
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 1))  # analyses running at once, per worker process
+app.config['JOB_QUEUE_SIZE'] = int(os.environ.get('JOB_QUEUE_SIZE', 8))  # analyses waiting per worker process, beyond that 503
+app.config['JOB_RETENTION'] = float(os.environ.get('JOB_RETENTION', 86400))  # seconds finished jobs are kept
+app.config['JOB_MAX_WAIT'] = float(os.environ.get('JOB_MAX_WAIT', 30))  # longest long-poll in seconds
+app.config['JOB_MAX_WAITERS'] = int(os.environ.get('JOB_MAX_WAITERS', 4))  # long-polls waiting at once, per worker process
+app.config['RESULTS_DB_URL'] = os.environ.get('RESULTS_DB_URL', 'sqlite:///results.db')  # prediction history
 
 # Initialize extensions
 CORS(app)
 jwt = JWTManager(app)
 
-# In-memory user storage (replace with database in production)
-users = {
-    'admin@example.com': {
-        'password': generate_password_hash('admin123'),
-        'name': 'Admin User'
-    }
-}
+request_profiler = RequestProfiler(
+    app.config['PROFILE_DIR'],
+    sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+    profiler=app.config['PROFILER']
+)
 
-# Load the trained model
-model = None
-try:
-    model = tf.keras.models.load_model('models/kidney_anomaly_model.h5')
-    print("Model loaded successfully")
-except:
-    print("Model not found. Please train the model first.")
+# Prometheus metrics, served at /metrics
+metrics = MetricsRegistry(app.config['METRICS_DIR'])
+http_requests = metrics.counter(
+    'http_requests_total', 'HTTP requests by endpoint, method and status', ['endpoint', 'method', 'status']
+)
+http_request_seconds = metrics.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by endpoint', ['endpoint']
+)
+stage_seconds = metrics.histogram(
+    'prediction_stage_duration_seconds',
+    'Time per prediction stage: upload_read, decode, queue_wait, inference, serialization',
+    ['stage']
+)
+inference_batch_size = metrics.histogram(
+    'inference_batch_size', 'Images per forward pass', buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+predictions_total = metrics.counter(
+    'predictions_total', 'Predictions served by predicted class and model version', ['predicted_class', 'model_version']
+)
+prediction_errors = metrics.counter('prediction_errors_total', 'Failed predictions by error type', ['error'])
+cache_lookups = metrics.counter('prediction_cache_lookups_total', 'Prediction cache lookups by result', ['result'])
+analysis_jobs = metrics.counter('analysis_jobs_total', 'Analysis jobs by outcome: completed, failed, rejected', ['status'])
 
-# Class labels
-CLASS_LABELS = ['Normal', 'Cyst', 'Stone', 'Tumor']
+password_hasher = PasswordHasher(
+    app.config['PASSWORD_HASH_METHOD'],
+    max_workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_pending=app.config['PASSWORD_HASH_QUEUE']
+)
+# Login/registration attempts per account and per client address (per worker process)
+account_rate_limiter = RateLimiter(app.config['LOGIN_RATE_PER_ACCOUNT'], app.config['LOGIN_RATE_PERIOD'])
+ip_rate_limiter = RateLimiter(app.config['LOGIN_RATE_PER_IP'], app.config['LOGIN_RATE_PERIOD'])
 
-def preprocess_image(image_path):
-    """Preprocess image for model prediction"""
+# Registered accounts, shared by every worker process through the database
+user_store = open_user_store(app.config['USER_DB_URL'], pool_size=app.config['USER_DB_POOL_SIZE'])
+if 'admin@example.com' not in user_store:
     try:
-        # Load and resize image
-        img = Image.open(image_path).convert('RGB')
-        img = img.resize((224, 224))
-        
-        # Convert to array and normalize
-        img_array = np.array(img) / 255.0
-        
-        # Add batch dimension
-        img_array = np.expand_dims(img_array, axis=0)
-        
-        return img_array
+        user_store.add('admin@example.com', 'Admin User', password_hasher.hash('admin123'))
+    except UserExistsError:
+        pass  # seeded by another worker meanwhile
+
+plan_threads(
+    CPU_COUNT,
+    app.config['DECODE_WORKERS'],
+    app.config['TF_INTRA_OP_THREADS'],
+    app.config['TF_INTER_OP_THREADS']
+)
+
+def make_inference_service(model_path, model_version):
+    """Create the (not yet loaded) inference service for one model artifact"""
+    # INFERENCE_BACKEND only applies to MODEL_PATH, other artifacts go by extension
+    backend = app.config['INFERENCE_BACKEND'] if model_path == app.config['MODEL_PATH'] else None
+    return InferenceService(
+        model_path,
+        mode=app.config['INFERENCE_MODE'],
+        jit_compile=app.config['INFERENCE_XLA'],
+        # Warm up to the largest batch it runs: a micro-batch or a chunk of a batch upload
+        max_batch_size=max(app.config['BATCH_MAX_SIZE'], app.config['BATCH_CHUNK_SIZE']),
+        intra_op_threads=app.config['TF_INTRA_OP_THREADS'],
+        inter_op_threads=app.config['TF_INTER_OP_THREADS'],
+        model_version=model_version,
+        backend=backend
+    )
+
+# The trained models; TensorFlow is only imported once one of them loads.
+# Requests take a snapshot of model_registry.active so a hot swap never
+# changes the model underneath an in-flight request.
+model_registry = ModelRegistry(
+    app.config['MODELS_DIR'],
+    make_inference_service,
+    default_path=app.config['MODEL_PATH'],
+    sync_interval=app.config['MODEL_SYNC_INTERVAL']
+)
+
+def init_model():
+    """Load and warm up the model in this process
+
+    TensorFlow's runtime does not survive fork(), so a preloading server must
+    call this in each worker rather than in the parent process.
+    """
+    return model_registry.load()
+
+if app.config['MODEL_INIT'] == 'import':
+    init_model()
+elif app.config['MODEL_INIT'] == 'background':
+    model_registry.active.start_background_load()
+
+def run_model_batch(batch):
+    """Run one forward pass of the active model over a stacked batch
+
+    Returns the outputs together with the version that produced them.
+    """
+    service = model_registry.active
+    return service.predict(batch), service.model_version
+
+# Results for previously seen images, keyed on image bytes + model version,
+# so every model version has its own entries
+prediction_cache = PredictionCache(
+    max_entries=app.config['CACHE_MAX_ENTRIES'],
+    ttl_seconds=app.config['CACHE_TTL_SECONDS'],
+    disk_dir=app.config['CACHE_DIR'],
+    disk_max_entries=app.config['CACHE_DISK_MAX_ENTRIES']
+)
+
+# Decodes the images of batch requests, separately from TensorFlow's threads
+decode_pool = DecodePool(app.config['DECODE_WORKERS'], kind=app.config['DECODE_POOL'])
+
+def record_batch(queue_waits, inference_seconds):
+    for wait in queue_waits:
+        stage_seconds.observe(wait, stage='queue_wait')
+    stage_seconds.observe(inference_seconds, stage='inference')
+    inference_batch_size.observe(len(queue_waits))
+
+# Concurrent /api/predict requests share batched forward passes
+batcher = MicroBatcher(
+    run_model_batch,
+    max_batch_size=app.config['BATCH_MAX_SIZE'],
+    max_wait_ms=app.config['BATCH_MAX_WAIT_MS'],
+    with_metadata=True,
+    on_batch=record_batch
+)
+
+# Analyses submitted through /api/jobs
+job_queue = open_job_queue(
+    app.config['JOB_DB_URL'],
+    max_workers=app.config['JOB_WORKERS'],
+    max_pending=app.config['JOB_QUEUE_SIZE'],
+    max_waiters=app.config['JOB_MAX_WAITERS'],
+    retention=app.config['JOB_RETENTION'],
+    on_finish=lambda status: analysis_jobs.inc(status=status)
+)
+
+# Every user's prediction history, shared by every worker process through the database
+result_store = open_result_store(app.config['RESULTS_DB_URL'], pool_size=app.config['USER_DB_POOL_SIZE'])
+
+def format_prediction(probabilities, model_version):
+    """Build the API result for one image's output probabilities"""
+    predicted_class = int(np.argmax(probabilities))
+    return {
+        'prediction': CLASS_LABELS[predicted_class],
+        'confidence': float(probabilities[predicted_class]),
+        'all_probabilities': {
+            CLASS_LABELS[i]: float(probabilities[i])
+            for i in range(len(CLASS_LABELS))
+        },
+        'model_version': model_version
+    }
+
+def prediction_error(error, message, status):
+    """Count a failed prediction under ``error`` and build its error response"""
+    prediction_errors.inc(error=error)
+    return jsonify({'error': message}), status
+
+def record_history(owner, results, job_id=None):
+    """Add the successful predictions among ``results`` to ``owner``'s history"""
+    try:
+        result_store.add(owner, [result for result in results if 'error' not in result], job_id)
     except Exception as e:
-        print(f"Error preprocessing image: {e}")
-        return None
+        # The prediction itself succeeded, so the client still gets it
+        print(f"Error recording prediction history: {e}")
+
+def serialize(payload):
+    with stage_seconds.time(stage='serialization'):
+        return jsonify(payload)
+
+def is_admin(email):
+    return email in app.config['ADMIN_EMAILS']
+
+def requested_by_admin():
+    """True when the request carries a valid admin token (checked outside ``jwt_required`` views)"""
+    try:
+        verify_jwt_in_request(optional=True)
+        return is_admin(get_jwt_identity())
+    except Exception:
+        return False
+
+def trace_forward_pass(service):
+    """TensorFlow trace of a forward pass when the current request is being profiled"""
+    profile = g.get('profile')
+    return profile.trace_tensorflow(service.backend) if profile is not None else nullcontext()
+
+def retry_later(message, retry_after, status=429):
+    """Error response telling the client when to try again"""
+    return jsonify({'error': message}), status, {'Retry-After': str(max(1, int(retry_after + 0.999)))}
+
+@app.before_request
+def start_request():
+    """Assign the request ID and start profiling if asked to (or sampled)"""
+    g.request_started = time.perf_counter()
+    request_id = request.headers.get('X-Request-ID')
+    g.request_id = request_id if valid_request_id(request_id) else uuid.uuid4().hex
+    
+    if request.headers.get('X-Profile') == '1' and requested_by_admin():
+        g.profile = request_profiler.start(g.request_id, path=request.path, reason='requested')
+    elif request.path.startswith('/api/predict') and request_profiler.sampled():
+        g.profile = request_profiler.start(g.request_id, path=request.path, reason='sampled')
+
+@app.before_request
+def follow_model_activations():
+    """Pick up a model version activated by another worker process"""
+    model_registry.sync()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if 'request_started' in g:
+        http_request_seconds.observe(time.perf_counter() - g.request_started, endpoint=endpoint)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    if g.get('profile') is not None:
+        g.profile.meta['status'] = response.status_code
+        response.headers['X-Profile-Id'] = g.profile.profile_id
+        if response.is_streamed:
+            # The request context is torn down before a stream is generated
+            response.call_on_close(g.profile.stop)
+            g.profile_streamed = True
+    return response
+
+@app.teardown_request
+def stop_profiling(error=None):
+    """Write the profile of a finished request (streamed ones stop when the stream closes)"""
+    profile = g.get('profile')
+    if profile is not None and not g.get('profile_streamed'):
+        profile.stop()
 
 @app.route('/api/register', methods=['POST'])
 def register():
@@ -73,16 +346,22 @@ def register():
         if not email or not password or not name:
             return jsonify({'error': 'Missing required fields'}), 400
         
-        if email in users:
+        retry_after = ip_rate_limiter.hit(request.remote_addr)
+        if retry_after:
+            return retry_later('Too many attempts, please try again later', retry_after)
+        
+        if email in user_store:
             return jsonify({'error': 'User already exists'}), 409
         
-        users[email] = {
-            'password': generate_password_hash(password),
-            'name': name
-        }
+        try:
+            user_store.add(email, name, password_hasher.hash(password))
+        except UserExistsError:
+            return jsonify({'error': 'User already exists'}), 409
         
         return jsonify({'message': 'User registered successfully'}), 201
     
+    except HasherBusyError as e:
+        return retry_later(str(e), 1, status=503)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -97,10 +376,21 @@ def login():
         if not email or not password:
             return jsonify({'error': 'Missing email or password'}), 400
         
-        user = users.get(email)
-        if not user or not check_password_hash(user['password'], password):
+        retry_after = max(ip_rate_limiter.hit(request.remote_addr), account_rate_limiter.hit(email))
+        if retry_after:
+            return retry_later('Too many login attempts, please try again later', retry_after)
+        
+        user = user_store.get(email)
+        if not user or not password_hasher.verify(user['password'], password):
             return jsonify({'error': 'Invalid credentials'}), 401
         
+        # Upgrade hashes made with an older PASSWORD_HASH_METHOD or cost, when there's capacity
+        try:
+            if password_hasher.needs_rehash(user['password']):
+                user_store.update_password(email, password_hasher.hash(password))
+        except HasherBusyError:
+            pass
+        
         access_token = create_access_token(identity=email)
         return jsonify({
             'access_token': access_token,
@@ -110,6 +400,8 @@ def login():
             }
         }), 200
     
+    except HasherBusyError as e:
+        return retry_later(str(e), 1, status=503)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -118,44 +410,366 @@ def login():
 def predict():
     """Predict kidney anomaly from uploaded image"""
     try:
-        if 'image' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
+        # Refuse an oversized upload before buffering it or waiting for the model;
+        # MAX_CONTENT_LENGTH is sized for batches (allow for the multipart envelope)
+        if request.content_length is None:
+            return prediction_error('length_required', 'The upload must have a Content-Length', 411)
+        if request.content_length > app.config['MAX_IMAGE_SIZE'] + 64 * 1024:
+            return prediction_error('image_too_large', 'Image exceeds the maximum file size', 413)
+        
+        # Parse the upload and read it into memory, nothing is written to disk
+        with stage_seconds.time(stage='upload_read'):
+            file = request.files.get('image')
+            image_bytes = file.read() if file is not None and file.filename != '' else None
+        if file is None:
+            return prediction_error('missing_image', 'No image file provided', 400)
+        if image_bytes is None:
+            return prediction_error('missing_image', 'No image file selected', 400)
         
-        file = request.files['image']
-        if file.filename == '':
-            return jsonify({'error': 'No image file selected'}), 400
+        service = model_registry.active
+        if not service.load():
+            return prediction_error('model_unavailable', 'Model not loaded. Please contact administrator.', 500)
         
-        if model is None:
-            return jsonify({'error': 'Model not loaded. Please contact administrator.'}), 500
+        if len(image_bytes) > app.config['MAX_IMAGE_SIZE']:
+            return prediction_error('image_too_large', 'Image exceeds the maximum file size', 413)
         
-        # Save uploaded file
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        cache_key = PredictionCache.make_key(image_bytes, service.model_version)
+        image_hash = PredictionCache.image_hash(cache_key)
+        cached_result = prediction_cache.get(cache_key)
+        cache_lookups.inc(result='miss' if cached_result is None else 'hit')
+        if cached_result is not None:
+            predictions_total.inc(predicted_class=cached_result['prediction'], model_version=cached_result['model_version'])
+            record_history(get_jwt_identity(), [{'filename': file.filename, 'image_hash': image_hash, **cached_result}])
+            return serialize(cached_result), 200
         
-        # Preprocess image
-        processed_image = preprocess_image(filepath)
+        with stage_seconds.time(stage='decode'):
+            processed_image = preprocess_image(image_bytes)
         if processed_image is None:
-            return jsonify({'error': 'Error processing image'}), 500
-        
-        # Make prediction
-        predictions = model.predict(processed_image)
-        predicted_class = np.argmax(predictions[0])
-        confidence = float(predictions[0][predicted_class])
-        
-        # Clean up uploaded file
-        os.remove(filepath)
-        
-        result = {
-            'prediction': CLASS_LABELS[predicted_class],
-            'confidence': confidence,
-            'all_probabilities': {
-                CLASS_LABELS[i]: float(predictions[0][i]) 
-                for i in range(len(CLASS_LABELS))
-            }
-        }
+            return prediction_error('decode_error', 'Error processing image', 500)
+        
+        if g.get('profile') is None:
+            # Make prediction (batched with other in-flight requests)
+            probabilities, model_version = batcher.submit(processed_image, timeout=app.config['PREDICT_TIMEOUT'])
+        else:
+            # A profiled request runs its own forward pass on this thread, so both
+            # the Python profile and the TensorFlow trace cover it and nothing else
+            with trace_forward_pass(service):
+                probabilities, model_version = service.predict(processed_image)[0], service.model_version
+        result = format_prediction(probabilities, model_version)
+        predictions_total.inc(predicted_class=result['prediction'], model_version=model_version)
+        # A swap may have landed between the lookup and the forward pass
+        if model_version != service.model_version:
+            cache_key = PredictionCache.make_key(image_bytes, model_version)
+        prediction_cache.put(cache_key, result)
+        record_history(get_jwt_identity(), [{'filename': file.filename, 'image_hash': image_hash, **result}])
+        
+        return serialize(result), 200
+    
+    except FutureTimeoutError:
+        return prediction_error('timeout', 'Prediction timed out', 504)
+    except Exception as e:
+        return prediction_error(type(e).__name__, str(e), 500)
+
+def start_chunk(service, images, start, stop, buffer):
+    """Look up a chunk in the cache and start decoding its misses into ``buffer``
+
+    Returns ``(cached, pending, pending_batch)``: the ``(index, result)`` cache
+    hits, the ``(index, cache_key)`` misses and the in-flight decode (or None).
+    """
+    cached = []
+    pending = []
+    for index in range(start, stop):
+        filename, image_bytes = images[index]
+        cache_key = PredictionCache.make_key(image_bytes, service.model_version)
+        cached_result = prediction_cache.get(cache_key)
+        if cached_result is not None:
+            images[index] = (filename, None)
+            cached.append((index, {'filename': filename, 'image_hash': PredictionCache.image_hash(cache_key), **cached_result}))
+        else:
+            pending.append((index, cache_key))
+    
+    if not pending:
+        return cached, pending, None
+    return cached, pending, decode_pool.submit([images[index][1] for index, _ in pending], buffer)
+
+def score_images(service, images):
+    """Yield ``(index, result)`` for each uploaded image as its chunk completes
+
+    ``images`` is a list of ``(filename, bytes)``; the bytes of each image are
+    released as soon as it has been decoded. Cached results are yielded without
+    decoding, the rest of each chunk is decoded on the decode pool and scored in
+    one forward pass. Chunks are double-buffered so the next chunk decodes
+    while the model runs the current one. The whole upload is scored by
+    ``service``, even if another model version is activated meanwhile.
+    """
+    chunk_size = app.config['BATCH_CHUNK_SIZE']
+    starts = list(range(0, len(images), chunk_size))
+    buffers = [allocate_batch(min(chunk_size, len(images))) for _ in range(min(2, len(starts)))]
+    
+    def start(chunk_number):
+        first = starts[chunk_number]
+        last = min(first + chunk_size, len(images))
+        return start_chunk(service, images, first, last, buffers[chunk_number % len(buffers)])
+    
+    upcoming = start(0)
+    for chunk_number in range(len(starts)):
+        cached, pending, pending_batch = upcoming
+        # Kick off decoding of the next chunk before this one reaches the model
+        if chunk_number + 1 < len(starts):
+            upcoming = start(chunk_number + 1)
+        
+        cache_lookups.inc(len(cached), result='hit')
+        for index, result in cached:
+            predictions_total.inc(predicted_class=result['prediction'], model_version=result['model_version'])
+            yield index, result
+        if pending_batch is None:
+            continue
+        
+        cache_lookups.inc(len(pending), result='miss')
+        with stage_seconds.time(stage='decode'):
+            batch, ok = pending_batch.result()
+        decoded = []
+        for (index, cache_key), decoded_ok in zip(pending, ok):
+            filename = images[index][0]
+            images[index] = (filename, None)
+            if decoded_ok:
+                decoded.append((index, cache_key, filename))
+            else:
+                prediction_errors.inc(error='decode_error')
+                yield index, {'filename': filename, 'error': 'Error processing image'}
+        if not decoded:
+            continue
+        
+        # One forward pass per chunk
+        with stage_seconds.time(stage='inference'), trace_forward_pass(service):
+            probabilities = service.predict(batch if ok.all() else batch[ok])
+        inference_batch_size.observe(len(decoded))
+        for (index, cache_key, filename), row in zip(decoded, probabilities):
+            result = format_prediction(row, service.model_version)
+            predictions_total.inc(predicted_class=result['prediction'], model_version=service.model_version)
+            prediction_cache.put(cache_key, result)
+            yield index, {'filename': filename, 'image_hash': PredictionCache.image_hash(cache_key), **result}
+
+def wants_stream():
+    """Return 'sse', 'ndjson' or None depending on what the client asked for"""
+    stream = request.args.get('stream', '').lower()
+    if stream == 'sse' or request.accept_mimetypes.best == 'text/event-stream':
+        return 'sse'
+    if stream in ('1', 'true', 'ndjson') or request.accept_mimetypes.best == 'application/x-ndjson':
+        return 'ndjson'
+    return None
+
+@app.route('/api/predict/batch', methods=['POST'])
+@jwt_required()
+def predict_batch():
+    """Predict kidney anomalies for every image of a multi-file or archive upload"""
+    try:
+        with stage_seconds.time(stage='upload_read'):
+            files = request.files.getlist('images')
+        if not files:
+            return prediction_error('missing_image', 'No image files provided', 400)
+        
+        service = model_registry.active
+        if not service.load():
+            return prediction_error('model_unavailable', 'Model not loaded. Please contact administrator.', 500)
         
-        return jsonify(result), 200
+        try:
+            with stage_seconds.time(stage='upload_read'):
+                images = expand_uploads(
+                    files,
+                    max_files=app.config['BATCH_MAX_FILES'],
+                    max_member_size=app.config['MAX_IMAGE_SIZE'],
+                    max_total_size=app.config['BATCH_MAX_BYTES']
+                )
+        except StudyUploadError as e:
+            return prediction_error('invalid_upload', str(e), 400)
+        
+        if not images:
+            return prediction_error('missing_image', 'No images found in upload', 400)
+        
+        owner = get_jwt_identity()
+        aggregator = StudyAggregator(CLASS_LABELS)
+        stream = wants_stream()
+        if stream is None:
+            results = [None] * len(images)
+            for index, result in score_images(service, images):
+                aggregator.add(result)
+                results[index] = result
+            record_history(owner, results)
+            
+            return serialize({
+                'results': results,
+                'study': aggregator.summary(),
+                'model_version': service.model_version
+            }), 200
+        
+        # Stream one record per image as each chunk completes, then the study summary
+        chunk_size = app.config['BATCH_CHUNK_SIZE']
+        def generate():
+            scored = []
+            try:
+                for index, result in score_images(service, images):
+                    aggregator.add(result)
+                    scored.append(result)
+                    record = json.dumps({'index': index, **result})
+                    yield f"data: {record}\n\n" if stream == 'sse' else record + '\n'
+                    # Record each chunk as it's sent rather than the whole upload at the end
+                    if len(scored) == chunk_size:
+                        record_history(owner, scored)
+                        scored = []
+                summary = json.dumps({'study': aggregator.summary(), 'model_version': service.model_version})
+                yield f"event: study\ndata: {summary}\n\n" if stream == 'sse' else summary + '\n'
+            except Exception as e:
+                prediction_errors.inc(error=type(e).__name__)
+                error = json.dumps({'error': str(e)})
+                yield f"event: error\ndata: {error}\n\n" if stream == 'sse' else error + '\n'
+            finally:
+                # Also when the client disconnects: what was scored is history
+                record_history(owner, scored)
+        
+        mimetype = 'text/event-stream' if stream == 'sse' else 'application/x-ndjson'
+        return Response(stream_with_context(generate()), mimetype=mimetype)
+    
+    except Exception as e:
+        return prediction_error(type(e).__name__, str(e), 500)
+
+def analyze_images(owner, job_id, images, progress):
+    """Score the images of an analysis job with the model active when it starts
+
+    Returns the job's result, shaped like a ``/api/predict/batch`` response.
+    """
+    service = model_registry.active
+    if not service.load():
+        raise RuntimeError('Model not loaded. Please contact administrator.')
+    
+    aggregator = StudyAggregator(CLASS_LABELS)
+    results = [None] * len(images)
+    # Jobs run outside any request; score_images needs an application context
+    with app.app_context():
+        for done, (index, result) in enumerate(score_images(service, images), 1):
+            aggregator.add(result)
+            results[index] = result
+            progress(done)
+    record_history(owner, results, job_id)
+    return {
+        'results': results,
+        'study': aggregator.summary(),
+        'model_version': service.model_version
+    }
+
+@app.route('/api/jobs', methods=['POST'])
+@jwt_required()
+def submit_job():
+    """Queue an analysis of the uploaded images and return its job at once"""
+    try:
+        with stage_seconds.time(stage='upload_read'):
+            files = request.files.getlist('images') + request.files.getlist('image')
+        if not files:
+            return prediction_error('missing_image', 'No image files provided', 400)
+        
+        if not model_registry.active.load():
+            return prediction_error('model_unavailable', 'Model not loaded. Please contact administrator.', 500)
+        
+        try:
+            with stage_seconds.time(stage='upload_read'):
+                images = expand_uploads(
+                    files,
+                    max_files=app.config['BATCH_MAX_FILES'],
+                    max_member_size=app.config['MAX_IMAGE_SIZE'],
+                    max_total_size=app.config['BATCH_MAX_BYTES']
+                )
+        except StudyUploadError as e:
+            return prediction_error('invalid_upload', str(e), 400)
+        
+        if not images:
+            return prediction_error('missing_image', 'No images found in upload', 400)
+        
+        owner = get_jwt_identity()
+        job_id = job_queue.submit(
+            owner, lambda job_id, progress: analyze_images(owner, job_id, images, progress), total=len(images)
+        )
+        return jsonify(describe_job(job_queue.get(job_id, owner))), 202, {'Location': f'/api/jobs/{job_id}'}
+    
+    except JobQueueFullError as e:
+        analysis_jobs.inc(status='rejected')
+        return retry_later(str(e), 5, status=503)
+    except Exception as e:
+        return prediction_error(type(e).__name__, str(e), 500)
+
+def poll_jobs(job_ids):
+    """Poll the current user's ``job_ids``, long-polling for ``?wait=<seconds>``
+
+    Returns the jobs and the headers of the response: a ``Retry-After`` when
+    the poll couldn't wait because too many others already are.
+    """
+    wait = request.args.get('wait', 0, type=float)
+    wait = min(wait, app.config['JOB_MAX_WAIT']) if wait > 0 else 0
+    jobs, waited = job_queue.poll(job_ids, get_jwt_identity(), wait=wait)
+    return jobs, ({} if waited else {'Retry-After': '5'})
+
+@app.route('/api/jobs', methods=['GET'])
+@jwt_required()
+def list_jobs():
+    """The current user's recent analysis jobs, newest first (``?active=1``: only unfinished ones)
+
+    ``?ids=<id>,<id>`` returns just those jobs instead; with ``?wait=<seconds>``
+    it long-polls until one of them finishes, so a client follows all its
+    jobs with one request.
+    """
+    try:
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        if request.args.get('ids'):
+            jobs, headers = poll_jobs(request.args['ids'].split(',')[:limit])
+            jobs.sort(key=lambda job: job['created_at'], reverse=True)
+            return jsonify({'jobs': [describe_job(job) for job in jobs]}), 200, headers
+        
+        jobs = job_queue.list(get_jwt_identity(), limit, unfinished_only=request.args.get('active') == '1')
+        return jsonify({'jobs': [describe_job(job) for job in jobs]}), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    """Status and result of an analysis job; ``?wait=<seconds>`` long-polls until it finishes"""
+    try:
+        jobs, headers = poll_jobs([job_id])
+        if not jobs:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(describe_job(jobs[0])), 200, headers
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/results', methods=['GET'])
+@jwt_required()
+def list_results():
+    """A page of the current user's prediction history, newest first
+
+    ``?limit=`` sets the page size (at most 200), ``?before=<id>`` continues
+    from the ``next_before`` of the previous page and ``?prediction=`` keeps
+    one predicted class.
+    """
+    try:
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        results, next_before = result_store.page(
+            get_jwt_identity(),
+            limit=limit,
+            before=request.args.get('before', type=int),
+            predicted_class=request.args.get('prediction')
+        )
+        return jsonify({'results': results, 'next_before': next_before}), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/results/summary', methods=['GET'])
+@jwt_required()
+def results_summary():
+    """Totals of the current user's prediction history for the dashboard"""
+    try:
+        return jsonify(result_store.summary(get_jwt_identity(), CLASS_LABELS)), 200
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -166,7 +780,7 @@ def get_profile():
     """Get user profile"""
     try:
         current_user_email = get_jwt_identity()
-        user = users.get(current_user_email)
+        user = user_store.get(current_user_email)
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -179,13 +793,70 @@ def get_profile():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/models', methods=['GET'])
+@jwt_required()
+def list_models():
+    """List the available model versions and the active one"""
+    try:
+        return jsonify({
+            'models': model_registry.available(),
+            **model_registry.status()
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/models/activate', methods=['POST'])
+@jwt_required()
+def activate_model():
+    """Load a model version in the background and swap it in once warmed up"""
+    try:
+        if not is_admin(get_jwt_identity()):
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        data = request.get_json() or {}
+        version = data.get('version')
+        if not version:
+            return jsonify({'error': 'Missing model version'}), 400
+        
+        if not model_registry.activate(version, wait=bool(data.get('wait'))):
+            return jsonify({'error': f"Unknown model version '{version}'"}), 404
+        
+        return jsonify(model_registry.status()), 202
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
+    service = model_registry.active
     return jsonify({
         'status': 'healthy',
-        'model_loaded': model is not None
+        'model_loaded': service.loaded,
+        'model_ready': service.ready,
+        'model_version': service.model_version,
+        'model_loading_version': model_registry.status()['loading_version'],
+        'inference_backend': service.backend,
+        'inference_mode': service.mode,
+        'batching': batcher.stats(),
+        'cache': prediction_cache.stats()
     }), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics of every worker process"""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """Readiness endpoint: 200 only once the model is loaded and warmed up"""
+    service = model_registry.active
+    if not service.ready:
+        return jsonify({'ready': False, 'reason': 'Model warming up'}), 503
+    if not service.loaded:
+        return jsonify({'ready': False, 'reason': 'Model not loaded'}), 503
+    return jsonify({'ready': True, 'model_version': service.model_version}), 200
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=4000)
@@ -0,0 +1,103 @@
+"""
+Password hashing and login rate limiting, kept off the request hot path.
+
+Password hashes are deliberately expensive: hundreds of milliseconds of CPU
+each. ``PasswordHasher`` runs them on a small dedicated pool of threads
+(hashlib releases the GIL while hashing), with a bounded number of hashes
+allowed to queue. A burst of logins therefore uses at most ``max_workers``
+cores, and attempts beyond the queue are turned away at once instead of
+tying up every request thread that ``/api/predict`` needs.
+
+``RateLimiter`` additionally caps attempts per account and per client
+address. Its buckets live in the process, so every server worker enforces
+the limit on its own.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from thread_pool import LazyThreadPool
+
+
+class HasherBusyError(RuntimeError):
+    """Raised when the password hashing queue is full or a hash takes too long"""
+
+
+class PasswordHasher:
+    """Hash and verify passwords on a bounded, dedicated thread pool
+
+    ``method`` is a werkzeug hash method including its cost parameters, e.g.
+    ``pbkdf2:sha256:600000`` or ``scrypt:32768:8:1``.
+    """
+
+    def __init__(self, method='pbkdf2:sha256:600000', max_workers=1, max_pending=2, timeout=30):
+        self.method = method
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._pool = LazyThreadPool(max_workers, thread_name_prefix='password-hash')
+        self._prefix = None
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusyError('Too many authentication requests, please retry shortly')
+        try:
+            future = self._pool.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HasherBusyError('Authentication timed out, please retry shortly')
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True when ``password_hash`` was made with a different method or cost"""
+        if self._prefix is None:
+            self._prefix = self.hash('').split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+
+class RateLimiter:
+    """Token bucket per key: ``limit`` attempts per ``period`` seconds, refilled continuously
+
+    A ``limit`` of 0 disables the limiter. At most ``max_keys`` buckets are
+    kept; the least recently used ones are dropped first.
+    """
+
+    def __init__(self, limit, period=60.0, max_keys=100000):
+        self.limit = limit
+        self.period = period
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """Record an attempt for ``key``; returns 0 if allowed, else seconds until the next one is"""
+        if not self.limit:
+            return 0.0
+        now = time.monotonic()
+        rate = self.limit / self.period
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.limit, now))
+            tokens = min(self.limit, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0.0
+            else:
+                retry_after = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
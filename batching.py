@@ -0,0 +1,202 @@
+"""
+Dynamic micro-batching for model inference.
+
+Concurrent requests submit single preprocessed images; a background worker
+collects them into one batch (up to ``max_batch_size`` images or until
+``max_wait_ms`` has elapsed since the first queued image), runs a single
+forward pass and hands each caller back its own row of the output.
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class _PendingItem:
+    __slots__ = ('array', 'future', 'enqueued_at')
+
+    def __init__(self, array, future):
+        self.array = array
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """Collect in-flight inference requests into batched forward passes
+
+    With ``with_metadata=True``, ``predict_fn`` returns ``(outputs, metadata)``
+    and every caller receives ``(row, metadata)`` (e.g. the model version that
+    produced the batch). ``on_batch``, if given, is called after every
+    successful forward pass with the queue wait of each item and the seconds
+    spent in ``predict_fn``.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10.0,
+                 max_queue_size=1024, stats_window=1000, with_metadata=False, on_batch=None):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be at least 1')
+
+        self.predict_fn = predict_fn
+        self.with_metadata = with_metadata
+        self.on_batch = on_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._worker = None
+        self._worker_pid = None
+        self._worker_lock = threading.Lock()
+        self._stopped = False
+
+        self._stats_lock = threading.Lock()
+        self._total_batches = 0
+        self._total_items = 0
+        self._max_batch_seen = 0
+        self._batch_sizes = deque(maxlen=stats_window)
+        self._queue_waits = deque(maxlen=stats_window)
+
+    def _ensure_worker(self):
+        """Start the worker thread on first use (and again after a fork)"""
+        pid = os.getpid()
+        if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+            return
+
+        with self._worker_lock:
+            if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+                return
+            if self._worker_pid != pid:
+                # Threads do not survive fork(); anything queued belonged to the parent
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._worker = threading.Thread(
+                target=self._run, name='micro-batcher', daemon=True
+            )
+            self._worker_pid = pid
+            self._worker.start()
+
+    def submit_async(self, array):
+        """Queue one preprocessed image and return a Future for its output row
+
+        ``array`` may be a single image (H, W, C) or a batch of one (1, H, W, C).
+        """
+        if self._stopped:
+            raise RuntimeError('MicroBatcher has been shut down')
+
+        if array.ndim == 4:
+            if array.shape[0] != 1:
+                raise ValueError('submit one image at a time')
+            array = array[0]
+
+        self._ensure_worker()
+        future = Future()
+        self._queue.put(_PendingItem(array, future))
+        return future
+
+    def submit(self, array, timeout=None):
+        """Queue one preprocessed image and block until its prediction is ready"""
+        return self.submit_async(array).result(timeout=timeout)
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Shutdown sentinel: finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+
+            started = time.perf_counter()
+            # Skip callers that gave up before their batch ran
+            batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            self._record(batch, started)
+            try:
+                inputs = np.stack([item.array for item in batch])
+                if self.with_metadata:
+                    outputs, metadata = self.predict_fn(inputs)
+                else:
+                    outputs = self.predict_fn(inputs)
+                outputs = np.asarray(outputs)
+            except Exception as e:
+                for item in batch:
+                    item.future.set_exception(e)
+                continue
+
+            if self.on_batch is not None:
+                self.on_batch([started - item.enqueued_at for item in batch], time.perf_counter() - started)
+
+            for i, item in enumerate(batch):
+                item.future.set_result((outputs[i], metadata) if self.with_metadata else outputs[i])
+
+    def _record(self, batch, started):
+        with self._stats_lock:
+            self._total_batches += 1
+            self._total_items += len(batch)
+            self._max_batch_seen = max(self._max_batch_seen, len(batch))
+            self._batch_sizes.append(len(batch))
+            for item in batch:
+                self._queue_waits.append(started - item.enqueued_at)
+
+    def stats(self):
+        """Return batch-size and queue-wait statistics"""
+        with self._stats_lock:
+            sizes = list(self._batch_sizes)
+            waits = sorted(self._queue_waits)
+            total_batches = self._total_batches
+            total_items = self._total_items
+            max_batch_seen = self._max_batch_seen
+
+        def percentile(values, pct):
+            if not values:
+                return 0.0
+            index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+            return values[index] * 1000.0
+
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'queue_depth': self._queue.qsize(),
+            'total_batches': total_batches,
+            'total_requests': total_items,
+            'mean_batch_size': (total_items / total_batches) if total_batches else 0.0,
+            'recent_mean_batch_size': (sum(sizes) / len(sizes)) if sizes else 0.0,
+            'largest_batch': max_batch_seen,
+            'queue_wait_ms': {
+                'mean': (sum(waits) / len(waits) * 1000.0) if waits else 0.0,
+                'p50': percentile(waits, 50),
+                'p95': percentile(waits, 95),
+                'p99': percentile(waits, 99),
+                'max': percentile(waits, 100),
+            },
+        }
+
+    def shutdown(self, wait=True):
+        """Stop the worker after it drains the requests already queued"""
+        self._stopped = True
+        if self._worker is not None and self._worker.is_alive():
+            self._queue.put(None)
+            if wait:
+                self._worker.join()
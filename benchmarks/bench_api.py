@@ -0,0 +1,370 @@
+"""
+Load-test the HTTP API end to end and write the results as diffable JSON.
+
+A gunicorn server (``app:app`` with ``gunicorn.conf.py``, as in production)
+is started in a scratch directory with its own user database and, unless
+``--model-path`` is given, the untrained model from ``create_demo_model.py``,
+so the benchmark needs no data and no network. Closed-loop clients then drive
+``/api/login`` and ``/api/predict`` at every ``--concurrency`` level, the
+latter with synthetic CT-like slices of every ``--image-sizes`` size. Each
+scenario reports throughput, p50/p95/p99 latency, the responses that weren't
+200 and the peak RSS of the server (master and workers).
+
+The prediction cache is disabled and rate limiting is off, so every request
+does the full work; any other setting can be overridden with ``--env``. Run
+it before and after a change and compare the two files with ``--compare``:
+
+    python benchmarks/bench_api.py --output before.json
+    python benchmarks/bench_api.py --output after.json --compare before.json
+
+Usage:
+    python benchmarks/bench_api.py --concurrency 1,4,8 --image-sizes 224,512,1024 --requests 200
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import numpy as np
+from PIL import Image
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOGIN = {'email': 'admin@example.com', 'password': 'admin123'}
+
+
+def request(url, body=None, headers=None):
+    """Return ``(status, seconds)`` for one HTTP request"""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, body, headers or {}), timeout=300) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - start
+
+
+def multipart_image(image_bytes, filename='slice.png'):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+        f'Content-Type: image/png\r\n\r\n'
+    ).encode() + image_bytes + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def make_images(size, count, seed):
+    """``count`` distinct synthetic PNG slices of ``size`` x ``size`` pixels"""
+    rng = np.random.default_rng(seed + size)
+    images = []
+    for _ in range(count):
+        base = rng.integers(0, 256, size=(max(1, size // 8), max(1, size // 8)), dtype=np.uint8)
+        png = io.BytesIO()
+        Image.fromarray(base).resize((size, size), Image.BILINEAR).convert('RGB').save(png, 'PNG')
+        images.append(png.getvalue())
+    return images
+
+
+def tree_rss_mb(pid):
+    """Resident memory of ``pid`` and all its descendants (Linux only, else None)"""
+    parents = {}
+    try:
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The command name may contain spaces; fields resume after its ')'
+                    parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    except OSError:
+        return None
+
+    pids, frontier = {pid}, [pid]
+    while frontier:
+        parent = frontier.pop()
+        children = [child for child, ppid in parents.items() if ppid == parent and child not in pids]
+        pids.update(children)
+        frontier.extend(children)
+
+    total_kb = 0
+    for process in pids:
+        try:
+            with open(f'/proc/{process}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total_kb / 1024.0
+
+
+class RssSampler:
+    """Track the peak RSS of the server's process tree from a background thread"""
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        rss = tree_rss_mb(self.pid)
+        if rss is not None:
+            self.peak_mb = rss if self.peak_mb is None else max(self.peak_mb, rss)
+        return rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.peak_mb = None
+        self.sample()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def create_model(workdir):
+    """Build the demo model in ``workdir`` and return its path"""
+    subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, 'create_demo_model.py')],
+        cwd=workdir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        env=dict(os.environ, TF_CPP_MIN_LOG_LEVEL='3')
+    )
+    return os.path.join(workdir, 'models', 'kidney_anomaly_model.h5')
+
+
+def start_server(port, model_path, args, workdir, overrides):
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_DIR,
+        PORT=str(port),
+        HOST='127.0.0.1',
+        GUNICORN_WORKERS=str(args.workers),
+        GUNICORN_THREADS=str(args.threads),
+        MODEL_PATH=os.path.abspath(model_path),
+        USER_DB_URL=f"sqlite:///{os.path.join(workdir, 'users.db')}",
+        METRICS_DIR=os.path.join(workdir, 'metrics'),
+        PROFILE_DIR=os.path.join(workdir, 'profiles'),
+        CACHE_MAX_ENTRIES='0',
+        LOGIN_RATE_PER_ACCOUNT='0',
+        LOGIN_RATE_PER_IP='0',
+        TF_CPP_MIN_LOG_LEVEL='3',
+    )
+    env.update(overrides)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'), 'app:app'],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        try:
+            if request(f'http://127.0.0.1:{port}/api/ready')[0] == 200:
+                return server
+        except OSError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.5)
+    server.kill()
+    raise RuntimeError('Server did not become ready')
+
+
+def run_scenario(send, concurrency, requests, sampler):
+    """Send ``requests`` requests from ``concurrency`` closed-loop clients; ``send(i)`` returns (status, seconds)"""
+    latencies, statuses = [], {}
+    next_request = iter(range(requests))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                i = next(next_request, None)
+            if i is None:
+                return
+            status, seconds = send(i)
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(seconds)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    with sampler:
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    result = {
+        'concurrency': concurrency,
+        'requests': requests,
+        'ok': statuses.get(200, 0),
+        'errors': {str(status): count for status, count in sorted(statuses.items()) if status != 200},
+        'seconds': elapsed,
+        'throughput_per_sec': statuses.get(200, 0) / elapsed,
+        'peak_rss_mb': sampler.peak_mb,
+    }
+    if latencies:
+        values = np.array(latencies) * 1000
+        result.update({
+            'mean_ms': float(values.mean()),
+            'p50_ms': float(np.percentile(values, 50)),
+            'p95_ms': float(np.percentile(values, 95)),
+            'p99_ms': float(np.percentile(values, 99)),
+        })
+    return result
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return {'commit': commit.stdout.strip(), 'dirty': bool(dirty.stdout.strip())}
+
+
+def scenario_key(scenario):
+    return (scenario['endpoint'], scenario.get('image_size'), scenario['concurrency'])
+
+
+def print_results(scenarios, baseline=None):
+    baseline = {scenario_key(scenario): scenario for scenario in (baseline or [])}
+    print(f"{'endpoint':<10}{'size':>6}{'conc':>6}{'req/s':>9}{'p50':>10}{'p95':>10}{'p99':>10}"
+          f"{'errors':>8}{'peak RSS':>11}{'  vs baseline (req/s, p95)' if baseline else ''}")
+    for scenario in scenarios:
+        line = (f"{scenario['endpoint']:<10}{scenario.get('image_size') or '-':>6}{scenario['concurrency']:>6}"
+                f"{scenario['throughput_per_sec']:>9.1f}{scenario.get('p50_ms', 0):>8.1f}ms"
+                f"{scenario.get('p95_ms', 0):>8.1f}ms{scenario.get('p99_ms', 0):>8.1f}ms"
+                f"{sum(scenario['errors'].values()):>8}{scenario['peak_rss_mb'] or 0:>9.0f}MB")
+        before = baseline.get(scenario_key(scenario))
+        if before is not None and before['throughput_per_sec'] and before.get('p95_ms'):
+            throughput = scenario['throughput_per_sec'] / before['throughput_per_sec'] - 1
+            p95 = scenario.get('p95_ms', 0) / before['p95_ms'] - 1
+            line += f"  {throughput:+8.1%} {p95:+8.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test /api/login and /api/predict on a local server')
+    parser.add_argument('--model-path', help='Model to serve (default: a fresh create_demo_model.py model)')
+    parser.add_argument('--workers', type=int, default=1, help='GUNICORN_WORKERS')
+    parser.add_argument('--threads', type=int, default=8, help='GUNICORN_THREADS')
+    parser.add_argument('--concurrency', default='1,4,8', help='Concurrent clients per scenario')
+    parser.add_argument('--image-sizes', default='224,512,1024', help='Square slice sizes to upload')
+    parser.add_argument('--requests', type=int, default=200, help='Predict requests per scenario')
+    parser.add_argument('--login-requests', type=int, default=20, help='Login requests per scenario (0 skips logins)')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured predict requests per image size')
+    parser.add_argument('--images', type=int, default=16, help='Distinct images per size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='Extra server environment, e.g. --env BATCH_MAX_SIZE=32 (repeatable)')
+    parser.add_argument('--port', type=int, default=4200)
+    parser.add_argument('--output', default='bench_api.json', help='Where to write the results')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    concurrency_levels = [int(value) for value in args.concurrency.split(',')]
+    image_sizes = [int(value) for value in args.image_sizes.split(',')]
+    overrides = dict(value.split('=', 1) for value in args.env)
+    base_url = f'http://127.0.0.1:{args.port}'
+
+    scenarios = []
+    with tempfile.TemporaryDirectory() as workdir:
+        model_path = args.model_path or create_model(workdir)
+        server = start_server(args.port, model_path, args, workdir, overrides)
+        try:
+            sampler = RssSampler(server.pid)
+            idle_rss_mb = sampler.sample()
+
+            login_body = json.dumps(LOGIN).encode()
+            login_headers = {'Content-Type': 'application/json'}
+            with urllib.request.urlopen(urllib.request.Request(f'{base_url}/api/login', login_body, login_headers)) as f:
+                token = json.load(f)['access_token']
+
+            if args.login_requests:
+                for concurrency in concurrency_levels:
+                    result = run_scenario(
+                        lambda i: request(f'{base_url}/api/login', login_body, login_headers),
+                        concurrency, args.login_requests, sampler
+                    )
+                    scenarios.append({'endpoint': 'login', **result})
+
+            for size in image_sizes:
+                # Each request carries its own multipart body, built outside the timed loop
+                uploads = [multipart_image(image) for image in make_images(size, args.images, args.seed)]
+                requests = [
+                    (body, {'Authorization': f'Bearer {token}', 'Content-Type': content_type})
+                    for body, content_type in uploads
+                ]
+
+                def send(i):
+                    return request(f'{base_url}/api/predict', *requests[i % len(requests)])
+
+                for i in range(args.warmup):
+                    send(i)
+                for concurrency in concurrency_levels:
+                    result = run_scenario(send, concurrency, args.requests, sampler)
+                    scenarios.append({'endpoint': 'predict', 'image_size': size,
+                                      'upload_bytes': int(np.mean([len(body) for body, _ in requests])), **result})
+        finally:
+            server.terminate()
+            server.wait()
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'revision': git_revision(),
+        'platform': {
+            'python': platform.python_version(),
+            'system': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {
+            'model_path': args.model_path or 'create_demo_model.py',
+            'workers': args.workers,
+            'threads': args.threads,
+            'warmup': args.warmup,
+            'images_per_size': args.images,
+            'seed': args.seed,
+            'env': overrides,
+        },
+        'idle_rss_mb': idle_rss_mb,
+        'scenarios': scenarios,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['scenarios']
+    print_results(scenarios, baseline)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+Measure /api/predict latency while the server is flooded with logins.
+
+For every ``--hash-workers`` setting a fresh gunicorn server (one worker,
+``GUNICORN_THREADS`` request threads) is started on a throwaway user
+database. Predict latency is measured first on its own, then with
+``--login-clients`` threads logging in back to back. A hash-worker count
+equal to the request thread count approximates the old behaviour of hashing
+on every request thread; the default (a quarter of the cores) keeps
+predictions flowing while the surplus logins are answered with 503s, after
+which the login clients back off for the ``Retry-After`` they were given.
+Rate limiting is disabled so that every login reaches the hasher.
+
+Usage:
+    python benchmarks/bench_auth_load.py --model-path models/kidney_anomaly_model.h5 --hash-workers 8,1
+"""
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import numpy as np
+from PIL import Image
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def request(url, body=None, headers=None):
+    """Return ``(status, seconds, retry_after)`` for one HTTP request"""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, body, headers or {}), timeout=120) as response:
+            response.read()
+            status, retry_after = response.status, None
+    except urllib.error.HTTPError as e:
+        status, retry_after = e.code, e.headers.get('Retry-After')
+    return status, time.perf_counter() - start, float(retry_after or 0)
+
+
+def login_body(email, password):
+    return json.dumps({'email': email, 'password': password}).encode(), {'Content-Type': 'application/json'}
+
+
+def multipart_image(image_bytes, filename='slice.png'):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+        f'Content-Type: image/png\r\n\r\n'
+    ).encode() + image_bytes + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def start_server(port, hash_workers, args, workdir):
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_DIR,
+        PORT=str(port),
+        GUNICORN_WORKERS='1',
+        GUNICORN_THREADS=str(args.threads),
+        MODEL_PATH=os.path.abspath(args.model_path),
+        USER_DB_URL=f"sqlite:///{os.path.join(workdir, 'users.db')}",
+        PASSWORD_HASH_METHOD=args.hash_method,
+        PASSWORD_HASH_WORKERS=str(hash_workers),
+        LOGIN_RATE_PER_ACCOUNT='0',
+        LOGIN_RATE_PER_IP='0',
+        TF_CPP_MIN_LOG_LEVEL='3',
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'), 'app:app'],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        try:
+            if request(f'http://127.0.0.1:{port}/api/ready')[0] == 200:
+                return server
+        except OSError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.5)
+    server.kill()
+    raise RuntimeError('Server did not become ready')
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {'count': 0}
+    values = np.array(latencies) * 1000
+    return {
+        'count': len(values),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'p99_ms': float(np.percentile(values, 99)),
+    }
+
+
+def run_phase(base_url, token, image_bytes, predict_clients, login_clients, duration):
+    stop = threading.Event()
+    predict_latencies, predict_errors = [], []
+    login_latencies, login_statuses = [], []
+    body, content_type = multipart_image(image_bytes)
+    headers = {'Authorization': f'Bearer {token}', 'Content-Type': content_type}
+
+    def predictor():
+        while not stop.is_set():
+            status, seconds, _ = request(f'{base_url}/api/predict', body, headers)
+            if status == 200:
+                predict_latencies.append(seconds)
+            else:
+                predict_errors.append(status)
+
+    def login_client():
+        login, login_headers = login_body('admin@example.com', 'admin123')
+        while not stop.is_set():
+            status, seconds, retry_after = request(f'{base_url}/api/login', login, login_headers)
+            login_statuses.append(status)
+            if status == 200:
+                login_latencies.append(seconds)
+            # Back off as asked, like a well-behaved client
+            stop.wait(retry_after)
+
+    threads = [threading.Thread(target=predictor) for _ in range(predict_clients)]
+    threads += [threading.Thread(target=login_client) for _ in range(login_clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'predict': {**percentiles(predict_latencies), 'errors': len(predict_errors)},
+        'login': {
+            **percentiles(login_latencies),
+            'per_sec': login_statuses.count(200) / duration,
+            'rejected_busy': login_statuses.count(503),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark predict latency under concurrent login load')
+    parser.add_argument('--model-path', default='models/kidney_anomaly_model.h5')
+    parser.add_argument('--hash-workers', default='8,1', help='PASSWORD_HASH_WORKERS settings to compare')
+    parser.add_argument('--hash-method', default='pbkdf2:sha256:600000')
+    parser.add_argument('--threads', type=int, default=8, help='GUNICORN_THREADS')
+    parser.add_argument('--predict-clients', type=int, default=2)
+    parser.add_argument('--login-clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per phase')
+    parser.add_argument('--port', type=int, default=4100)
+    parser.add_argument('--output', help='Also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    png = io.BytesIO()
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (512, 512, 3), dtype=np.uint8)).save(png, 'PNG')
+    image_bytes = png.getvalue()
+
+    results = {}
+    for hash_workers in [int(value) for value in args.hash_workers.split(',')]:
+        with tempfile.TemporaryDirectory() as workdir:
+            server = start_server(args.port, hash_workers, args, workdir)
+            try:
+                base_url = f'http://127.0.0.1:{args.port}'
+                login, login_headers = login_body('admin@example.com', 'admin123')
+                with urllib.request.urlopen(urllib.request.Request(f'{base_url}/api/login', login, login_headers)) as f:
+                    token = json.load(f)['access_token']
+
+                results[hash_workers] = {
+                    'idle': run_phase(base_url, token, image_bytes, args.predict_clients, 0, args.duration),
+                    'login_storm': run_phase(base_url, token, image_bytes, args.predict_clients,
+                                             args.login_clients, args.duration),
+                }
+            finally:
+                server.terminate()
+                server.wait()
+
+    print(f"{'hash workers':<14}{'phase':<13}{'predict p50':>12}{'p95':>9}{'p99':>9}{'logins/s':>10}{'503s':>7}")
+    for hash_workers, phases in results.items():
+        for phase, result in phases.items():
+            predict = result['predict']
+            print(f"{hash_workers:<14}{phase:<13}{predict.get('p50_ms', 0):>10.1f}ms{predict.get('p95_ms', 0):>7.1f}ms"
+                  f"{predict.get('p99_ms', 0):>7.1f}ms{result['login']['per_sec']:>10.1f}{result['login']['rejected_busy']:>7}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark the eager (model.predict) and compiled (tf.function) inference paths.
+
+Usage:
+    python benchmarks/bench_inference.py --model models/kidney_anomaly_model.h5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tensorflow as tf
+
+from inference import INFERENCE_MODES, build_inference_fn, warmup
+
+
+def time_path(inference_fn, batch_size, iterations):
+    """Return per-call latencies in seconds for one batch size"""
+    batch = np.random.rand(batch_size, 224, 224, 3).astype(np.float32)
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        inference_fn(batch)
+        latencies.append(time.perf_counter() - start)
+    return np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare eager and compiled inference latency')
+    parser.add_argument('--model', default='models/kidney_anomaly_model.h5')
+    parser.add_argument('--batch-sizes', default='1,4,16', help='Comma separated batch sizes')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--xla', action='store_true', help='Also benchmark the XLA-compiled path')
+    args = parser.parse_args()
+
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+    model = tf.keras.models.load_model(args.model)
+
+    paths = [(mode, mode, False) for mode in INFERENCE_MODES]
+    if args.xla:
+        paths.append(('compiled+xla', 'compiled', True))
+
+    print(f"{'path':<14}{'batch':>6}{'first call ms':>15}{'p50 ms':>10}{'p95 ms':>10}{'images/s':>12}")
+    for name, mode, jit_compile in paths:
+        inference_fn = build_inference_fn(model, mode=mode, jit_compile=jit_compile)
+        for batch_size in batch_sizes:
+            first_call = warmup(inference_fn, [batch_size]) * 1000.0
+            latencies = time_path(inference_fn, batch_size, args.iterations)
+            p50, p95 = np.percentile(latencies, [50, 95]) * 1000.0
+            throughput = batch_size * args.iterations / latencies.sum()
+            print(f"{name:<14}{batch_size:>6}{first_call:>15.1f}{p50:>10.2f}{p95:>10.2f}{throughput:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
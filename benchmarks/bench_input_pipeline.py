@@ -0,0 +1,126 @@
+"""
+Compare the training input pipelines: ImageDataGenerator vs tf.data.
+
+Reports images/sec for one pass over the training split of each pipeline
+(decode + resize + augmentation, no model), and for tf.data both the first
+epoch (decoding) and a later epoch (served from the cache). The tf.data
+pipeline is also run over preprocessed shards (see ``dataset_shards.py``),
+whose first epoch needs no decoding. Without ``--data-dir`` a synthetic
+``<class>/`` tree of CT-like images is generated.
+
+Usage:
+    python benchmarks/bench_input_pipeline.py --data-dir data/kidney_ct_scans --batch-size 32
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inference import CLASS_LABELS
+
+
+def make_dataset_dir(root, images_per_class, size):
+    """Write ``images_per_class`` synthetic PNG slices for every class under ``root``"""
+    rng = np.random.default_rng(0)
+    for class_name in CLASS_LABELS:
+        class_dir = os.path.join(root, class_name)
+        os.makedirs(class_dir, exist_ok=True)
+        for i in range(images_per_class):
+            base = rng.integers(0, 256, size=(size // 8, size // 8), dtype=np.uint8)
+            img = Image.fromarray(base).resize((size, size), Image.BILINEAR).convert('RGB')
+            img.save(os.path.join(class_dir, f"{i:05d}.png"))
+    return root
+
+
+def time_epoch(batches):
+    """Iterate one epoch and return (images, seconds)"""
+    images = 0
+    start = time.perf_counter()
+    for batch, _ in batches:
+        images += len(batch)
+    return images, time.perf_counter() - start
+
+
+def bench_legacy(data_dir, batch_size):
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+    datagen = ImageDataGenerator(
+        rescale=1./255, rotation_range=20, width_shift_range=0.2, height_shift_range=0.2,
+        shear_range=0.2, zoom_range=0.2, horizontal_flip=True, fill_mode='nearest',
+        validation_split=0.2
+    )
+    generator = datagen.flow_from_directory(
+        data_dir, target_size=(224, 224), batch_size=batch_size,
+        class_mode='categorical', subset='training'
+    )
+    # The generator loops forever; stop after one epoch
+    images, seconds = time_epoch(generator[i] for i in range(len(generator)))
+    return {'epoch_images_per_sec': images / seconds}
+
+
+def bench_tf_data(data_dir, batch_size, epochs):
+    from training_data import prepare_datasets
+
+    train_dataset, _ = prepare_datasets(data_dir, batch_size)
+    rates = []
+    for _ in range(epochs):
+        images, seconds = time_epoch(train_dataset)
+        rates.append(images / seconds)
+    return {
+        'first_epoch_images_per_sec': rates[0],
+        'cached_epoch_images_per_sec': max(rates[1:]) if len(rates) > 1 else None,
+    }
+
+
+def bench_shards(data_dir, shard_dir, batch_size, epochs):
+    from dataset_shards import write_shards
+    from training_data import list_labelled_images
+
+    start = time.perf_counter()
+    write_shards(list_labelled_images(data_dir), shard_dir)
+    result = bench_tf_data(shard_dir, batch_size, epochs)
+    result['conversion_seconds'] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the training input pipelines')
+    parser.add_argument('--data-dir', help='Dataset with <class>/ folders (default: synthetic)')
+    parser.add_argument('--images-per-class', type=int, default=100, help='Synthetic dataset size')
+    parser.add_argument('--size', type=int, default=512, help='Synthetic image edge length in pixels')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--epochs', type=int, default=3, help='tf.data epochs (first one fills the cache)')
+    parser.add_argument('--skip-legacy', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or make_dataset_dir(tmp, args.images_per_class, args.size)
+        print(f"Dataset: {data_dir}, batch size {args.batch_size}, {os.cpu_count()} cores")
+
+        results = {}
+        if not args.skip_legacy:
+            try:
+                results['ImageDataGenerator'] = bench_legacy(data_dir, args.batch_size)
+            except ImportError as e:
+                print(f"Skipping ImageDataGenerator: {e}")
+        results['tf.data'] = bench_tf_data(data_dir, args.batch_size, args.epochs)
+        results['tf.data (shards)'] = bench_shards(data_dir, os.path.join(tmp, 'shards'), args.batch_size, args.epochs)
+        print(f"Shard conversion took {results['tf.data (shards)']['conversion_seconds']:.1f}s")
+
+    print(f"\n{'pipeline':<20}{'epoch 1 images/s':>18}{'cached images/s':>18}")
+    for name, result in results.items():
+        first = result.get('first_epoch_images_per_sec', result.get('epoch_images_per_sec'))
+        cached = result.get('cached_epoch_images_per_sec')
+        cached_text = '-' if cached is None else f"{cached:.1f}"
+        print(f"{name:<20}{first:>18.1f}{cached_text:>18}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Compare the original preprocess_image implementation with preprocessing.py.
+
+Each path runs in its own subprocess so that peak RSS is measured in isolation.
+
+Usage:
+    python benchmarks/bench_preprocess.py --images 200 --size 1024 --batch-size 16
+"""
+
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessing import allocate_batch, preprocess_batch
+
+
+def legacy_preprocess(image_bytes):
+    """The original app.preprocess_image implementation"""
+    img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    img = img.resize((224, 224))
+    img_array = np.array(img) / 255.0
+    return np.expand_dims(img_array, axis=0)
+
+
+def make_images(count, size, fmt):
+    """Synthesise ``count`` CT-like grayscale-ish RGB images of ``size`` pixels"""
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(count):
+        base = rng.integers(0, 256, size=(size // 8, size // 8), dtype=np.uint8)
+        img = Image.fromarray(base).resize((size, size), Image.BILINEAR).convert('RGB')
+        buffer = io.BytesIO()
+        img.save(buffer, format=fmt)
+        images.append(buffer.getvalue())
+    return images
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def run_path(path, args):
+    images = make_images(args.images, args.size, args.format)
+    baseline_rss = peak_rss_mb()
+
+    start = time.perf_counter()
+    if path == 'legacy':
+        for offset in range(0, len(images), args.batch_size):
+            chunk = images[offset:offset + args.batch_size]
+            # Keras would then stack the per-image float64 arrays into a batch
+            np.concatenate([legacy_preprocess(data) for data in chunk]).astype(np.float32)
+    else:
+        buffer = allocate_batch(args.batch_size)
+        for offset in range(0, len(images), args.batch_size):
+            preprocess_batch(images[offset:offset + args.batch_size], out=buffer)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'path': path,
+        'images_per_sec': len(images) / elapsed,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_delta_mb': peak_rss_mb() - baseline_rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark image preprocessing paths')
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--size', type=int, default=1024, help='Source image edge length in pixels')
+    parser.add_argument('--format', default='JPEG', choices=['JPEG', 'PNG'])
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--path', choices=['legacy', 'new'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.path:
+        print(json.dumps(run_path(args.path, args)))
+        return
+
+    print(f"{args.images} {args.format} images of {args.size}x{args.size}, batch size {args.batch_size}")
+    print(f"{'path':<8}{'images/s':>12}{'peak RSS MB':>14}{'RSS delta MB':>14}")
+    for path in ('legacy', 'new'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--path', path, '--images', str(args.images),
+             '--size', str(args.size), '--format', args.format, '--batch-size', str(args.batch_size)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{path:<8}{result['images_per_sec']:>12.1f}{result['peak_rss_mb']:>14.1f}{result['peak_rss_delta_mb']:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Measure app import time and memory for each MODEL_INIT mode.
+
+Every mode runs in a fresh interpreter. ``import`` reproduces the old
+behaviour (TensorFlow imported and the model loaded before the app is
+importable); ``lazy`` and ``background`` defer TensorFlow.
+
+Usage:
+    python benchmarks/bench_startup.py --modes import,lazy,background
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def current_rss_mb():
+    """Resident set size of this process (Linux), falling back to peak RSS"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def measure():
+    """Child process: import app, then time the first auth request and readiness"""
+    sys.path.insert(0, REPO_DIR)
+    baseline_rss = current_rss_mb()
+
+    start = time.perf_counter()
+    import app
+    import_seconds = time.perf_counter() - start
+    import_rss = current_rss_mb()
+    tensorflow_imported = 'tensorflow' in sys.modules
+
+    client = app.app.test_client()
+    start = time.perf_counter()
+    client.post('/api/login', json={'email': 'admin@example.com', 'password': 'admin123'})
+    first_login_seconds = time.perf_counter() - start
+
+    # Time from import until the model is ready to serve (lazy mode loads it now)
+    start = time.perf_counter()
+    app.model_registry.load()
+    ready_seconds = import_seconds + time.perf_counter() - start
+
+    return {
+        'import_seconds': import_seconds,
+        'rss_after_import_mb': import_rss,
+        'rss_delta_mb': import_rss - baseline_rss,
+        'tensorflow_imported_at_import': tensorflow_imported,
+        'first_login_seconds': first_login_seconds,
+        'seconds_until_model_ready': ready_seconds,
+        'rss_after_model_load_mb': current_rss_mb(),
+        'model_loaded': app.model_registry.active.loaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark app startup per MODEL_INIT mode')
+    parser.add_argument('--modes', default='import,lazy,background')
+    parser.add_argument('--output', help='Also write the results as JSON to this file')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure()))
+        return
+
+    results = {}
+    for mode in args.modes.split(','):
+        env = dict(os.environ, MODEL_INIT=mode, TF_CPP_MIN_LOG_LEVEL='3')
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child'],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'mode':<12}{'import s':>10}{'RSS MB':>10}{'1st login s':>13}{'ready s':>10}{'RSS loaded MB':>15}")
+    for mode, result in results.items():
+        print(f"{mode:<12}{result['import_seconds']:>10.2f}{result['rss_after_import_mb']:>10.1f}"
+              f"{result['first_login_seconds']:>13.3f}{result['seconds_until_model_ready']:>10.2f}"
+              f"{result['rss_after_model_load_mb']:>15.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+"""
+Offline bulk scoring of a directory tree of images.
+
+``python bulk_score.py /archive/ct_slices --output scores.csv`` walks the
+given directories recursively and scores every image with the same
+preprocessing and model loading as the server (``DecodePool`` /
+``try_decode_into`` and ``InferenceService``). Images stream through in
+chunks: the next chunk is decoded on the decode pool while the model runs the
+current one, and each chunk's rows are written out as soon as it has been
+scored, so memory stays flat however large the archive is.
+
+An interrupted run continues with ``--resume``, which skips every path
+already in the output. Images that fail to decode are written with an
+``error`` and never stop the run.
+
+Results are written as CSV, or, when the output ends in ``.parquet``, as a
+directory of Parquet part files (requires ``pyarrow``).
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import shutil
+import time
+
+import numpy as np
+
+from decode_pool import POOL_KINDS, DecodePool, plan_threads
+from inference import CLASS_LABELS, INFERENCE_BACKENDS, INFERENCE_MODES, InferenceService
+from preprocessing import allocate_batch
+from study import IMAGE_EXTENSIONS
+
+COLUMNS = (
+    ['path', 'prediction', 'confidence']
+    + [f'prob_{label}' for label in CLASS_LABELS]
+    + ['model_version', 'error']
+)
+PART_FILE = 'part-{:05d}.parquet'
+
+
+def find_images(roots):
+    """Yield the image files under ``roots`` (directories or files), in sorted order"""
+    for root in roots:
+        if os.path.isfile(root):
+            yield root
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+            for name in sorted(filenames):
+                if not name.startswith('.') and name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(dirpath, name)
+
+
+def result_row(path, probabilities, model_version):
+    """Build the output row for one scored image"""
+    predicted_class = int(np.argmax(probabilities))
+    row = {
+        'path': path,
+        'prediction': CLASS_LABELS[predicted_class],
+        'confidence': float(probabilities[predicted_class]),
+        'model_version': model_version,
+        'error': None,
+    }
+    for i, label in enumerate(CLASS_LABELS):
+        row[f'prob_{label}'] = float(probabilities[i])
+    return row
+
+
+def error_row(path, error, model_version):
+    row = dict.fromkeys(COLUMNS)
+    row.update({'path': path, 'model_version': model_version, 'error': error})
+    return row
+
+
+class CsvResults:
+    """Append rows to a CSV file, flushing after every chunk"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def scored_paths(self):
+        """Paths already in the file; a torn last line from a crash is dropped first"""
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+        with open(self.path, newline='') as f:
+            return {row['path'] for row in csv.DictReader(f) if row.get('path')}
+
+    def open(self):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+        if new_file:
+            self._writer.writeheader()
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetResults:
+    """Write rows to a directory of Parquet part files of ``rows_per_file`` rows
+
+    Each part is written to a temporary name and renamed into place, so a
+    crash never leaves a half-written part behind; the rows that were still
+    buffered are simply scored again on resume.
+    """
+
+    def __init__(self, path, rows_per_file=10000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit('Parquet output requires pyarrow (pip install pyarrow)')
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.rows_per_file = rows_per_file
+        self.schema = pa.schema(
+            [('path', pa.string()), ('prediction', pa.string()), ('confidence', pa.float64())]
+            + [(f'prob_{label}', pa.float64()) for label in CLASS_LABELS]
+            + [('model_version', pa.string()), ('error', pa.string())]
+        )
+        self._buffer = []
+
+    def _parts(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if name.startswith('part-') and name.endswith('.parquet'))
+
+    def scored_paths(self):
+        paths = set()
+        for name in self._parts():
+            table = self.pq.read_table(os.path.join(self.path, name), columns=['path'])
+            paths.update(table.column('path').to_pylist())
+        return paths
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+        parts = self._parts()
+        self._next_part = int(parts[-1][len('part-'):-len('.parquet')]) + 1 if parts else 0
+
+    def write(self, rows):
+        self._buffer.extend(rows)
+        if len(self._buffer) >= self.rows_per_file:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        table = self.pa.Table.from_pylist(self._buffer, schema=self.schema)
+        part = os.path.join(self.path, PART_FILE.format(self._next_part))
+        self.pq.write_table(table, part + '.tmp')
+        os.replace(part + '.tmp', part)
+        self._next_part += 1
+        self._buffer = []
+
+    def close(self):
+        self._flush()
+
+
+def open_results(path, rows_per_file=10000):
+    if path.endswith('.parquet'):
+        return ParquetResults(path, rows_per_file)
+    return CsvResults(path)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def score_tree(service, paths, results, decode_pool, batch_size=32, progress_every=1000):
+    """Score ``paths`` with ``service``, writing each chunk's rows to ``results``
+
+    Returns throughput statistics. Chunks are double-buffered: the next chunk
+    decodes on ``decode_pool`` while the model runs the current one.
+    """
+    stats = {'scored': 0, 'failed': 0, 'decode_wait_seconds': 0.0, 'inference_seconds': 0.0, 'write_seconds': 0.0}
+    buffers = [allocate_batch(batch_size) for _ in range(2)]
+    chunks = chunked(paths, batch_size)
+    start = time.perf_counter()
+    next_report = progress_every
+
+    chunk = next(chunks, None)
+    upcoming = (chunk, decode_pool.submit(chunk, buffers[0])) if chunk else None
+    chunk_number = 0
+    while upcoming is not None:
+        chunk, pending = upcoming
+        chunk_number += 1
+        following = next(chunks, None)
+        # Kick off decoding of the next chunk before this one reaches the model
+        upcoming = (following, decode_pool.submit(following, buffers[chunk_number % 2])) if following else None
+
+        waited = time.perf_counter()
+        batch, ok = pending.result()
+        stats['decode_wait_seconds'] += time.perf_counter() - waited
+
+        probabilities = iter(())
+        if ok.any():
+            inferred = time.perf_counter()
+            probabilities = iter(service.predict(batch if ok.all() else batch[ok]))
+            stats['inference_seconds'] += time.perf_counter() - inferred
+        rows = [
+            result_row(path, next(probabilities), service.model_version) if decoded_ok
+            else error_row(path, 'Error processing image', service.model_version)
+            for path, decoded_ok in zip(chunk, ok)
+        ]
+
+        written = time.perf_counter()
+        results.write(rows)
+        stats['write_seconds'] += time.perf_counter() - written
+
+        stats['scored'] += int(ok.sum())
+        stats['failed'] += int(len(ok) - ok.sum())
+        done = stats['scored'] + stats['failed']
+        if progress_every and done >= next_report:
+            elapsed = time.perf_counter() - start
+            print(f"{done} images in {elapsed:.1f}s ({done / elapsed:.1f} images/sec), {stats['failed']} failed")
+            next_report += progress_every
+
+    stats['seconds'] = time.perf_counter() - start
+    total = stats['scored'] + stats['failed']
+    stats['images_per_sec'] = total / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    return stats
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description='Score every image under one or more directories')
+    parser.add_argument('roots', nargs='+', help='Directories (searched recursively) or image files')
+    parser.add_argument('--output', default='scores.csv', help='CSV file, or a directory ending in .parquet')
+    parser.add_argument('--model', default=os.environ.get('MODEL_PATH', 'models/kidney_anomaly_model.h5'))
+    parser.add_argument('--backend', choices=INFERENCE_BACKENDS, default=None,
+                        help="Inference backend (default: from the model file's extension)")
+    parser.add_argument('--mode', choices=INFERENCE_MODES, default='compiled')
+    parser.add_argument('--batch-size', type=int, default=32, help='Images per forward pass')
+    parser.add_argument('--decode-workers', type=int, default=max(1, cpu_count // 4))
+    parser.add_argument('--decode-pool', choices=POOL_KINDS, default='thread')
+    parser.add_argument('--intra-op-threads', type=int, default=max(1, cpu_count - max(1, cpu_count // 4)))
+    parser.add_argument('--inter-op-threads', type=int, default=0)
+    parser.add_argument('--rows-per-file', type=int, default=10000, help='Rows per Parquet part file')
+    parser.add_argument('--progress-every', type=int, default=1000, help='Print progress every N images (0 disables)')
+    parser.add_argument('--resume', action='store_true', help='Skip images already in the output')
+    parser.add_argument('--overwrite', action='store_true', help='Replace an existing output')
+    args = parser.parse_args()
+
+    if os.path.exists(args.output) and not (args.resume or args.overwrite):
+        parser.error(f"{args.output} already exists; pass --resume to continue it or --overwrite to replace it")
+    if args.overwrite and os.path.exists(args.output):
+        if os.path.isdir(args.output):
+            shutil.rmtree(args.output)
+        else:
+            os.remove(args.output)
+
+    results = open_results(args.output, args.rows_per_file)
+    done = results.scored_paths() if args.resume else set()
+    if done:
+        print(f"Resuming: {len(done)} images already in {args.output}")
+
+    plan_threads(cpu_count, args.decode_workers, args.intra_op_threads, args.inter_op_threads)
+    service = InferenceService(
+        args.model,
+        mode=args.mode,
+        max_batch_size=args.batch_size,
+        intra_op_threads=args.intra_op_threads,
+        inter_op_threads=args.inter_op_threads,
+        backend=args.backend,
+    )
+    if not service.load():
+        raise SystemExit(f"Could not load {args.model}: {service.load_error}")
+
+    paths = (path for path in find_images(args.roots) if path not in done)
+    decode_pool = DecodePool(args.decode_workers, kind=args.decode_pool)
+    results.open()
+    try:
+        stats = score_tree(service, paths, results, decode_pool, args.batch_size, args.progress_every)
+    finally:
+        results.close()
+        decode_pool.shutdown()
+
+    total = stats['scored'] + stats['failed']
+    print(f"\nScored {stats['scored']} images ({stats['failed']} failed, {len(done)} skipped) "
+          f"in {stats['seconds']:.1f}s: {stats['images_per_sec']:.1f} images/sec")
+    if total:
+        print(f"Waiting on decode {stats['decode_wait_seconds']:.1f}s, inference {stats['inference_seconds']:.1f}s, "
+              f"writing {stats['write_seconds']:.1f}s ({service.describe()}, model {service.model_version})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Preprocessed dataset shards: decode the training images once, memory-map them after.
+
+``python dataset_shards.py --data-dir data/kidney_ct_scans --output-dir data/shards``
+decodes and resizes every image of ``data_dir/<class>/`` once (with the same
+code the server uses) and writes them as uint8 ``shard-NNNNN.npy`` arrays of
+shape (count, 224, 224, 3), plus an ``index.json`` listing each image's
+original path, label, shard and row. ``ShardedDataset`` memory-maps the
+shards, so training and evaluation only touch the pages of the rows they read
+and never decode an image again.
+
+A shard directory can be passed anywhere a ``data_dir`` is expected
+(``train_model.py``, ``export_model.py``); samples keep their original paths,
+so the train/validation split is the same as when reading the image files.
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference import CLASS_LABELS
+from preprocessing import TARGET_SIZE, load_image
+
+INDEX_FILE = 'index.json'
+SHARD_FILE = 'shard-{:05d}.npy'
+
+
+def is_shard_dir(path):
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+def _decode(path, image_size):
+    try:
+        return np.asarray(load_image(path, image_size))
+    except Exception as e:
+        print(f"Skipping {path}: {e}")
+        return None
+
+
+def write_shards(samples, output_dir, shard_size=1024, image_size=TARGET_SIZE, workers=None):
+    """Decode ``[(path, label)]`` into uint8 shards in ``output_dir`` and write the index
+
+    Images that fail to decode are left out and listed under ``failed``.
+    Returns the index.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    width, height = image_size
+    index = {
+        'image_size': [width, height],
+        'class_labels': list(CLASS_LABELS),
+        'shards': [],
+        'samples': [],
+        'failed': [],
+    }
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        for start in range(0, len(samples), shard_size):
+            chunk = samples[start:start + shard_size]
+            pixels = list(executor.map(lambda sample: _decode(sample[0], image_size), chunk))
+            decoded = [(sample, image) for sample, image in zip(chunk, pixels) if image is not None]
+            index['failed'].extend(path for (path, _), image in zip(chunk, pixels) if image is None)
+            if not decoded:
+                continue
+
+            shard_number = len(index['shards'])
+            shard_name = SHARD_FILE.format(shard_number)
+            shard = np.lib.format.open_memmap(
+                os.path.join(output_dir, shard_name), mode='w+', dtype=np.uint8,
+                shape=(len(decoded), height, width, 3)
+            )
+            for row, ((path, label), image) in enumerate(decoded):
+                shard[row] = image
+                index['samples'].append({'path': path, 'label': label, 'shard': shard_number, 'row': row})
+            shard.flush()
+            del shard
+
+            index['shards'].append({'file': shard_name, 'count': len(decoded)})
+            print(f"Wrote {shard_name} ({len(decoded)} images)")
+
+    with open(os.path.join(output_dir, INDEX_FILE), 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+class ShardedDataset:
+    """Memory-mapped view of a shard directory written by ``write_shards``"""
+
+    def __init__(self, shard_dir):
+        with open(os.path.join(shard_dir, INDEX_FILE)) as f:
+            self.index = json.load(f)
+
+        self.shard_dir = shard_dir
+        self.image_size = tuple(self.index['image_size'])
+        self.shards = [
+            np.load(os.path.join(shard_dir, shard['file']), mmap_mode='r')
+            for shard in self.index['shards']
+        ]
+        self.samples = [(sample['path'], sample['label']) for sample in self.index['samples']]
+        self._rows = {
+            sample['path']: (sample['shard'], sample['row']) for sample in self.index['samples']
+        }
+
+    def __len__(self):
+        return len(self.samples)
+
+    def read(self, samples):
+        """Return the uint8 images of ``[(path, label)]`` as one (n, height, width, 3) array"""
+        width, height = self.image_size
+        images = np.empty((len(samples), height, width, 3), dtype=np.uint8)
+        locations = np.array([self._rows[path] for path, _ in samples]).reshape(-1, 2)
+
+        # Read shard by shard, in row order, so every shard is scanned sequentially
+        for shard_number in np.unique(locations[:, 0]):
+            positions = np.flatnonzero(locations[:, 0] == shard_number)
+            positions = positions[np.argsort(locations[positions, 1])]
+            images[positions] = self.shards[shard_number][locations[positions, 1]]
+        return images
+
+    def arrays(self, samples=None):
+        """Return ``(images, labels)`` for evaluation: float32 images in [0, 1] and label indices"""
+        samples = self.samples if samples is None else samples
+        images = self.read(samples).astype(np.float32)
+        images /= 255.0
+        return images, np.array([label for _, label in samples])
+
+    def batches(self, samples, batch_size=32, shuffle=False, seed=42):
+        """A ``tf.data.Dataset`` of ``(uint8_images, label_indices)`` batches of ``samples``
+
+        Shuffled datasets draw a new order every epoch.
+        """
+        import tensorflow as tf
+
+        samples = list(samples)
+        labels = np.array([label for _, label in samples], dtype=np.int32)
+        width, height = self.image_size
+        epoch = [0]
+
+        def generate():
+            order = np.arange(len(samples))
+            if shuffle:
+                np.random.default_rng(seed + epoch[0]).shuffle(order)
+                epoch[0] += 1
+            for start in range(0, len(order), batch_size):
+                chunk = order[start:start + batch_size]
+                yield self.read([samples[i] for i in chunk]), labels[chunk]
+
+        dataset = tf.data.Dataset.from_generator(
+            generate,
+            output_signature=(
+                tf.TensorSpec((None, height, width, 3), tf.uint8),
+                tf.TensorSpec((None,), tf.int32),
+            )
+        )
+        return dataset.apply(tf.data.experimental.assert_cardinality(-(-len(samples) // batch_size)))
+
+
+def main():
+    from training_data import list_labelled_images
+
+    parser = argparse.ArgumentParser(description='Convert data/<class>/ images into memory-mappable uint8 shards')
+    parser.add_argument('--data-dir', default='data/kidney_ct_scans')
+    parser.add_argument('--output-dir', default='data/shards')
+    parser.add_argument('--shard-size', type=int, default=1024, help='Images per shard')
+    parser.add_argument('--workers', type=int, default=0, help='Decode threads (default: one per core)')
+    args = parser.parse_args()
+
+    samples = list_labelled_images(args.data_dir)
+    if not samples:
+        parser.error(f"No images found under {args.data_dir}/<class>/")
+
+    start = time.perf_counter()
+    index = write_shards(samples, args.output_dir, args.shard_size, workers=args.workers or None)
+    elapsed = time.perf_counter() - start
+
+    total_bytes = sum(
+        os.path.getsize(os.path.join(args.output_dir, shard['file'])) for shard in index['shards']
+    )
+    print(f"\n{len(index['samples'])} images in {len(index['shards'])} shards "
+          f"({total_bytes / 1e6:.1f} MB) in {elapsed:.1f}s, {len(index['failed'])} failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Worker pool for image decoding, kept separate from TensorFlow's thread pools.
+
+Decoding runs on a thread pool by default (PIL releases the GIL while
+decoding and resizing); a process pool can be used instead when decoding is
+dominated by Python-level work. Batches are submitted asynchronously so the
+next chunk can be decoded while the model runs the current one.
+"""
+
+import numpy as np
+
+from preprocessing import load_image, try_decode_into
+from thread_pool import LazyProcessPool, LazyThreadPool
+
+POOL_KINDS = ('thread', 'process')
+
+
+def _load_pixels(source, target_size):
+    """Process-pool worker: decode to uint8 pixels (rows can't be shared across processes)"""
+    try:
+        return np.asarray(load_image(source, target_size))
+    except Exception as e:
+        print(f"Error preprocessing image: {e}")
+        return None
+
+
+class PendingBatch:
+    """A batch whose rows are being decoded in the background"""
+
+    def __init__(self, batch, futures, kind):
+        self.batch = batch
+        self._futures = futures
+        self._kind = kind
+
+    def result(self):
+        """Wait for every row and return ``(batch, ok)`` like ``preprocess_batch``"""
+        ok = np.zeros(len(self._futures), dtype=bool)
+        for i, future in enumerate(self._futures):
+            if self._kind == 'thread':
+                ok[i] = future.result()
+                continue
+
+            pixels = future.result()
+            if pixels is None:
+                self.batch[i] = 0.0
+            else:
+                np.divide(pixels, 255, out=self.batch[i], dtype=np.float32)
+                ok[i] = True
+        return self.batch, ok
+
+
+class DecodePool:
+    """Decode images into float32 batch buffers on a dedicated worker pool"""
+
+    def __init__(self, workers, kind='thread'):
+        if kind not in POOL_KINDS:
+            raise ValueError(f"Unknown decode pool kind '{kind}', expected one of {POOL_KINDS}")
+        self.workers = workers
+        self.kind = kind
+        # Created on first use, and again in a forked worker process
+        if kind == 'thread':
+            self._pool = LazyThreadPool(workers, thread_name_prefix='decode')
+        else:
+            self._pool = LazyProcessPool(workers)
+
+    def submit(self, sources, out):
+        """Start decoding ``sources`` into the first rows of ``out`` and return a PendingBatch
+
+        For the process pool every source must be picklable (paths or bytes).
+        """
+        batch = out[:len(sources)]
+        if self.kind == 'thread':
+            futures = [self._pool.submit(try_decode_into, source, batch[i]) for i, source in enumerate(sources)]
+        else:
+            height, width = batch.shape[1:3]
+            futures = [self._pool.submit(_load_pixels, source, (width, height)) for source in sources]
+        return PendingBatch(batch, futures, self.kind)
+
+    def decode(self, sources, out):
+        """Decode ``sources`` into ``out`` and wait for the result"""
+        return self.submit(sources, out).result()
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+def plan_threads(cpu_count, decode_workers, intra_op_threads, inter_op_threads):
+    """Warn when decode workers plus TensorFlow's op threads oversubscribe the CPU
+
+    A thread count of 0 means "let TensorFlow decide", which uses every core.
+    Returns the list of warnings that were printed.
+    """
+    warnings = []
+    intra = intra_op_threads or cpu_count
+    if cpu_count > 1 and decode_workers + intra > cpu_count:
+        warnings.append(
+            f"{decode_workers} decode workers + {intra} TensorFlow intra-op threads exceed "
+            f"{cpu_count} cores; set DECODE_WORKERS / TF_INTRA_OP_THREADS to split them"
+        )
+    if inter_op_threads and inter_op_threads > cpu_count:
+        warnings.append(f"TF_INTER_OP_THREADS={inter_op_threads} exceeds {cpu_count} cores")
+
+    for warning in warnings:
+        print(f"Warning: {warning}")
+    return warnings
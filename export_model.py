@@ -0,0 +1,252 @@
+"""
+Export the trained Keras model to lighter CPU inference formats.
+
+Supported formats:
+    tflite-fp32     plain TFLite conversion
+    tflite-dynamic  dynamic-range quantization (int8 weights, float activations)
+    tflite-int8     full-integer quantization calibrated on a representative dataset
+    onnx            ONNX via tf2onnx (optional dependency), served with ONNX Runtime
+
+Every exported artifact is checked for accuracy parity against the Keras model
+and benchmarked for latency/throughput. Any artifact can then be served by
+pointing MODEL_PATH at it (the backend is picked from the file extension).
+
+Usage:
+    python export_model.py --model models/kidney_anomaly_model.h5 \
+        --formats tflite-dynamic,tflite-int8,onnx --data-dir data/kidney_ct_scans
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from inference import OnnxRunner, TFLiteRunner, build_inference_fn
+from preprocessing import preprocess_batch
+from training_data import open_dataset
+
+EXPORT_FORMATS = ('tflite-fp32', 'tflite-dynamic', 'tflite-int8', 'onnx')
+
+
+def sample_images(images, count, seed):
+    """Deterministically sample up to ``count`` images, balanced across classes"""
+    by_class = {}
+    for path, label in images:
+        by_class.setdefault(label, []).append((path, label))
+
+    rng = random.Random(seed)
+    for items in by_class.values():
+        rng.shuffle(items)
+
+    # Round-robin over the classes so every class is represented
+    sampled = []
+    queues = [items for _, items in sorted(by_class.items())]
+    while len(sampled) < count and any(queues):
+        for items in queues:
+            if items and len(sampled) < count:
+                sampled.append(items.pop())
+    return sampled
+
+
+def load_batch(samples, shards=None):
+    """Decode ``[(path, label)]`` into a float32 batch and a label array
+
+    With ``shards`` (a ``ShardedDataset``) the images are read from the shards.
+    """
+    if shards is not None:
+        return shards.arrays(samples)
+    batch, ok = preprocess_batch([path for path, _ in samples])
+    labels = np.array([label for _, label in samples])
+    return batch[ok], labels[ok]
+
+
+def export_tflite(model, output_path, quantization='none', calibration_batch=None):
+    """Convert a Keras model to TFLite and return the output path
+
+    ``quantization`` is 'none', 'dynamic' or 'int8'. Full-int8 quantization
+    needs ``calibration_batch``, a float32 array of representative inputs; the
+    model keeps float32 input/output tensors so it is a drop-in replacement.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if quantization in ('dynamic', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if quantization == 'int8':
+        if calibration_batch is None or len(calibration_batch) == 0:
+            raise ValueError('Full-int8 quantization needs a representative dataset')
+
+        def representative_dataset():
+            for image in calibration_batch:
+                yield [image[np.newaxis, ...]]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    tflite_model = converter.convert()
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+    return output_path
+
+
+def export_onnx(model, output_path, opset=13):
+    """Convert a Keras model to ONNX with tf2onnx and return the output path"""
+    try:
+        import tf2onnx
+    except ImportError:
+        raise RuntimeError('ONNX export requires tf2onnx (pip install tf2onnx onnxruntime)')
+
+    input_signature = [tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name='input')]
+
+    # Converting a traced function works across Keras versions, unlike from_keras
+    @tf.function(input_signature=input_signature)
+    def serve(images):
+        return model(images, training=False)
+
+    tf2onnx.convert.from_function(serve, input_signature=input_signature, opset=opset, output_path=output_path)
+    return output_path
+
+
+def parity_report(reference_probabilities, probabilities, labels=None):
+    """Compare an exported model's outputs with the Keras model's"""
+    reference_classes = np.argmax(reference_probabilities, axis=1)
+    classes = np.argmax(probabilities, axis=1)
+    difference = np.abs(reference_probabilities - probabilities)
+
+    report = {
+        'samples': int(len(classes)),
+        'top1_agreement': float(np.mean(reference_classes == classes)),
+        'mean_abs_probability_diff': float(difference.mean()),
+        'max_abs_probability_diff': float(difference.max()),
+    }
+    if labels is not None:
+        report['accuracy'] = float(np.mean(classes == labels))
+        report['reference_accuracy'] = float(np.mean(reference_classes == labels))
+    return report
+
+
+def benchmark(inference_fn, batch_size, iterations):
+    """Return batch-1 latency percentiles and batched throughput for a runner"""
+    single = np.random.rand(1, 224, 224, 3).astype(np.float32)
+    batch = np.random.rand(batch_size, 224, 224, 3).astype(np.float32)
+    inference_fn(single)
+    inference_fn(batch)
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        inference_fn(single)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(max(1, iterations // 4)):
+        inference_fn(batch)
+    elapsed = time.perf_counter() - start
+
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000.0
+    return {
+        'batch1_p50_ms': float(p50),
+        'batch1_p95_ms': float(p95),
+        f'batch{batch_size}_images_per_sec': batch_size * max(1, iterations // 4) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the kidney anomaly model to TFLite / ONNX')
+    parser.add_argument('--model', default='models/kidney_anomaly_model.h5')
+    parser.add_argument('--output-dir', default='models')
+    parser.add_argument('--formats', default='tflite-dynamic,tflite-int8',
+                        help=f"Comma separated subset of {','.join(EXPORT_FORMATS)}")
+    parser.add_argument('--data-dir', default='data/kidney_ct_scans',
+                        help='Labelled images (or a shard directory) for int8 calibration and the parity check')
+    parser.add_argument('--calibration-samples', type=int, default=200)
+    parser.add_argument('--eval-samples', type=int, default=200)
+    parser.add_argument('--benchmark-iterations', type=int, default=50)
+    parser.add_argument('--benchmark-batch-size', type=int, default=16)
+    parser.add_argument('--report', help='Write the parity/latency report as JSON to this file')
+    args = parser.parse_args()
+
+    formats = [name.strip() for name in args.formats.split(',') if name.strip()]
+    for name in formats:
+        if name not in EXPORT_FORMATS:
+            parser.error(f"Unknown format '{name}', expected one of {EXPORT_FORMATS}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    model = tf.keras.models.load_model(args.model)
+    base_name = os.path.splitext(os.path.basename(args.model))[0]
+
+    # Calibration and evaluation samples are drawn with different seeds
+    labelled, shards = open_dataset(args.data_dir)
+    if labelled:
+        calibration_batch, _ = load_batch(sample_images(labelled, args.calibration_samples, seed=0), shards)
+        eval_batch, eval_labels = load_batch(sample_images(labelled, args.eval_samples, seed=1), shards)
+    else:
+        print(f"No labelled images found in {args.data_dir}; parity is checked on random inputs")
+        calibration_batch = None
+        eval_batch = np.random.default_rng(1).random((args.eval_samples, 224, 224, 3), dtype=np.float32)
+        eval_labels = None
+
+    keras_fn = build_inference_fn(model, mode='compiled')
+    reference = np.concatenate([
+        keras_fn(eval_batch[i:i + 32]) for i in range(0, len(eval_batch), 32)
+    ])
+
+    report = {
+        'keras': {
+            'path': args.model,
+            'size_bytes': os.path.getsize(args.model),
+            'benchmark': benchmark(keras_fn, args.benchmark_batch_size, args.benchmark_iterations),
+        }
+    }
+
+    for name in formats:
+        extension = '.onnx' if name == 'onnx' else '.tflite'
+        output_path = os.path.join(args.output_dir, f"{base_name}_{name.replace('-', '_')}{extension}")
+        print(f"\nExporting {name} -> {output_path}")
+
+        try:
+            if name == 'onnx':
+                export_onnx(model, output_path)
+                runner = OnnxRunner(output_path)
+            else:
+                quantization = {'tflite-fp32': 'none', 'tflite-dynamic': 'dynamic', 'tflite-int8': 'int8'}[name]
+                export_tflite(model, output_path, quantization, calibration_batch)
+                runner = TFLiteRunner(output_path)
+        except Exception as e:
+            print(f"Skipping {name}: {e}")
+            report[name] = {'error': str(e)}
+            continue
+
+        probabilities = np.concatenate([
+            runner(eval_batch[i:i + 32]) for i in range(0, len(eval_batch), 32)
+        ])
+        report[name] = {
+            'path': output_path,
+            'size_bytes': os.path.getsize(output_path),
+            'parity': parity_report(reference, probabilities, eval_labels),
+            'benchmark': benchmark(runner, args.benchmark_batch_size, args.benchmark_iterations),
+        }
+
+    batch_key = f"batch{args.benchmark_batch_size}_images_per_sec"
+    print(f"\n{'artifact':<16}{'size MB':>9}{'top-1 agree':>13}{'max |dp|':>10}{'p50 ms':>9}{'images/s':>10}")
+    for name, result in report.items():
+        if 'error' in result:
+            print(f"{name:<16}  failed: {result['error']}")
+            continue
+        parity = result.get('parity', {'top1_agreement': 1.0, 'max_abs_probability_diff': 0.0})
+        print(f"{name:<16}{result['size_bytes'] / 1e6:>9.2f}{parity['top1_agreement']:>13.3f}"
+              f"{parity['max_abs_probability_diff']:>10.4f}{result['benchmark']['batch1_p50_ms']:>9.2f}"
+              f"{result['benchmark'][batch_key]:>10.1f}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
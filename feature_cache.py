@@ -0,0 +1,161 @@
+"""
+Precomputed backbone features for training the classifier head.
+
+While the MobileNetV2 backbone is frozen, its pooled output for an image never
+changes, so it only has to be computed once. ``build_feature_cache`` runs the
+backbone over a dataset split and writes the pooled features to a ``.npy``
+file next to the labels; ``feature_dataset`` memory-maps them back and feeds
+batches to the head, so a training epoch no longer decodes a single image or
+runs a single convolution.
+
+A cache directory is reused as long as the images (paths, sizes and
+modification times) and the extraction settings are unchanged.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from dataset_shards import INDEX_FILE
+from inference import CLASS_LABELS
+from training_data import augment_batch, make_dataset
+
+FEATURES_FILE = '{split}_features.npy'
+LABELS_FILE = '{split}_labels.npy'
+META_FILE = 'meta.json'
+
+
+def fingerprint(samples, stat_files=True, **settings):
+    """Hash the image files of ``samples`` plus the extraction ``settings``
+
+    Without ``stat_files`` only the paths and labels are hashed (the images
+    come from shards, whose index is part of ``settings``).
+    """
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+    for path, label in samples:
+        if stat_files:
+            stat = os.stat(path)
+            digest.update(f"{path}|{label}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+        else:
+            digest.update(f"{path}|{label}\n".encode())
+    return digest.hexdigest()
+
+
+def feature_extractor(model):
+    """Return a model mapping images to the output of ``model``'s pooling layer"""
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D):
+            return tf.keras.Model(model.inputs, layer.output)
+    raise ValueError('Model has no GlobalAveragePooling2D layer to take features from')
+
+
+def extract_features(extractor, samples, output_path, batch_size=64, augment_copies=0, seed=42, shards=None):
+    """Write pooled features of ``samples`` to a memory-mapped ``.npy`` file
+
+    With ``augment_copies`` the split is extracted once as-is plus that many
+    more times with a fixed (seeded) augmentation, giving the head some of
+    the variety of on-the-fly augmentation. Returns the labels, one per row.
+    """
+    passes = 1 + augment_copies
+    dataset = make_dataset(samples, batch_size, training=False, cache=False, shards=shards)
+    feature_dim = extractor.output_shape[-1]
+    features = np.lib.format.open_memmap(
+        output_path, mode='w+', dtype=np.float32, shape=(len(samples) * passes, feature_dim)
+    )
+
+    labels = []
+    row = 0
+    for copy in range(passes):
+        tf.random.set_seed(seed + copy)
+        for images, one_hot in dataset:
+            if copy > 0:
+                images = augment_batch(images)
+            batch_features = extractor(images, training=False).numpy()
+            features[row:row + len(batch_features)] = batch_features
+            row += len(batch_features)
+            labels.append(np.argmax(one_hot.numpy(), axis=1))
+
+    features.flush()
+    del features
+    return np.concatenate(labels)
+
+
+def build_feature_cache(model, splits, cache_dir, batch_size=64, augment_copies=0, seed=42, shards=None):
+    """Extract (or reuse) features for each ``{split_name: samples}`` in ``splits``
+
+    Only the first split (the training split) gets augmented copies. Images
+    are read from ``shards`` (a ``ShardedDataset``) when given.
+    Returns ``{split_name: (features_memmap, labels)}``.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    extractor = feature_extractor(model)
+    names = list(splits)
+    settings = {
+        'backbone': extractor.layers[-2].name,
+        'parameters': int(extractor.count_params()),
+        'feature_dim': int(extractor.output_shape[-1]),
+        'augment_copies': augment_copies,
+        'seed': seed,
+    }
+    if shards is not None:
+        settings['shards'] = [shards.shard_dir, os.stat(os.path.join(shards.shard_dir, INDEX_FILE)).st_mtime_ns]
+
+    meta_path = os.path.join(cache_dir, META_FILE)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = {}
+
+    cached = {}
+    for name in names:
+        copies = augment_copies if name == names[0] else 0
+        key = fingerprint(splits[name], stat_files=shards is None, split=name, **settings)
+        features_path = os.path.join(cache_dir, FEATURES_FILE.format(split=name))
+        labels_path = os.path.join(cache_dir, LABELS_FILE.format(split=name))
+
+        if meta.get(name) != key or not os.path.exists(features_path) or not os.path.exists(labels_path):
+            print(f"Extracting {name} features for {len(splits[name])} images ({1 + copies} pass(es))...")
+            labels = extract_features(extractor, splits[name], features_path, batch_size, copies, seed, shards)
+            np.save(labels_path, labels)
+            meta[name] = key
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f, indent=2)
+        else:
+            print(f"Reusing cached {name} features from {features_path}")
+
+        cached[name] = (np.load(features_path, mmap_mode='r'), np.load(labels_path))
+    return cached
+
+
+def feature_dataset(features, labels, batch_size=32, training=False, num_classes=len(CLASS_LABELS), seed=42):
+    """Batch ``(features, one_hot_labels)`` from a memory-mapped feature array
+
+    Only the rows of the current batch are read from the memory map; training
+    datasets are reshuffled every epoch.
+    """
+    epoch = [0]
+
+    def batches():
+        order = np.arange(len(labels))
+        if training:
+            np.random.default_rng(seed + epoch[0]).shuffle(order)
+            epoch[0] += 1
+        for start in range(0, len(order), batch_size):
+            # Sorted indices read the memory map sequentially
+            index = np.sort(order[start:start + batch_size])
+            yield np.asarray(features[index]), np.eye(num_classes, dtype=np.float32)[labels[index]]
+
+    dataset = tf.data.Dataset.from_generator(
+        batches,
+        output_signature=(
+            tf.TensorSpec((None, features.shape[1]), tf.float32),
+            tf.TensorSpec((None, num_classes), tf.float32),
+        )
+    )
+    # Generators have unknown length; Keras needs it to end epochs cleanly
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(-(-len(labels) // batch_size)))
+    return dataset.prefetch(tf.data.AUTOTUNE)
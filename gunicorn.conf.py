@@ -0,0 +1,55 @@
+"""
+Gunicorn configuration for serving the Flask API in production.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+With ``preload_app`` the master imports ``app`` (Flask, NumPy, PIL and the
+application code) and the TensorFlow package once, and every forked worker
+shares those pages copy-on-write. TensorFlow's runtime deadlocks in a forked child once it has
+been initialised in the parent, so the model itself is loaded and warmed up in
+each worker, before the worker starts accepting requests; ``/api/ready``
+reports 503 until that is done.
+"""
+
+import os
+import shutil
+import tempfile
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '4000')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_class = 'gthread'
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+accesslog = '-'
+
+# Read by app.py at import time: the model is loaded per worker (below) rather
+# than in the master, and each worker sizes its thread pools for its share of the cores
+os.environ.setdefault('MODEL_INIT', 'deferred')
+os.environ.setdefault('SERVER_WORKERS', str(workers))
+# Every worker publishes its metrics here and /metrics sums them; unless set,
+# a fresh directory per server start, so totals restart with the server
+temporary_metrics_dir = None
+if not os.environ.get('METRICS_DIR'):
+    temporary_metrics_dir = os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='kidney-metrics-')
+
+
+
+def when_ready(server):
+    """Import (but don't initialise) TensorFlow in the master so workers share it"""
+    if preload_app:
+        from inference import import_tensorflow
+        import_tensorflow()
+
+
+def post_worker_init(worker):
+    """Load and warm up the model in the worker before it accepts connections"""
+    from app import init_model
+    init_model()
+
+
+def on_exit(server):
+    if temporary_metrics_dir:
+        shutil.rmtree(temporary_metrics_dir, ignore_errors=True)
@@ -0,0 +1,158 @@
+"""
+Per-user history of the predictions served, read a page at a time.
+
+``ResultStore`` keeps one row per scored image (owner, time, file name, model
+version, predicted class, confidence, class probabilities, SHA-256 of the
+image and the analysis job it belonged to, if any) in a SQL table indexed on
+``(owner, id)``. Pages are addressed by the last row ID seen (``before``)
+rather than by offset, so fetching any page is one short index range scan
+however long the history grows.
+
+Dashboard counts come from a per-user, per-class totals table that is updated
+in the same transaction as the rows it counts, so they are a lookup of a
+handful of rows instead of a scan of the history.
+"""
+
+import json
+import time
+from collections import Counter
+
+from user_store import open_database, placeholder_for
+
+RESULT_COLUMNS = (
+    'id', 'created_at', 'filename', 'model_version', 'predicted_class',
+    'confidence', 'probabilities', 'image_hash', 'job_id'
+)
+
+
+class ResultStore:
+    """Prediction history in a SQL database"""
+
+    def __init__(self, pool, placeholder='?', id_column='INTEGER PRIMARY KEY'):
+        self.pool = pool
+        self.placeholder = placeholder
+        self.id_column = id_column
+
+    def _sql(self, statement):
+        return statement.replace('?', self.placeholder)
+
+    def create_schema(self):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS results ("
+                f"id {self.id_column}, "
+                f"owner TEXT NOT NULL, "
+                f"created_at DOUBLE PRECISION NOT NULL, "
+                f"filename TEXT, "
+                f"model_version TEXT NOT NULL, "
+                f"predicted_class TEXT NOT NULL, "
+                f"confidence DOUBLE PRECISION NOT NULL, "
+                f"probabilities TEXT NOT NULL, "
+                f"image_hash TEXT, "
+                f"job_id TEXT)"
+            )
+            cursor.execute('CREATE INDEX IF NOT EXISTS results_owner ON results (owner, id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS results_owner_class ON results (owner, predicted_class, id)')
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS result_totals ("
+                "owner TEXT NOT NULL, "
+                "predicted_class TEXT NOT NULL, "
+                "total INTEGER NOT NULL, "
+                "last_created_at DOUBLE PRECISION NOT NULL, "
+                "PRIMARY KEY (owner, predicted_class))"
+            )
+
+    def add(self, owner, results, job_id=None):
+        """Record ``results`` (API prediction results, with ``filename`` and ``image_hash``) for ``owner``"""
+        if not results:
+            return
+        now = time.time()
+        rows = [
+            (owner, now, result.get('filename'), result['model_version'], result['prediction'],
+             result['confidence'], json.dumps(result['all_probabilities']), result.get('image_hash'), job_id)
+            for result in results
+        ]
+        counts = Counter(result['prediction'] for result in results)
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.executemany(
+                self._sql(
+                    'INSERT INTO results (owner, created_at, filename, model_version, predicted_class, '
+                    'confidence, probabilities, image_hash, job_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+                ),
+                rows
+            )
+            cursor.executemany(
+                self._sql(
+                    'INSERT INTO result_totals (owner, predicted_class, total, last_created_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (owner, predicted_class) DO UPDATE SET '
+                    'total = result_totals.total + excluded.total, last_created_at = excluded.last_created_at'
+                ),
+                [(owner, predicted_class, count, now) for predicted_class, count in counts.items()]
+            )
+
+    @staticmethod
+    def _row(row):
+        record = dict(zip(RESULT_COLUMNS, row))
+        return {
+            'id': record['id'],
+            'created_at': record['created_at'],
+            'filename': record['filename'],
+            'prediction': record['predicted_class'],
+            'confidence': record['confidence'],
+            'all_probabilities': json.loads(record['probabilities']),
+            'model_version': record['model_version'],
+            'image_hash': record['image_hash'],
+            'job_id': record['job_id'],
+        }
+
+    def page(self, owner, limit=50, before=None, predicted_class=None):
+        """Up to ``limit`` of ``owner``'s results older than row ``before``, newest first
+
+        Returns ``(results, next_before)``; ``next_before`` is None on the last page.
+        """
+        conditions, params = ['owner = ?'], [owner]
+        if before is not None:
+            conditions.append('id < ?')
+            params.append(before)
+        if predicted_class:
+            conditions.append('predicted_class = ?')
+            params.append(predicted_class)
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                self._sql(
+                    f"SELECT {', '.join(RESULT_COLUMNS)} FROM results WHERE {' AND '.join(conditions)} "
+                    f"ORDER BY id DESC LIMIT ?"
+                ),
+                (*params, limit + 1)
+            )
+            rows = cursor.fetchall()
+        results = [self._row(row) for row in rows[:limit]]
+        return results, (results[-1]['id'] if len(rows) > limit else None)
+
+    def summary(self, owner, class_labels=()):
+        """Totals of ``owner``'s history: overall, per predicted class and the time of the latest"""
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                self._sql('SELECT predicted_class, total, last_created_at FROM result_totals WHERE owner = ?'),
+                (owner,)
+            )
+            rows = cursor.fetchall()
+        class_counts = {label: 0 for label in class_labels}
+        class_counts.update({predicted_class: total for predicted_class, total, _ in rows})
+        return {
+            'total': sum(class_counts.values()),
+            'class_counts': class_counts,
+            'last_analysis_at': max((last for _, _, last in rows), default=None),
+        }
+
+
+def open_result_store(url='sqlite:///results.db', pool_size=8):
+    """Open (creating the schema if needed) the prediction history at ``url``, see ``user_store.open_database``"""
+    pool, driver, id_column = open_database(url, pool_size)
+    store = ResultStore(pool, placeholder=placeholder_for(driver), id_column=id_column)
+    store.create_schema()
+    return store
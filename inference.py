@@ -0,0 +1,357 @@
+"""
+Inference callables for the kidney anomaly model.
+
+``model.predict`` builds Keras' data adapters and callback machinery on every
+call, which dominates latency for the small batches served by the API. The
+compiled path instead traces the model once into a ``tf.function`` with a fixed
+input signature (optionally XLA-compiled) and is warmed up before the first
+real request arrives.
+
+TensorFlow is only imported when a model is actually loaded, so processes that
+never run inference (auth-only workers, tooling) don't pay its import time and
+memory. ``InferenceService`` owns the lazily loaded model.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+INPUT_SHAPE = (224, 224, 3)
+INFERENCE_MODES = ('compiled', 'eager')
+INFERENCE_BACKENDS = ('keras', 'tflite', 'onnx')
+
+# Class labels, in the order of the model's output units
+CLASS_LABELS = ['Normal', 'Cyst', 'Stone', 'Tumor']
+
+
+def import_tensorflow():
+    """Import TensorFlow on first use and return the module"""
+    import tensorflow as tf
+    return tf
+
+
+def model_file_version(model_path):
+    """Identify a model artifact by its file name and a hash of its contents"""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return f"{name}-{digest.hexdigest()[:12]}"
+
+
+def configure_threads(intra_op_threads=0, inter_op_threads=0):
+    """Size TensorFlow's intra/inter-op thread pools (0 keeps TensorFlow's default)
+
+    Must be called before the first TensorFlow op runs, i.e. before loading the model.
+    """
+    tf = import_tensorflow()
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError:
+        # The runtime is already initialised (e.g. a second model in this
+        # process); the pools keep the sizes they were created with
+        pass
+
+
+def _bucket_size(batch_size):
+    """Round a batch size up to the next power of two"""
+    bucket = 1
+    while bucket < batch_size:
+        bucket *= 2
+    return bucket
+
+
+def build_inference_fn(model, mode='compiled', jit_compile=False, input_shape=INPUT_SHAPE):
+    """Wrap a Keras model in a callable mapping a float32 batch to probabilities
+
+    ``mode='eager'`` keeps the original ``model.predict`` behaviour, while
+    ``mode='compiled'`` runs a traced ``tf.function``. With ``jit_compile``
+    XLA compiles one program per input shape, so batches are zero-padded up to
+    power-of-two buckets to keep the number of compilations small.
+    """
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"Unknown inference mode '{mode}', expected one of {INFERENCE_MODES}")
+
+    if mode == 'eager':
+        def run_eager(batch):
+            return model.predict(batch, verbose=0)
+        return run_eager
+
+    tf = import_tensorflow()
+
+    @tf.function(
+        input_signature=[tf.TensorSpec(shape=(None,) + tuple(input_shape), dtype=tf.float32)],
+        jit_compile=jit_compile
+    )
+    def serve(images):
+        return model(images, training=False)
+
+    def run_compiled(batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        count = batch.shape[0]
+        if jit_compile:
+            padded = _bucket_size(count)
+            if padded != count:
+                pad = np.zeros((padded - count,) + batch.shape[1:], dtype=np.float32)
+                batch = np.concatenate([batch, pad])
+        return serve(batch).numpy()[:count]
+
+    return run_compiled
+
+
+class TFLiteRunner:
+    """Run a ``.tflite`` artifact (float, dynamic-range or full-int8) on float32 batches
+
+    Uses the standalone ``tflite_runtime`` package when installed, so serving a
+    TFLite model doesn't require TensorFlow at all. Resizing an interpreter's
+    input reallocates its tensor arena, so batches are zero-padded to
+    power-of-two buckets with one interpreter (and lock, since interpreters are
+    not thread-safe) per bucket.
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            Interpreter = import_tensorflow().lite.Interpreter
+
+        self._interpreter_class = Interpreter
+        self.model_path = model_path
+        self.num_threads = num_threads or None
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+
+    def _bucket(self, batch_size):
+        with self._buckets_lock:
+            if batch_size not in self._buckets:
+                interpreter = self._interpreter_class(model_path=self.model_path, num_threads=self.num_threads)
+                input_details = interpreter.get_input_details()[0]
+                interpreter.resize_tensor_input(input_details['index'], [batch_size] + list(input_details['shape'][1:]))
+                interpreter.allocate_tensors()
+                self._buckets[batch_size] = (
+                    interpreter,
+                    interpreter.get_input_details()[0],
+                    interpreter.get_output_details()[0],
+                    threading.Lock()
+                )
+            return self._buckets[batch_size]
+
+    def __call__(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        count = batch.shape[0]
+        padded = _bucket_size(count)
+        if padded != count:
+            pad = np.zeros((padded - count,) + batch.shape[1:], dtype=np.float32)
+            batch = np.concatenate([batch, pad])
+
+        interpreter, input_details, output_details, lock = self._bucket(padded)
+
+        # Full-int8 models with integer I/O expect quantized inputs
+        input_dtype = input_details['dtype']
+        if input_dtype != np.float32:
+            scale, zero_point = input_details['quantization']
+            info = np.iinfo(input_dtype)
+            batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(input_dtype)
+
+        with lock:
+            interpreter.set_tensor(input_details['index'], batch)
+            interpreter.invoke()
+            output = interpreter.get_tensor(output_details['index'])[:count]
+
+        if output.dtype != np.float32:
+            scale, zero_point = output_details['quantization']
+            output = (output.astype(np.float32) - zero_point) * scale
+        return np.array(output, dtype=np.float32)
+
+
+class OnnxRunner:
+    """Run a ``.onnx`` artifact with ONNX Runtime on the CPU"""
+
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        return self.session.run(None, {self._input_name: batch})[0]
+
+
+def backend_for_path(model_path):
+    """Pick the serving backend from a model artifact's extension"""
+    extension = os.path.splitext(model_path)[1].lower()
+    if extension == '.tflite':
+        return 'tflite'
+    if extension == '.onnx':
+        return 'onnx'
+    return 'keras'
+
+
+def warmup_bucket_sizes(max_batch_size, bucketed=False):
+    """Batch sizes to run during warmup so no live request pays for tracing
+
+    ``bucketed`` runners (XLA, TFLite) need every power-of-two bucket warmed.
+    """
+    if not bucketed:
+        return [1, max_batch_size] if max_batch_size > 1 else [1]
+
+    sizes = []
+    bucket = 1
+    while bucket < max_batch_size:
+        sizes.append(bucket)
+        bucket *= 2
+    sizes.append(bucket)
+    return sizes
+
+
+def warmup(inference_fn, batch_sizes=(1,), input_shape=INPUT_SHAPE):
+    """Run dummy batches through ``inference_fn`` and return the elapsed seconds"""
+    start = time.perf_counter()
+    for batch_size in batch_sizes:
+        inference_fn(np.zeros((batch_size,) + tuple(input_shape), dtype=np.float32))
+    return time.perf_counter() - start
+
+
+class ModelUnavailableError(RuntimeError):
+    """Raised when a prediction is requested but no model could be loaded"""
+
+
+class InferenceService:
+    """Lazily loaded, warmed-up model behind a thread-safe ``predict`` callable
+
+    Nothing touches TensorFlow until ``load()`` runs, either explicitly, from a
+    background thread (``start_background_load``) or on the first prediction.
+    """
+
+    def __init__(self, model_path, mode='compiled', jit_compile=False, max_batch_size=16,
+                 intra_op_threads=0, inter_op_threads=0, model_version=None, backend=None):
+        backend = backend or backend_for_path(model_path)
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Unknown inference backend '{backend}', expected one of {INFERENCE_BACKENDS}")
+
+        self.model_path = model_path
+        self.backend = backend
+        self.mode = mode
+        self.jit_compile = jit_compile
+        self.max_batch_size = max_batch_size
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+        self.model = None
+        self.model_version = model_version
+        self.inference_fn = None
+        self.load_error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+
+        self._ready = threading.Event()
+        self._attempted = False
+        self._lock = threading.Lock()
+        self._background = None
+
+    @property
+    def loaded(self):
+        return self.inference_fn is not None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def load(self):
+        """Import TensorFlow, load and warm up the model; return True once usable
+
+        Safe to call from several threads: later callers wait for the first
+        load to finish. A failed load is not retried.
+        """
+        if self._ready.is_set():
+            return self.loaded
+
+        with self._lock:
+            if self._attempted:
+                return self.loaded
+            self._attempted = True
+
+            start = time.perf_counter()
+            try:
+                model, inference_fn = self._load_backend()
+                print(f"Model loaded successfully ({self.backend} backend)")
+                if self.model_version is None:
+                    self.model_version = model_file_version(self.model_path)
+                self.load_seconds = time.perf_counter() - start
+
+                # Trace/compile before serving so the first request doesn't pay for it
+                self.warmup_seconds = warmup(
+                    inference_fn,
+                    warmup_bucket_sizes(self.max_batch_size, self.jit_compile or self.backend == 'tflite')
+                )
+                print(f"Model warmed up in {self.warmup_seconds:.2f}s ({self.describe()}, pid {os.getpid()})")
+                self.model = model
+                self.inference_fn = inference_fn
+                return True
+            except Exception as e:
+                self.load_error = str(e)
+                print(f"Could not load model {self.model_path}: {type(e).__name__}: {e}")
+                return False
+            finally:
+                # Failed or not, waiters and readiness checks get their answer
+                self._ready.set()
+
+    def _load_backend(self):
+        """Return ``(model, inference_fn)`` for the configured backend"""
+        if self.backend == 'tflite':
+            runner = TFLiteRunner(self.model_path, num_threads=self.intra_op_threads)
+            return runner, runner
+        if self.backend == 'onnx':
+            runner = OnnxRunner(self.model_path, num_threads=self.intra_op_threads)
+            return runner, runner
+
+        configure_threads(self.intra_op_threads, self.inter_op_threads)
+        tf = import_tensorflow()
+        model = tf.keras.models.load_model(self.model_path)
+        return model, build_inference_fn(model, mode=self.mode, jit_compile=self.jit_compile)
+
+    def describe(self):
+        if self.backend == 'keras':
+            return f"keras backend, {self.mode} mode"
+        return f"{self.backend} backend"
+
+    def start_background_load(self):
+        """Load and warm up the model on a daemon thread"""
+        if self._background is None:
+            self._background = threading.Thread(target=self.load, name='model-warmup', daemon=True)
+            self._background.start()
+        return self._background
+
+    def ensure_loaded(self):
+        """Load the model if needed and raise ModelUnavailableError if that failed"""
+        if not self.load():
+            raise ModelUnavailableError('Model not loaded. Please contact administrator.')
+
+    def predict(self, batch):
+        """Return the model's output probabilities for a float32 batch"""
+        self.ensure_loaded()
+        return self.inference_fn(batch)
+
+    def status(self):
+        """Describe the service for health and readiness checks"""
+        return {
+            'model_loaded': self.loaded,
+            'ready': self.ready,
+            'model_version': self.model_version,
+            'inference_backend': self.backend,
+            'inference_mode': self.mode,
+            'load_seconds': self.load_seconds,
+            'warmup_seconds': self.warmup_seconds,
+            'load_error': self.load_error,
+        }
@@ -0,0 +1,305 @@
+"""
+Asynchronous analysis jobs: submit now, fetch the result later.
+
+``JobQueue.submit`` records a job and returns its ID at once. The work runs on
+a small pool of threads in the submitting process, so a long multi-slice
+study neither holds a request thread for its whole duration nor is wasted
+when the client disconnects. Job state, progress and results live in a SQL
+table (``JobStore``, on any database ``user_store.open_database`` supports),
+so under gunicorn every worker can answer a poll for a job that another
+worker is running.
+
+``JobQueue.poll`` with a ``wait`` long-polls: it returns as soon as one of
+the jobs asked about has finished (at once for jobs of this process, within
+``poll_interval`` for others) or when ``wait`` runs out. Each waiting poll
+holds a request thread, so at most ``max_waiters`` wait at a time; polls
+beyond that return the jobs as they stand. Finished jobs are kept for
+``retention`` seconds; a job whose process exited before finishing it is
+reported as failed.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from thread_pool import LazyThreadPool
+from user_store import open_database, placeholder_for
+
+FINISHED_STATUSES = ('completed', 'failed')
+JOB_COLUMNS = (
+    'id', 'owner', 'kind', 'status', 'total', 'done', 'worker',
+    'created_at', 'started_at', 'finished_at', 'result', 'error'
+)
+
+
+class JobQueueFullError(RuntimeError):
+    """Raised when a job is submitted while the queue of this process is full"""
+
+
+def worker_id():
+    """Identifies the process running a job: ``host:pid``"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def worker_exited(worker):
+    """True when ``worker`` (see ``worker_id``) is a process on this host that no longer exists"""
+    host, _, pid = worker.rpartition(':')
+    if host != socket.gethostname() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def describe_job(job):
+    """The API view of a job"""
+    return {
+        'id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': {'done': job['done'], 'total': job['total']},
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'result': job['result'],
+        'error': job['error'],
+    }
+
+
+class JobStore:
+    """Jobs and their results in a SQL table"""
+
+    def __init__(self, pool, placeholder='?'):
+        self.pool = pool
+        self.placeholder = placeholder
+
+    def _sql(self, statement):
+        return statement.replace('?', self.placeholder)
+
+    def create_schema(self):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, "
+                "owner TEXT NOT NULL, "
+                "kind TEXT NOT NULL, "
+                "status TEXT NOT NULL, "
+                "total INTEGER NOT NULL, "
+                "done INTEGER NOT NULL, "
+                "worker TEXT NOT NULL, "
+                "created_at DOUBLE PRECISION NOT NULL, "
+                "started_at DOUBLE PRECISION, "
+                "finished_at DOUBLE PRECISION, "
+                "result TEXT, "
+                "error TEXT)"
+            )
+            cursor.execute('CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created_at)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at)')
+
+    @staticmethod
+    def _row(row):
+        job = dict(zip(JOB_COLUMNS, row))
+        if job['result'] is not None:
+            job['result'] = json.loads(job['result'])
+        return job
+
+    def add(self, job_id, owner, kind, total, worker):
+        with self.pool.connection() as connection:
+            connection.cursor().execute(
+                self._sql(
+                    'INSERT INTO jobs (id, owner, kind, status, total, done, worker, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+                ),
+                (job_id, owner, kind, 'queued', total, 0, worker, time.time())
+            )
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self.pool.connection() as connection:
+            connection.cursor().execute(
+                self._sql(f'UPDATE jobs SET {assignments} WHERE id = ?'), (*fields.values(), job_id)
+            )
+
+    def get(self, job_id):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(self._sql(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?"), (job_id,))
+            row = cursor.fetchone()
+        return None if row is None else self._row(row)
+
+    def get_many(self, job_ids):
+        """The jobs among ``job_ids`` that exist, in no particular order"""
+        if not job_ids:
+            return []
+        markers = ', '.join('?' for _ in job_ids)
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                self._sql(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id IN ({markers})"), tuple(job_ids)
+            )
+            return [self._row(row) for row in cursor.fetchall()]
+
+    def list(self, owner, finished_after, limit=20, unfinished_only=False):
+        """The newest jobs of ``owner``, skipping those that finished before ``finished_after``"""
+        if unfinished_only:
+            condition, params = 'finished_at IS NULL', (owner, limit)
+        else:
+            condition, params = '(finished_at IS NULL OR finished_at >= ?)', (owner, finished_after, limit)
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                self._sql(
+                    f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs "
+                    f"WHERE owner = ? AND {condition} "
+                    f"ORDER BY created_at DESC LIMIT ?"
+                ),
+                params
+            )
+            return [self._row(row) for row in cursor.fetchall()]
+
+    def purge(self, finished_before):
+        """Delete the jobs that finished before ``finished_before``"""
+        with self.pool.connection() as connection:
+            connection.cursor().execute(
+                self._sql('DELETE FROM jobs WHERE finished_at < ?'), (finished_before,)
+            )
+
+
+class JobQueue:
+    """Run submitted jobs on up to ``max_workers`` threads, with at most ``max_pending`` waiting
+
+    At most ``max_waiters`` polls long-poll at a time. ``on_finish(status)``
+    is called with ``'completed'`` or ``'failed'`` after every job, e.g. to
+    count outcomes.
+    """
+
+    def __init__(self, store, max_workers=1, max_pending=8, max_waiters=4, retention=86400.0, poll_interval=0.25,
+                 progress_interval=0.5, on_finish=None):
+        self.store = store
+        self.max_workers = max_workers
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.progress_interval = progress_interval
+        self.on_finish = on_finish
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._waiters = threading.BoundedSemaphore(max_waiters)
+        self._finished = threading.Condition()
+        self._pool = LazyThreadPool(max_workers, thread_name_prefix='job')
+
+    def submit(self, owner, fn, total, kind='analysis'):
+        """Queue ``fn(job_id, progress)`` and return the job ID
+
+        ``fn`` reports progress by calling ``progress(done)``; its (JSON
+        serialisable) return value becomes the job's result, an exception
+        fails the job. Raises JobQueueFullError when the queue is full.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFullError('Too many analyses in progress, please retry shortly')
+        try:
+            self.store.purge(time.time() - self.retention)
+            job_id = uuid.uuid4().hex
+            self.store.add(job_id, owner, kind, total, worker_id())
+            self._pool.submit(self._run, job_id, fn, total)
+        except Exception:
+            self._slots.release()
+            raise
+        return job_id
+
+    def _run(self, job_id, fn, total):
+        last_report = 0.0
+
+        def progress(done):
+            nonlocal last_report
+            # Throttled: every report is a database write
+            if time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                self.store.update(job_id, done=done)
+
+        try:
+            self.store.update(job_id, status='running', started_at=time.time())
+            result = fn(job_id, progress)
+            self.store.update(job_id, status='completed', done=total, result=result, finished_at=time.time())
+            status = 'completed'
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self.store.update(job_id, status='failed', error=str(e), finished_at=time.time())
+            status = 'failed'
+        finally:
+            self._slots.release()
+            with self._finished:
+                self._finished.notify_all()
+        if self.on_finish is not None:
+            self.on_finish(status)
+
+    def _current(self, job):
+        """``job`` as it stands, failing it if its process has exited"""
+        if job['status'] not in FINISHED_STATUSES and worker_exited(job['worker']):
+            self.store.update(
+                job['id'], status='failed', error='The server process running this job exited',
+                finished_at=time.time()
+            )
+            job = self.store.get(job['id'])
+        return job
+
+    def _lookup(self, job_ids, owner):
+        expired = time.time() - self.retention
+        return [
+            self._current(job) for job in self.store.get_many(job_ids)
+            if job['owner'] == owner and (job['finished_at'] is None or job['finished_at'] >= expired)
+        ]
+
+    def poll(self, job_ids, owner, wait=0.0):
+        """The jobs among ``job_ids`` of ``owner``, waiting up to ``wait`` seconds for one to finish
+
+        Returns ``(jobs, waited)``. Unknown jobs, other users' jobs and expired
+        ones are left out. ``waited`` is False when the poll would have waited
+        but ``max_waiters`` others already were, so it returned at once.
+        """
+        deadline = time.monotonic() + wait
+        waiting = wait > 0 and self._waiters.acquire(blocking=False)
+        try:
+            while True:
+                jobs = self._lookup(job_ids, owner)
+                remaining = deadline - time.monotonic()
+                if (not waiting or remaining <= 0 or not jobs
+                        or any(job['status'] in FINISHED_STATUSES for job in jobs)):
+                    return jobs, waiting or wait <= 0
+                with self._finished:
+                    self._finished.wait(min(self.poll_interval, remaining))
+        finally:
+            if waiting:
+                self._waiters.release()
+
+    def get(self, job_id, owner, wait=0.0):
+        """The job ``job_id`` of ``owner``, waiting up to ``wait`` seconds for it to finish (see ``poll``)
+
+        Returns None for unknown jobs, other users' jobs and expired ones.
+        """
+        jobs, _ = self.poll([job_id], owner, wait)
+        return jobs[0] if jobs else None
+
+    def list(self, owner, limit=20, unfinished_only=False):
+        """The newest unexpired (or only the unfinished) jobs of ``owner``"""
+        jobs = self.store.list(owner, time.time() - self.retention, limit, unfinished_only)
+        return [self._current(job) for job in jobs]
+
+
+def open_job_queue(url='sqlite:///jobs.db', pool_size=8, **options):
+    """Open (creating the schema if needed) the job store at ``url`` and return its queue
+
+    ``options`` are passed to ``JobQueue``.
+    """
+    pool, driver, _ = open_database(url, pool_size)
+    store = JobStore(pool, placeholder=placeholder_for(driver))
+    store.create_schema()
+    return JobQueue(store, **options)
@@ -0,0 +1,221 @@
+"""
+Prometheus-style counters and histograms, rendered in the text exposition format.
+
+Recording a value is a dictionary lookup and an in-memory increment under a
+lock; nothing is formatted until ``/metrics`` is scraped. Under gunicorn each
+worker process has its own metrics, so with a shared ``directory`` every
+process writes a snapshot of its values there (at most every
+``flush_interval`` seconds, from a background thread) and ``render`` sums the
+snapshots of all processes, including ones that have since exited, so totals
+never go backwards.
+"""
+
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, from sub-millisecond stages up to slow model loads
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SNAPSHOT_FILE = 'metrics-{pid}.json'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination (name it ``..._total``)"""
+
+    kind = 'counter'
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry.changed()
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+    @staticmethod
+    def merge(total, values):
+        return total + values
+
+    def render(self, samples):
+        for key, value in sorted(samples.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, json.loads(key))} {_format_value(value)}"
+
+
+class Histogram:
+    """Bucketed distribution (plus sum and count) per label combination"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, one for +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+        self.registry.changed()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the ``with`` block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): list(counts) for key, counts in self._values.items()}
+
+    @staticmethod
+    def merge(total, values):
+        return [a + b for a, b in zip(total, values)]
+
+    def render(self, samples):
+        for key, counts in sorted(samples.items()):
+            values = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, [('le', _format_value(float(bound)))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    """The metrics of this process, optionally merged with other processes via ``directory``"""
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory or None
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        self._dirty = threading.Event()
+        self._flusher_pid = None
+        self._lock = threading.Lock()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def changed(self):
+        if self.directory is None:
+            return
+        self._dirty.set()
+        if self._flusher_pid != os.getpid():
+            self._start_flusher()
+
+    def _start_flusher(self):
+        """Start the snapshot writer of this process (again after a fork)"""
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def flush(self):
+        """Write this process's values to ``directory``"""
+        if self.directory is None:
+            return
+        self._dirty.clear()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, os.path.join(self.directory, SNAPSHOT_FILE.format(pid=os.getpid())))
+
+    def _collect(self):
+        if self.directory is None:
+            return self.snapshot()
+
+        self.flush()
+        merged = {name: {} for name in self._metrics}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric_name, samples in snapshot.items():
+                metric = self._metrics.get(metric_name)
+                if metric is None:
+                    continue
+                for key, value in samples.items():
+                    current = merged[metric_name].get(key)
+                    merged[metric_name][key] = value if current is None else metric.merge(current, value)
+        return merged
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        samples = self._collect()
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(samples.get(name, {})))
+        return '\n'.join(lines) + '\n'
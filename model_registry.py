@@ -0,0 +1,195 @@
+"""
+Registry of versioned model artifacts with zero-downtime hot swapping.
+
+Every model file in the models directory is identified by a content-derived
+version (see ``inference.model_file_version``). Activating a version loads and
+warms it up on a background thread while the current version keeps serving,
+then swaps the active ``InferenceService`` reference in one assignment.
+Requests take a snapshot of ``registry.active`` and use it throughout, so
+in-flight requests finish on the version they started with.
+
+The active version is recorded in ``active_model.json`` in the models
+directory; other worker processes pick the change up through ``sync()``.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+from inference import model_file_version
+
+MODEL_EXTENSIONS = ('.h5', '.keras', '.tflite', '.onnx')
+ACTIVE_MODEL_FILE = 'active_model.json'
+
+
+class ModelRegistry:
+    """Versioned model artifacts, one of which is active at a time"""
+
+    def __init__(self, models_dir, service_factory, default_path, sync_interval=5.0):
+        self.models_dir = models_dir
+        self.service_factory = service_factory
+        self.default_path = default_path
+        self.sync_interval = sync_interval
+
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._loading = None
+        self._last_error = None
+        self._last_sync = time.monotonic()
+
+        path = self._recorded_path() or default_path
+        self._active = service_factory(path, self._version_of(path))
+
+    @property
+    def active(self):
+        """The InferenceService currently serving predictions"""
+        return self._active
+
+    @property
+    def active_file(self):
+        return os.path.join(self.models_dir, ACTIVE_MODEL_FILE)
+
+    def _version_of(self, path):
+        """Content-derived version of ``path``, memoised on (mtime, size)"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        signature = (stat.st_mtime, stat.st_size)
+        cached = self._versions.get(path)
+        if cached is None or cached[0] != signature:
+            cached = (signature, model_file_version(path))
+            self._versions[path] = cached
+        return cached[1]
+
+    def available(self):
+        """List the model artifacts in the models directory, newest first"""
+        try:
+            names = os.listdir(self.models_dir)
+        except OSError:
+            return []
+
+        models = []
+        for name in names:
+            path = os.path.join(self.models_dir, name)
+            if not name.lower().endswith(MODEL_EXTENSIONS) or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            models.append({
+                'version': self._version_of(path),
+                'filename': name,
+                'size_bytes': stat.st_size,
+                'modified': stat.st_mtime,
+            })
+        return sorted(models, key=lambda model: model['modified'], reverse=True)
+
+    def resolve(self, version):
+        """Return the path of the artifact with this version (or file name)"""
+        for model in self.available():
+            if version in (model['version'], model['filename']):
+                return os.path.join(self.models_dir, model['filename'])
+        return None
+
+    def _recorded_path(self):
+        try:
+            with open(self.active_file) as f:
+                recorded = json.load(f)
+        except (OSError, ValueError):
+            return None
+        path = os.path.join(self.models_dir, recorded.get('filename', ''))
+        return path if os.path.isfile(path) else None
+
+    def _record_active(self, path, version):
+        os.makedirs(self.models_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.models_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': version, 'filename': os.path.basename(path), 'activated_at': time.time()}, f)
+        os.replace(tmp_path, self.active_file)
+
+    def load(self):
+        """Load and warm up the active version (see ``InferenceService.load``)"""
+        return self._active.load()
+
+    def activate(self, version, wait=False, record=True):
+        """Load ``version`` in the background and swap it in once it is warm
+
+        Returns False if the version is unknown, True otherwise. With
+        ``wait`` the call blocks until the swap (or failed load) is done.
+        The latest activation wins: a version still loading when another is
+        activated is discarded once it's loaded.
+        """
+        path = self.resolve(version)
+        if path is None:
+            return False
+
+        version = self._version_of(path)
+        with self._lock:
+            if self._active.model_version == version and self._active.loaded:
+                # Supersedes any other version still loading
+                self._loading = None
+                return True
+            if self._loading is not None and self._loading[0] == version:
+                thread = self._loading[1]
+            else:
+                thread = threading.Thread(
+                    target=self._load_and_swap, args=(path, version, record),
+                    name=f'model-load-{version}', daemon=True
+                )
+                self._loading = (version, thread)
+                thread.start()
+
+        if wait:
+            thread.join()
+        return True
+
+    def _load_and_swap(self, path, version, record):
+        service = self.service_factory(path, version)
+        try:
+            loaded = service.load()
+        except Exception as e:
+            loaded = False
+            service.load_error = str(e)
+
+        with self._lock:
+            if self._loading is None or self._loading[1] is not threading.current_thread():
+                print(f"Discarded model {version}: another version was activated while it loaded")
+                return
+            self._loading = None
+            if loaded:
+                previous = self._active
+                # A single reference assignment: new requests see the new version,
+                # in-flight requests keep the service they already hold
+                self._active = service
+                self._last_error = None
+                if record:
+                    self._record_active(path, version)
+                print(f"Activated model {version} (was {previous.model_version})")
+            else:
+                self._last_error = {'version': version, 'error': service.load_error}
+                print(f"Failed to activate model {version}: {service.load_error}")
+
+    def sync(self):
+        """Follow activations made by other worker processes (throttled)"""
+        now = time.monotonic()
+        if now - self._last_sync < self.sync_interval:
+            return
+        self._last_sync = now
+
+        path = self._recorded_path()
+        if path is None:
+            return
+        version = self._version_of(path)
+        if version != self._active.model_version and self._loading is None:
+            self.activate(version, record=False)
+
+    def status(self):
+        """Describe the active version, any version being loaded and the last failure"""
+        loading = self._loading
+        return {
+            'active': self._active.status(),
+            'loading_version': loading[0] if loading else None,
+            'last_error': self._last_error,
+        }
@@ -0,0 +1,222 @@
+"""
+Content-addressed cache for prediction results.
+
+Results are keyed on a SHA-256 of the raw uploaded bytes plus the version of
+the model that produced them, so re-uploads of the same CT slice skip decoding
+and inference entirely. The in-memory tier is a bounded LRU with optional TTL;
+an optional on-disk tier (one small JSON file per entry) survives restarts and
+is shared by every worker process pointed at the same directory.
+
+The disk tier holds at most ``disk_max_entries`` entries: at most every
+``disk_sweep_interval`` seconds a write starts a background sweep that deletes
+expired entries and then the least recently used ones (by file mtime, which a
+disk hit refreshes) beyond the limit.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """Thread-safe LRU/TTL cache of prediction results"""
+
+    def __init__(self, max_entries=10000, ttl_seconds=None, disk_dir=None, disk_max_entries=100000,
+                 disk_sweep_interval=60.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds or None
+        self.disk_dir = disk_dir or None
+        self.disk_max_entries = disk_max_entries
+        self.disk_sweep_interval = disk_sweep_interval
+        self._last_sweep = time.monotonic()
+        self._sweeping = False
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(image_bytes, model_version):
+        """Cache key for an uploaded image scored by a given model version"""
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        return f"{model_version}:{digest}"
+
+    @staticmethod
+    def image_hash(key):
+        """The SHA-256 of the image bytes a key was made from"""
+        return key.rpartition(':')[2]
+
+    def _expired(self, stored_at, now):
+        return self.ttl_seconds is not None and now - stored_at > self.ttl_seconds
+
+    def _disk_path(self, key):
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_dir, name[:2], name + '.json')
+
+    def _read_disk(self, key, now):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if record.get('key') != key:
+            return None
+        if self._expired(record['stored_at'], now):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            # Recently used: the sweep evicts by mtime
+            os.utime(path)
+        except OSError:
+            pass
+        return record
+
+    def _write_disk(self, key, value, stored_at):
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'key': key, 'stored_at': stored_at, 'value': value}, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _maybe_sweep(self):
+        """Start a background sweep of the disk tier if one is due"""
+        with self._lock:
+            if self._sweeping or time.monotonic() - self._last_sweep < self.disk_sweep_interval:
+                return
+            self._sweeping = True
+            self._last_sweep = time.monotonic()
+        threading.Thread(target=self.sweep_disk, name='cache-sweep', daemon=True).start()
+
+    def sweep_disk(self):
+        """Delete expired entries from the disk tier, then the oldest beyond ``disk_max_entries``
+
+        Returns the number of entries deleted. Other processes may sweep the
+        same directory at the same time; entries they already deleted are skipped.
+        """
+        try:
+            now = time.time()
+            entries = []
+            for directory, _, names in os.walk(self.disk_dir):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    try:
+                        mtime = os.stat(path).st_mtime
+                    except OSError:
+                        continue
+                    temporary = name.endswith('.tmp')
+                    # A temp file is only stale once its writer is surely done with it
+                    if not temporary or now - mtime > 60:
+                        entries.append((mtime, temporary, path))
+
+            # Newest first. An entry is stored no later than its mtime, so an
+            # entry whose mtime is past the TTL has expired
+            entries.sort(reverse=True)
+            kept = removed = 0
+            for mtime, temporary, path in entries:
+                if not temporary and not self._expired(mtime, now) and kept < self.disk_max_entries:
+                    kept += 1
+                    continue
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+            return removed
+        finally:
+            with self._lock:
+                self._sweeping = False
+
+    def _store(self, key, value, stored_at):
+        self._entries[key] = (value, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached result for ``key`` or None"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if not self._expired(stored_at, now):
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._entries[key]
+
+        if self.disk_dir:
+            record = self._read_disk(key, now)
+            if record is not None:
+                with self._lock:
+                    self._store(key, record['value'], record['stored_at'])
+                    self._hits += 1
+                    self._disk_hits += 1
+                return record['value']
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key, value):
+        """Store a JSON-serialisable result under ``key``"""
+        if not self.enabled:
+            return
+
+        stored_at = time.time()
+        with self._lock:
+            self._store(key, value, stored_at)
+        if self.disk_dir:
+            self._write_disk(key, value, stored_at)
+            self._maybe_sweep()
+
+    def clear(self):
+        """Drop every in-memory entry (the disk tier is left untouched)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit ratio and size information"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'enabled': self.enabled,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'disk_tier': self.disk_dir is not None,
+                'disk_max_entries': self.disk_max_entries if self.disk_dir else None,
+                'hits': self._hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'hit_ratio': (self._hits / lookups) if lookups else 0.0,
+            }
@@ -0,0 +1,97 @@
+"""
+Image preprocessing for model input.
+
+Images are decoded at reduced resolution where the codec allows it (JPEG
+draft mode), resized once and written straight into a caller-provided float32
+buffer, so filling an N-image batch needs no per-image float temporaries.
+"""
+
+import io
+
+import numpy as np
+from PIL import Image
+
+TARGET_SIZE = (224, 224)
+
+
+def _open_source(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+
+def load_image(source, target_size=TARGET_SIZE):
+    """Decode ``source`` to an RGB image of ``target_size`` (width, height)
+
+    ``source`` may be a file path, raw image bytes or a binary file-like object.
+    """
+    img = Image.open(_open_source(source))
+
+    # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding
+    # instead of materialising the full-resolution image first
+    if img.format == 'JPEG':
+        img.draft('RGB', target_size)
+
+    img = img.convert('RGB')
+    if img.size != target_size:
+        # reducing_gap shrinks large images by an integer factor with reduce()
+        # before the (more expensive) bicubic resample
+        img = img.resize(target_size, Image.BICUBIC, reducing_gap=3.0)
+    return img
+
+
+def decode_into(source, out):
+    """Decode one image into ``out``, a (height, width, 3) float32 array, scaled to [0, 1]"""
+    height, width = out.shape[:2]
+    pixels = np.asarray(load_image(source, (width, height)))
+    np.divide(pixels, 255, out=out, dtype=np.float32)
+    return out
+
+
+def allocate_batch(batch_size, target_size=TARGET_SIZE):
+    """Allocate an uninitialised float32 batch buffer for ``batch_size`` images"""
+    width, height = target_size
+    return np.empty((batch_size, height, width, 3), dtype=np.float32)
+
+
+def try_decode_into(source, row):
+    """Like ``decode_into`` but zero the row and return False if decoding fails"""
+    try:
+        decode_into(source, row)
+        return True
+    except Exception as e:
+        print(f"Error preprocessing image: {e}")
+        row[...] = 0.0
+        return False
+
+
+def preprocess_batch(sources, out=None, executor=None):
+    """Decode ``sources`` into consecutive rows of a float32 batch buffer
+
+    Returns ``(batch, ok)`` where ``batch`` is a view of the first
+    ``len(sources)`` rows of ``out`` (allocated when not given) and ``ok`` is a
+    boolean mask of the images that decoded successfully. Rows of images that
+    failed to decode are zeroed. With an ``executor`` the rows are decoded in
+    parallel; PIL releases the GIL while decoding and resizing.
+    """
+    if out is None:
+        out = allocate_batch(len(sources))
+    batch = out[:len(sources)]
+
+    if executor is None:
+        ok = [try_decode_into(source, batch[i]) for i, source in enumerate(sources)]
+    else:
+        ok = list(executor.map(try_decode_into, sources, batch))
+
+    return batch, np.array(ok, dtype=bool)
+
+
+def preprocess_image(image_source):
+    """Preprocess image for model prediction
+
+    ``image_source`` may be a file path, raw image bytes or a binary
+    file-like object (e.g. an uploaded ``FileStorage.stream``). Returns a
+    (1, 224, 224, 3) float32 batch, or None if the image could not be decoded.
+    """
+    batch, ok = preprocess_batch([image_source])
+    return batch if ok[0] else None
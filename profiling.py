@@ -0,0 +1,157 @@
+"""
+Opt-in per-request profiling of the prediction path.
+
+A profiled request gets a ``ProfileSession`` that records the Python side of
+the request with cProfile (or pyinstrument, when installed and selected) and
+a TensorFlow profiler trace of its forward pass, written to
+``<output_dir>/<profile_id>/`` where the profile ID is the time, a random
+part and the request ID (so a reused request ID can't overwrite an earlier
+profile):
+
+- ``python.prof`` / ``python.txt``: cProfile stats (load with ``pstats`` or
+  snakeviz) and the top functions by cumulative time
+- ``python.html``: the pyinstrument report, instead of the above
+- ``tensorflow/``: the TensorFlow trace; open it with TensorBoard's profile plugin
+- ``meta.json``: request, status and timings
+
+One request per process is profiled at a time (the TensorFlow profiler and,
+on newer Pythons, cProfile are process-wide); others that would have been
+profiled meanwhile run normally. Requests that aren't profiled pay for a
+header lookup and, when sampling is on, one random number.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+PROFILERS = ('cprofile', 'pyinstrument')
+# No leading dot: rules out '.', '..' and hidden names when used in a path
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}$')
+
+
+def valid_request_id(value):
+    return bool(value) and REQUEST_ID_PATTERN.match(value) is not None
+
+
+class ProfileSession:
+    """Profile of one request; ``stop`` writes everything to ``directory``"""
+
+    def __init__(self, directory, request_id, profiler='cprofile', details=None, on_stop=None):
+        self.directory = directory
+        self.profile_id = os.path.basename(directory)
+        self.request_id = request_id
+        self.profiler = profiler
+        self.on_stop = on_stop
+        self.meta = {'request_id': request_id, 'profiler': profiler, **(details or {})}
+        self._python = None
+        self._started = None
+        self._stopped = False
+
+    def start(self):
+        if self.profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            self._python = Profiler()
+            self._python.start()
+        else:
+            self._python = cProfile.Profile()
+            self._python.enable()
+        self._started = time.perf_counter()
+        return self
+
+    @contextmanager
+    def trace_tensorflow(self, backend='keras'):
+        """Record a TensorFlow profiler trace of the ``with`` block (keras backend only)"""
+        if backend != 'keras':
+            self.meta['tensorflow_trace'] = f'not available for the {backend} backend'
+            yield
+            return
+
+        from inference import import_tensorflow
+        tf = import_tensorflow()
+        tf.profiler.experimental.start(os.path.join(self.directory, 'tensorflow'))
+        try:
+            yield
+        finally:
+            tf.profiler.experimental.stop()
+        self.meta['tensorflow_trace'] = 'tensorflow/'
+
+    def stop(self):
+        """Stop profiling and write the results (only the first call does anything)"""
+        if self._stopped or self._python is None:
+            return
+        self._stopped = True
+        try:
+            self._write()
+        finally:
+            if self.on_stop is not None:
+                self.on_stop()
+
+    def _write(self):
+        self.meta['seconds'] = time.perf_counter() - self._started
+        os.makedirs(self.directory, exist_ok=True)
+
+        if self.profiler == 'pyinstrument':
+            self._python.stop()
+            with open(os.path.join(self.directory, 'python.html'), 'w') as f:
+                f.write(self._python.output_html())
+        else:
+            self._python.disable()
+            self._python.dump_stats(os.path.join(self.directory, 'python.prof'))
+            summary = io.StringIO()
+            pstats.Stats(self._python, stream=summary).sort_stats('cumulative').print_stats(40)
+            with open(os.path.join(self.directory, 'python.txt'), 'w') as f:
+                f.write(summary.getvalue())
+
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        print(f"Profile of request {self.request_id} written to {self.directory}")
+
+
+class RequestProfiler:
+    """Decide which requests to profile and start their sessions
+
+    The app profiles requests that ask for it (an admin's profiling header)
+    and, on sampled paths, those for which ``sampled()`` comes up true, i.e.
+    a ``sample_rate`` fraction of them.
+    """
+
+    def __init__(self, output_dir='profiles', sample_rate=0.0, profiler='cprofile'):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{profiler}', expected one of {PROFILERS}")
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.profiler = profiler
+        self._active = threading.Lock()
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def directory_for(self, request_id):
+        """A new directory under ``output_dir`` for a profile of ``request_id``"""
+        if not valid_request_id(request_id):
+            raise ValueError(f"Invalid request ID {request_id!r}")
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}-{request_id}"
+        root = os.path.realpath(self.output_dir)
+        directory = os.path.realpath(os.path.join(root, profile_id))
+        if os.path.dirname(directory) != root:
+            raise ValueError(f"Profile directory {directory} is outside {root}")
+        return directory
+
+    def start(self, request_id, **details):
+        """Start profiling a request; returns None while another request is being profiled"""
+        if not self._active.acquire(blocking=False):
+            return None
+        try:
+            directory = self.directory_for(request_id)
+            return ProfileSession(directory, request_id, self.profiler, details, on_stop=self._active.release).start()
+        except Exception:
+            self._active.release()
+            raise
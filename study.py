@@ -0,0 +1,176 @@
+"""
+Helpers for multi-image (study) prediction requests.
+
+A study upload is any mix of individual image files and zip/tar archives of
+slices. ``expand_uploads`` flattens it into ``(filename, bytes)`` pairs in
+memory and ``StudyAggregator`` summarises the per-slice results.
+"""
+
+import io
+import os
+import tarfile
+import zipfile
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+
+class StudyUploadError(ValueError):
+    """Raised when a study upload is malformed or exceeds the configured limits"""
+
+
+def _is_image_name(name):
+    base = os.path.basename(name)
+    return not base.startswith('.') and base.lower().endswith(IMAGE_EXTENSIONS)
+
+
+class _SizeBudget:
+    """Enforce the per-image and whole-upload limits on the bytes an upload expands to"""
+
+    def __init__(self, max_member_size, max_total_size=None):
+        self.max_member_size = max_member_size
+        self.remaining = max_total_size
+
+    def check(self, name, size):
+        if size > self.max_member_size:
+            raise StudyUploadError(f"{name} exceeds the per-image size limit")
+        if self.remaining is not None and size > self.remaining:
+            raise StudyUploadError(f"{name} exceeds the size limit of the whole upload")
+
+    def take(self, name, data):
+        self.check(name, len(data))
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def read(self, name, stream):
+        """Read at most one byte past the limits, whatever size the archive declares"""
+        limit = self.max_member_size if self.remaining is None else min(self.max_member_size, self.remaining)
+        return self.take(name, stream.read(limit + 1))
+
+
+def _iter_zip(data, archive_name, budget):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for info in sorted(archive.infolist(), key=lambda i: i.filename):
+            if info.is_dir() or not _is_image_name(info.filename):
+                continue
+            name = f"{archive_name}/{info.filename}"
+            budget.check(name, info.file_size)
+            with archive.open(info) as member:
+                yield name, budget.read(name, member)
+
+
+def _iter_tar(data, archive_name, budget):
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:*') as archive:
+        members = sorted(archive.getmembers(), key=lambda m: m.name)
+        for member in members:
+            if not member.isfile() or not _is_image_name(member.name):
+                continue
+            name = f"{archive_name}/{member.name}"
+            budget.check(name, member.size)
+            yield name, budget.read(name, archive.extractfile(member))
+
+
+def expand_uploads(files, max_files, max_member_size, max_total_size=None):
+    """Flatten uploaded images and archives into a list of (filename, bytes)
+
+    ``files`` is an iterable of werkzeug ``FileStorage`` objects. Archives are
+    read entirely in memory; only members with an image extension are kept.
+    Every image may be at most ``max_member_size`` bytes and all of them
+    together at most ``max_total_size``.
+    """
+    budget = _SizeBudget(max_member_size, max_total_size)
+    images = []
+    for file in files:
+        if not file or not file.filename:
+            continue
+
+        name = file.filename
+        data = file.read()
+        lowered = name.lower()
+
+        if lowered.endswith('.zip') or (not lowered.endswith(IMAGE_EXTENSIONS) and zipfile.is_zipfile(io.BytesIO(data))):
+            members = _iter_zip(data, name, budget)
+        elif lowered.endswith(ARCHIVE_EXTENSIONS):
+            members = _iter_tar(data, name, budget)
+        else:
+            members = [(name, budget.take(name, data))]
+
+        try:
+            for member in members:
+                images.append(member)
+                if len(images) > max_files:
+                    raise StudyUploadError(f"A study may contain at most {max_files} images")
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            raise StudyUploadError(f"Could not read archive {name}: {e}")
+
+    return images
+
+
+class StudyAggregator:
+    """Incrementally summarise per-slice results into a study-level finding
+
+    The study is reported as the abnormal class predicted on the most slices
+    (ties broken by the highest single-slice confidence), or ``normal_label``
+    when no slice was classified as abnormal. Only running totals are kept, so
+    results can be streamed out as soon as they are added.
+    """
+
+    def __init__(self, class_labels, normal_label='Normal'):
+        self.class_labels = list(class_labels)
+        self.normal_label = normal_label
+        self.total = 0
+        self.scored = 0
+        self.class_counts = {label: 0 for label in self.class_labels}
+        self.probability_sums = {label: 0.0 for label in self.class_labels}
+        self.max_confidence = {label: 0.0 for label in self.class_labels}
+
+    def add(self, result):
+        """Account for one per-image result (successful or ``{'error': ...}``)"""
+        self.total += 1
+        if 'error' in result:
+            return
+
+        self.scored += 1
+        label = result['prediction']
+        self.class_counts[label] += 1
+        self.max_confidence[label] = max(self.max_confidence[label], result['confidence'])
+        for name, probability in result['all_probabilities'].items():
+            self.probability_sums[name] += probability
+
+    def summary(self):
+        """Return the study-level aggregate of everything added so far"""
+        abnormal = [
+            label for label in self.class_labels
+            if label != self.normal_label and self.class_counts[label] > 0
+        ]
+        if abnormal:
+            study_prediction = max(abnormal, key=lambda label: (self.class_counts[label], self.max_confidence[label]))
+        elif self.scored:
+            study_prediction = self.normal_label
+        else:
+            study_prediction = None
+
+        return {
+            'total_images': self.total,
+            'scored_images': self.scored,
+            'failed_images': self.total - self.scored,
+            'class_counts': dict(self.class_counts),
+            'mean_probabilities': {
+                label: (self.probability_sums[label] / self.scored) if self.scored else 0.0
+                for label in self.class_labels
+            },
+            'max_confidence_by_class': dict(self.max_confidence),
+            'abnormal_images': sum(
+                count for label, count in self.class_counts.items() if label != self.normal_label
+            ),
+            'study_prediction': study_prediction,
+        }
+
+
+def aggregate_study(results, class_labels, normal_label='Normal'):
+    """Summarise a complete list of per-slice results, see ``StudyAggregator``"""
+    aggregator = StudyAggregator(class_labels, normal_label)
+    for result in results:
+        aggregator.add(result)
+    return aggregator.summary()
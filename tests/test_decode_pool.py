@@ -0,0 +1,49 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from decode_pool import DecodePool
+from preprocessing import allocate_batch
+
+
+def png_bytes(value):
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), (value, value, value)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def decode_all(pool):
+    batch, ok = pool.decode([png_bytes(0), png_bytes(255), b'not an image'], allocate_batch(3))
+    return ok.tolist(), float(batch[1].mean())
+
+
+@pytest.mark.parametrize('kind', ['thread', 'process'])
+def test_decodes(kind):
+    pool = DecodePool(2, kind=kind)
+    try:
+        assert decode_all(pool) == ([True, True, False], 1.0)
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_pool_used_before_a_fork_works_in_the_child():
+    pool = DecodePool(1)
+    decode_all(pool)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os._exit(0 if decode_all(pool) == ([True, True, False], 1.0) else 1)
+        except BaseException:
+            os._exit(2)
+    try:
+        _, status = os.waitpid(pid, 0)
+        assert os.WEXITSTATUS(status) == 0
+    finally:
+        pool.shutdown()
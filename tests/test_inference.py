@@ -0,0 +1,50 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inference import InferenceService
+
+
+class BrokenWarmupService(InferenceService):
+    def _load_backend(self):
+        def inference_fn(batch):
+            raise ValueError(f'unexpected input shape {batch.shape}')
+        return object(), inference_fn
+
+
+class WorkingService(InferenceService):
+    def _load_backend(self):
+        return object(), lambda batch: np.zeros((len(batch), 4), dtype=np.float32)
+
+
+def test_failed_warmup_is_reported_and_ends_the_wait(tmp_path):
+    model_path = tmp_path / 'model.onnx'
+    model_path.write_bytes(b'model')
+    service = BrokenWarmupService(str(model_path), backend='onnx')
+
+    assert service.load() is False
+    assert service.ready
+    assert not service.loaded
+    assert 'unexpected input shape' in service.load_error
+    assert service.load() is False
+
+
+def test_unreadable_model_file_is_reported(tmp_path):
+    service = WorkingService(str(tmp_path / 'missing.onnx'), backend='onnx')
+
+    assert service.load() is False
+    assert service.ready
+    assert service.load_error
+
+
+def test_successful_load(tmp_path):
+    model_path = tmp_path / 'model.onnx'
+    model_path.write_bytes(b'model')
+    service = WorkingService(str(model_path), backend='onnx')
+
+    assert service.load() is True
+    assert service.ready and service.loaded
+    assert service.model_version.startswith('model-')
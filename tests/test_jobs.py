@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobs import open_job_queue
+
+
+def open_queue(tmp_path, **options):
+    return open_job_queue(f"sqlite:///{tmp_path / 'jobs.db'}", **options)
+
+
+def test_poll_returns_when_any_job_finishes(tmp_path):
+    queue = open_queue(tmp_path, max_workers=2)
+    release = threading.Event()
+    quick = queue.submit('alice', lambda job_id, progress: 'quick', total=1)
+    slow = queue.submit('alice', lambda job_id, progress: release.wait(10) and 'slow', total=1)
+    others = queue.submit('bob', lambda job_id, progress: None, total=1)
+    try:
+        jobs, waited = queue.poll([quick, slow, others, 'unknown'], 'alice', wait=5)
+        assert waited
+        assert {job['id'] for job in jobs} == {quick, slow}
+        assert any(job['status'] == 'completed' for job in jobs)
+    finally:
+        release.set()
+
+
+def test_polls_beyond_max_waiters_return_at_once(tmp_path):
+    queue = open_queue(tmp_path, max_workers=1, max_waiters=1)
+    release = threading.Event()
+    job_id = queue.submit('alice', lambda job_id, progress: release.wait(10), total=1)
+    try:
+        waiter = threading.Thread(target=queue.poll, args=([job_id], 'alice', 5))
+        waiter.start()
+        time.sleep(0.2)
+
+        started = time.monotonic()
+        jobs, waited = queue.poll([job_id], 'alice', wait=5)
+        assert not waited
+        assert time.monotonic() - started < 1
+        assert jobs[0]['status'] in ('queued', 'running')
+    finally:
+        release.set()
+        waiter.join()
+
+    # The slot is free again
+    assert queue.poll([job_id], 'alice', wait=1)[1]
@@ -0,0 +1,47 @@
+import json
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_registry import ModelRegistry
+
+
+class FakeService:
+    """Stands in for InferenceService; ``load`` blocks until the version's gate opens"""
+
+    gates = {}
+
+    def __init__(self, path, version):
+        self.path = path
+        self.model_version = version
+        self.loaded = False
+        self.load_error = None
+
+    def load(self):
+        gate = self.gates.get(os.path.basename(self.path))
+        if gate is not None:
+            gate.wait(10)
+        self.loaded = True
+        return True
+
+
+def test_latest_activation_wins_over_a_slower_earlier_one(tmp_path):
+    for name in ('current.h5', 'slow.h5', 'fast.h5'):
+        (tmp_path / name).write_bytes(name.encode())
+    FakeService.gates = {'slow.h5': threading.Event()}
+    registry = ModelRegistry(str(tmp_path), FakeService, str(tmp_path / 'current.h5'))
+    registry.load()
+
+    registry.activate('slow.h5')
+    slow = registry._loading[1]
+    registry.activate('fast.h5', wait=True)
+    assert os.path.basename(registry.active.path) == 'fast.h5'
+
+    FakeService.gates['slow.h5'].set()
+    slow.join()
+    assert os.path.basename(registry.active.path) == 'fast.h5'
+    assert registry._loading is None
+    with open(registry.active_file) as f:
+        assert json.load(f)['filename'] == 'fast.h5'
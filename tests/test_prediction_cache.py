@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prediction_cache import PredictionCache
+
+
+def disk_files(directory):
+    return [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names]
+
+
+def test_sweep_keeps_the_most_recently_used_disk_entries(tmp_path):
+    cache = PredictionCache(max_entries=100, disk_dir=str(tmp_path), disk_max_entries=3, disk_sweep_interval=3600)
+    for i in range(5):
+        cache.put(f'key{i}', {'i': i})
+    # Oldest first by mtime; key0 is then used again
+    for i, path in enumerate(sorted(disk_files(tmp_path), key=os.path.getmtime)):
+        os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+    cache.clear()
+    assert cache.get('key0') == {'i': 0}
+
+    assert cache.sweep_disk() == 2
+    assert len(disk_files(tmp_path)) == 3
+    cache.clear()
+    assert cache.get('key0') == {'i': 0}
+
+
+def test_sweep_deletes_expired_entries(tmp_path):
+    cache = PredictionCache(ttl_seconds=60, disk_dir=str(tmp_path), disk_sweep_interval=3600)
+    cache.put('old', 1)
+    cache.put('new', 2)
+    old_path = cache._disk_path('old')
+    os.utime(old_path, (time.time() - 120, time.time() - 120))
+
+    assert cache.sweep_disk() == 1
+    assert not os.path.exists(old_path)
+    assert os.path.exists(cache._disk_path('new'))
+
+
+def test_writes_start_a_sweep_when_due(tmp_path):
+    cache = PredictionCache(disk_dir=str(tmp_path), disk_max_entries=2, disk_sweep_interval=0)
+    for i in range(5):
+        cache.put(f'key{i}', i)
+        deadline = time.monotonic() + 5
+        while cache._sweeping and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert len(disk_files(tmp_path)) <= 2
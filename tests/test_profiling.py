@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profiling import RequestProfiler, valid_request_id
+
+
+@pytest.mark.parametrize('request_id', ['.', '..', '...', '.hidden', '../x', 'a/b', '', 'x' * 65])
+def test_rejects_unsafe_request_ids(request_id):
+    assert not valid_request_id(request_id)
+
+
+@pytest.mark.parametrize('request_id', ['abc', 'a.b', 'req-1_2', 'a..b'])
+def test_accepts_request_ids(request_id):
+    assert valid_request_id(request_id)
+
+
+def test_profiles_stay_in_output_dir_and_are_not_overwritten(tmp_path):
+    profiler = RequestProfiler(output_dir=str(tmp_path))
+    directories = []
+    for _ in range(2):
+        session = profiler.start('same-id', path='/api/predict')
+        session.stop()
+        directories.append(session.directory)
+
+    assert directories[0] != directories[1]
+    for directory in directories:
+        assert os.path.dirname(directory) == os.path.realpath(tmp_path)
+        assert os.path.basename(directory).endswith('-same-id')
+        assert os.path.exists(os.path.join(directory, 'meta.json'))
+
+    with pytest.raises(ValueError):
+        profiler.start('..')
+    # The failed start released the lock
+    session = profiler.start('next')
+    assert session is not None
+    session.stop()
@@ -0,0 +1,67 @@
+import io
+import os
+import sys
+import tarfile
+import zipfile
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from study import StudyUploadError, expand_uploads
+
+
+def upload(name, data):
+    return FileStorage(stream=io.BytesIO(data), filename=name)
+
+
+def zip_of(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def tar_of(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_expands_images_and_archives():
+    files = [
+        upload('a.png', b'a'),
+        upload('study.zip', zip_of({'1.png': b'1', 'notes.txt': b'x'})),
+        upload('study.tar.gz', tar_of({'2.jpg': b'2'})),
+    ]
+    images = expand_uploads(files, max_files=10, max_member_size=10)
+    assert images == [('a.png', b'a'), ('study.zip/1.png', b'1'), ('study.tar.gz/2.jpg', b'2')]
+
+
+def test_plain_uploads_obey_the_per_image_limit():
+    with pytest.raises(StudyUploadError, match='per-image'):
+        expand_uploads([upload('a.png', b'x' * 11)], max_files=10, max_member_size=10)
+
+
+@pytest.mark.parametrize('archive', [zip_of, tar_of])
+def test_total_expanded_size_is_bounded(archive):
+    # Compresses to a few KB, expands to 1MB
+    members = {f'{i}.png': b'\0' * 100_000 for i in range(10)}
+    files = [upload('study.zip' if archive is zip_of else 'study.tgz', archive(members))]
+    with pytest.raises(StudyUploadError, match='whole upload'):
+        expand_uploads(files, max_files=100, max_member_size=200_000, max_total_size=500_000)
+
+
+def test_zip_member_larger_than_declared_is_rejected():
+    data = bytearray(zip_of({'1.png': b'\0' * 1000}))
+    # Make the central directory claim a 10 byte member
+    central = data.index(b'PK\x01\x02')
+    data[central + 24:central + 28] = (10).to_bytes(4, 'little')
+    with pytest.raises(StudyUploadError):
+        expand_uploads([upload('study.zip', bytes(data))], max_files=10, max_member_size=100)
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from training_data import augment_batch, augmentation_parameters
+
+
+def test_augmentation_parameters_are_independent():
+    parameters = augmentation_parameters(4096, seed=42)
+    names = sorted(parameters)
+    values = np.stack([parameters[name].numpy() for name in names])
+
+    correlations = np.corrcoef(values)
+    off_diagonal = correlations[~np.eye(len(names), dtype=bool)]
+    assert np.abs(off_diagonal).max() < 0.1, dict(zip(names, correlations.round(2).tolist()))
+
+
+def test_augmentation_parameters_cover_their_ranges():
+    parameters = {name: value.numpy() for name, value in augmentation_parameters(4096, seed=42).items()}
+
+    assert np.abs(parameters['theta']).max() <= np.radians(20.0) + 1e-6
+    assert 0.8 - 1e-6 <= parameters['zoom_x'].min() and parameters['zoom_x'].max() <= 1.2 + 1e-6
+    assert np.abs(parameters['shift_x']).max() <= 0.2 + 1e-6
+    assert set(np.unique(parameters['flip'])) == {-1.0, 1.0}
+    # Rotation and flip used to come from the same draw
+    assert (np.sign(parameters['theta']) == parameters['flip']).mean() < 0.6
+
+
+def test_augment_batch_keeps_shape():
+    images = np.random.default_rng(0).random((4, 32, 32, 3)).astype(np.float32)
+    assert augment_batch(images, seed=1).shape == images.shape
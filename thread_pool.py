@@ -0,0 +1,56 @@
+"""
+Worker pools for background work in a (possibly forked) server process.
+
+gunicorn forks its workers from a master that may already have imported the
+app; an executor made before the fork is copied into the child without its
+threads (or, for a process pool, with management threads and pipes that
+belong to the parent), so work submitted to it would never run.
+``LazyThreadPool`` and ``LazyProcessPool`` create their executor on first
+use and again whenever they're used from a different process.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class LazyThreadPool:
+    """A ``ThreadPoolExecutor`` of ``max_workers`` threads, created in the process that uses it"""
+
+    def __init__(self, max_workers, thread_name_prefix=''):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _create(self):
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.thread_name_prefix)
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor_pid = os.getpid()
+                self._executor = self._create()
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        """Shut the executor down if this process created one"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            if executor is not None and self._executor_pid == os.getpid():
+                executor.shutdown(wait=wait)
+
+
+class LazyProcessPool(LazyThreadPool):
+    """A ``ProcessPoolExecutor`` of ``max_workers`` processes, created in the process that uses it"""
+
+    def __init__(self, max_workers):
+        super().__init__(max_workers)
+
+    def _create(self):
+        return ProcessPoolExecutor(max_workers=self.max_workers)
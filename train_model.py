@@ -1,22 +1,29 @@
 import tensorflow as tf
 from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.models import Model
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
+import argparse
 import os
-import numpy as np
-from PIL import Image
+import shutil
 import matplotlib.pyplot as plt
 
-def create_model(num_classes=4):
+from feature_cache import build_feature_cache, feature_dataset
+from training_checkpoint import PhaseCheckpoint
+from training_config import PRECISIONS, EpochTimer, GradientAccumulationModel, configure_training, ensure_onednn
+from training_data import open_dataset, prepare_datasets, stratified_split
+
+def create_model(num_classes=4, weights='imagenet', accumulation_steps=1):
     """
     Create MobileNetV2 model with transfer learning for kidney anomaly classification
+    
+    With ``accumulation_steps`` > 1 the model averages the gradients of that
+    many batches before every optimizer step.
     """
     # Load pre-trained MobileNetV2
     base_model = MobileNetV2(
-        weights='imagenet',
+        weights=weights,
         include_top=False,
         input_shape=(224, 224, 3)
     )
@@ -38,61 +45,75 @@ def create_model(num_classes=4):
     x = Dropout(0.2)(x)
     x = Dense(512, activation='relu')(x)
     x = Dropout(0.3)(x)
-    outputs = Dense(num_classes, activation='softmax')(x)
+    # Softmax in float32 even under a mixed precision policy
+    outputs = Dense(num_classes, activation='softmax', dtype='float32')(x)
+    
+    if accumulation_steps > 1:
+        return GradientAccumulationModel(inputs, outputs, accumulation_steps=accumulation_steps)
     
     model = Model(inputs, outputs)
     
     return model
 
-def prepare_data_generators(data_dir, batch_size=32):
+def create_head(feature_dim, num_classes=4):
     """
-    Prepare data generators for training and validation
+    Create the classifier head of create_model() on its own, taking pooled backbone features
     """
-    # Data augmentation for training
-    train_datagen = ImageDataGenerator(
-        rescale=1./255,
-        rotation_range=20,
-        width_shift_range=0.2,
-        height_shift_range=0.2,
-        shear_range=0.2,
-        zoom_range=0.2,
-        horizontal_flip=True,
-        fill_mode='nearest',
-        validation_split=0.2
-    )
-    
-    # Only rescaling for validation
-    val_datagen = ImageDataGenerator(
-        rescale=1./255,
-        validation_split=0.2
-    )
-    
-    # Training generator
-    train_generator = train_datagen.flow_from_directory(
-        data_dir,
-        target_size=(224, 224),
-        batch_size=batch_size,
-        class_mode='categorical',
-        subset='training'
-    )
+    inputs = tf.keras.Input(shape=(feature_dim,))
+    x = Dropout(0.2)(inputs)
+    x = Dense(512, activation='relu')(x)
+    x = Dropout(0.3)(x)
+    outputs = Dense(num_classes, activation='softmax', dtype='float32')(x)
     
-    # Validation generator
-    val_generator = val_datagen.flow_from_directory(
-        data_dir,
-        target_size=(224, 224),
-        batch_size=batch_size,
-        class_mode='categorical',
-        subset='validation'
-    )
+    return Model(inputs, outputs)
+
+def find_backbone(model):
+    """
+    Return the MobileNetV2 sub-model of a model built by create_model()
+    """
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.Model):
+            return layer
+    raise ValueError('Model has no backbone sub-model')
+
+def copy_head_weights(head, model):
+    """
+    Copy the weights of a head trained by train_head_on_features() into the full model
+    """
+    head_layers = [layer for layer in head.layers if isinstance(layer, Dense)]
+    model_layers = [layer for layer in model.layers if isinstance(layer, Dense)]
+    for source, target in zip(head_layers, model_layers):
+        target.set_weights(source.get_weights())
+
+def save_for_serving(model, path):
+    """
+    Save ``model``'s weights as a plain float32 create_model() network
     
-    return train_generator, val_generator
+    Models trained with mixed precision or gradient accumulation are copied
+    into an ordinary Keras model first, so the server can load the file
+    without custom objects and runs it in float32.
+    """
+    policy = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy('float32')
+    try:
+        serving_model = create_model(num_classes=model.output_shape[-1], weights=None)
+    finally:
+        tf.keras.mixed_precision.set_global_policy(policy)
+    
+    serving_model.set_weights(model.get_weights())
+    serving_model.save(path, include_optimizer=False)
+    print(f"Model saved as {path}")
 
-def train_model(data_dir, epochs=50, batch_size=32):
+def train_model(data_dir, epochs=50, batch_size=32, accumulation_steps=1, checkpoint_dir=None, checkpoint_every=1):
     """
     Train the kidney anomaly detection model
+    
+    With ``checkpoint_dir`` the model and optimizer state are checkpointed
+    every ``checkpoint_every`` epochs, and training resumes from the latest
+    checkpoint found there.
     """
     # Create model
-    model = create_model()
+    model = create_model(accumulation_steps=accumulation_steps)
     
     # Compile model
     model.compile(
@@ -101,16 +122,22 @@ def train_model(data_dir, epochs=50, batch_size=32):
         metrics=['accuracy']
     )
     
-    # Prepare data generators
-    train_generator, val_generator = prepare_data_generators(data_dir, batch_size)
+    # Prepare the tf.data input pipelines
+    train_dataset, val_dataset = prepare_datasets(data_dir, batch_size)
+    
+    # Resume from the latest checkpoint of this phase, if any
+    phase_checkpoint, initial_epoch = resume_phase(model, checkpoint_dir, checkpoint_every)
     
-    # Create callbacks
+    # Create callbacks (the best weights are exported for serving after training)
+    checkpoint_path = 'models/kidney_anomaly_model.best.weights.h5'
     checkpoint = ModelCheckpoint(
-        'models/kidney_anomaly_model.h5',
+        checkpoint_path,
         monitor='val_accuracy',
         save_best_only=True,
+        save_weights_only=True,
         mode='max',
-        verbose=1
+        verbose=1,
+        initial_value_threshold=phase_checkpoint.best if phase_checkpoint and initial_epoch else None
     )
     
     early_stopping = EarlyStopping(
@@ -128,23 +155,117 @@ def train_model(data_dir, epochs=50, batch_size=32):
         verbose=1
     )
     
+    callbacks = [checkpoint, early_stopping, reduce_lr, EpochTimer(batch_size)]
+    if phase_checkpoint:
+        callbacks.append(phase_checkpoint)
+    
     # Train the model
     history = model.fit(
-        train_generator,
+        train_dataset,
         epochs=epochs,
-        validation_data=val_generator,
-        callbacks=[checkpoint, early_stopping, reduce_lr],
+        initial_epoch=initial_epoch,
+        validation_data=val_dataset,
+        callbacks=callbacks,
         verbose=1
     )
     
+    model.load_weights(checkpoint_path)
+    save_for_serving(model, 'models/kidney_anomaly_model.h5')
+    if phase_checkpoint:
+        phase_checkpoint.complete(model)
+    
     return model, history
 
-def fine_tune_model(model, data_dir, epochs=20, batch_size=16):
+def resume_phase(model, checkpoint_dir, checkpoint_every=1):
+    """
+    Attach a PhaseCheckpoint to the compiled ``model`` and restore its latest state
+    
+    Returns ``(phase_checkpoint, initial_epoch)``; ``(None, 0)`` without a checkpoint directory.
+    """
+    if not checkpoint_dir:
+        return None, 0
+    phase_checkpoint = PhaseCheckpoint(checkpoint_dir, every_epochs=checkpoint_every)
+    return phase_checkpoint, phase_checkpoint.restore(model)
+
+def train_head_on_features(data_dir, epochs=50, batch_size=32, feature_dir='data/features', augment_copies=0,
+                           accumulation_steps=1, checkpoint_dir=None):
+    """
+    Train the model's head on precomputed features of the frozen backbone
+    
+    The backbone runs once over the dataset (plus ``augment_copies`` fixed
+    augmented passes of the training split) and its pooled features are kept
+    on disk in ``feature_dir``, so each epoch only runs the small Dense head.
+    Returns the full model with the trained head, ready for fine_tune_model().
+    Head training takes seconds, so it is not checkpointed per epoch; with
+    ``checkpoint_dir`` only the finished model is checkpointed.
+    ``accumulation_steps`` is kept on the returned model for fine-tuning.
+    """
+    model = create_model(accumulation_steps=accumulation_steps)
+    
+    images, shards = open_dataset(data_dir)
+    train_samples, val_samples = stratified_split(images)
+    features = build_feature_cache(
+        model,
+        {'train': train_samples, 'validation': val_samples},
+        feature_dir,
+        augment_copies=augment_copies,
+        shards=shards
+    )
+    train_features, train_labels = features['train']
+    val_features, val_labels = features['validation']
+    
+    head = create_head(train_features.shape[1])
+    head.compile(
+        optimizer=Adam(learning_rate=0.001),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    
+    early_stopping = EarlyStopping(
+        monitor='val_loss',
+        patience=10,
+        restore_best_weights=True,
+        verbose=1
+    )
+    
+    reduce_lr = ReduceLROnPlateau(
+        monitor='val_loss',
+        factor=0.2,
+        patience=5,
+        min_lr=1e-7,
+        verbose=1
+    )
+    
+    history = head.fit(
+        feature_dataset(train_features, train_labels, batch_size, training=True),
+        epochs=epochs,
+        validation_data=feature_dataset(val_features, val_labels, batch_size),
+        callbacks=[early_stopping, reduce_lr, EpochTimer(batch_size, len(train_labels))],
+        verbose=1
+    )
+    
+    # Put the best head on top of the backbone and save the full model
+    copy_head_weights(head, model)
+    model.compile(
+        optimizer=Adam(learning_rate=0.001),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    save_for_serving(model, 'models/kidney_anomaly_model.h5')
+    if checkpoint_dir:
+        PhaseCheckpoint(checkpoint_dir).complete(model)
+    
+    return model, history
+
+def fine_tune_model(model, data_dir, epochs=20, batch_size=16, checkpoint_dir=None, checkpoint_every=1):
     """
     Fine-tune the model by unfreezing some layers
+    
+    ``model`` is the model trained by train_model() (or train_head_on_features()).
+    See train_model() for ``checkpoint_dir``.
     """
     # Unfreeze the top layers of the base model
-    base_model = model.layers[2]  # MobileNetV2 layer
+    base_model = find_backbone(model)  # MobileNetV2 layer
     base_model.trainable = True
     
     # Freeze all the layers before the last 30 layers
@@ -158,16 +279,22 @@ def fine_tune_model(model, data_dir, epochs=20, batch_size=16):
         metrics=['accuracy']
     )
     
-    # Prepare data generators
-    train_generator, val_generator = prepare_data_generators(data_dir, batch_size)
+    # Prepare the tf.data input pipelines
+    train_dataset, val_dataset = prepare_datasets(data_dir, batch_size)
+    
+    # Resume from the latest checkpoint of this phase, if any
+    phase_checkpoint, initial_epoch = resume_phase(model, checkpoint_dir, checkpoint_every)
     
-    # Create callbacks
+    # Create callbacks (the best weights are exported for serving after training)
+    checkpoint_path = 'models/kidney_anomaly_model_finetuned.best.weights.h5'
     checkpoint = ModelCheckpoint(
-        'models/kidney_anomaly_model_finetuned.h5',
+        checkpoint_path,
         monitor='val_accuracy',
         save_best_only=True,
+        save_weights_only=True,
         mode='max',
-        verbose=1
+        verbose=1,
+        initial_value_threshold=phase_checkpoint.best if phase_checkpoint and initial_epoch else None
     )
     
     early_stopping = EarlyStopping(
@@ -177,21 +304,35 @@ def fine_tune_model(model, data_dir, epochs=20, batch_size=16):
         verbose=1
     )
     
+    callbacks = [checkpoint, early_stopping, EpochTimer(batch_size)]
+    if phase_checkpoint:
+        callbacks.append(phase_checkpoint)
+    
     # Fine-tune the model
     history = model.fit(
-        train_generator,
+        train_dataset,
         epochs=epochs,
-        validation_data=val_generator,
-        callbacks=[checkpoint, early_stopping],
+        initial_epoch=initial_epoch,
+        validation_data=val_dataset,
+        callbacks=callbacks,
         verbose=1
     )
     
+    model.load_weights(checkpoint_path)
+    save_for_serving(model, 'models/kidney_anomaly_model_finetuned.h5')
+    if phase_checkpoint:
+        phase_checkpoint.complete(model)
+    
     return model, history
 
 def plot_training_history(history):
     """
     Plot training history
     """
+    if history is None or not history.history:
+        print("No training epochs were run, skipping the training history plot")
+        return
+    
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 5))
     
     # Plot accuracy
@@ -233,6 +374,39 @@ def create_sample_data_structure():
     print("data/kidney_ct_scans/Tumor/ - for tumor images")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train the kidney anomaly detection model')
+    parser.add_argument('--data-dir', default='data/kidney_ct_scans',
+                        help='Images in <class>/ folders, or a shard directory from dataset_shards.py')
+    parser.add_argument('--precomputed-features', action='store_true',
+                        help='Train the head on cached backbone features instead of images (first phase only)')
+    parser.add_argument('--feature-dir', default='data/features', help='Where precomputed features are stored')
+    parser.add_argument('--feature-augment-copies', type=int, default=0,
+                        help='Extra fixed-augmentation passes of the training split to extract features for')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--fine-tune-epochs', type=int, default=15)
+    parser.add_argument('--fine-tune-batch-size', type=int, default=16)
+    parser.add_argument('--precision', choices=PRECISIONS, default='float32',
+                        help="'mixed_bfloat16' computes in bfloat16 with float32 weights; 'auto' uses it when the CPU supports bfloat16")
+    parser.add_argument('--intra-op-threads', type=int, default=0, help='Threads per op (0: TensorFlow default)')
+    parser.add_argument('--inter-op-threads', type=int, default=0, help='Ops run concurrently (0: TensorFlow default)')
+    parser.add_argument('--onednn', choices=['default', 'on', 'off'], default='default',
+                        help='Toggle oneDNN optimizations (TF_ENABLE_ONEDNN_OPTS)')
+    parser.add_argument('--accumulation-steps', type=int, default=1,
+                        help='Batches whose gradients are averaged per optimizer step (effective batch = batch size x steps)')
+    parser.add_argument('--checkpoint-dir', default='checkpoints',
+                        help='Where model and optimizer state are checkpointed during training')
+    parser.add_argument('--checkpoint-every', type=int, default=1, help='Checkpoint every N epochs')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from the latest checkpoints instead of starting over')
+    args = parser.parse_args()
+    
+    ensure_onednn(args.onednn)
+    precision = configure_training(args.precision, args.intra_op_threads, args.inter_op_threads)
+    print(f"Precision: {precision}, oneDNN: {os.environ.get('TF_ENABLE_ONEDNN_OPTS', 'default')}, "
+          f"threads: intra={args.intra_op_threads or 'default'} inter={args.inter_op_threads or 'default'}, "
+          f"effective batch size: {args.batch_size * args.accumulation_steps}")
+    
     # Create necessary directories
     os.makedirs('models', exist_ok=True)
     os.makedirs('data', exist_ok=True)
@@ -241,36 +415,78 @@ if __name__ == "__main__":
     create_sample_data_structure()
     
     # Check if data directory exists and has images
-    data_dir = 'data/kidney_ct_scans'
+    data_dir = args.data_dir
     if not os.path.exists(data_dir):
         print(f"Data directory {data_dir} does not exist. Please create it and add your CT scan images.")
         exit(1)
     
     # Check if there are images in the data directory
-    total_images = 0
-    for class_name in ['Normal', 'Cyst', 'Stone', 'Tumor']:
-        class_dir = os.path.join(data_dir, class_name)
-        if os.path.exists(class_dir):
-            images = [f for f in os.listdir(class_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-            total_images += len(images)
-            print(f"{class_name}: {len(images)} images")
+    samples, _ = open_dataset(data_dir)
+    total_images = len(samples)
+    for label_index, class_name in enumerate(['Normal', 'Cyst', 'Stone', 'Tumor']):
+        count = sum(1 for _, label in samples if label == label_index)
+        print(f"{class_name}: {count} images")
     
     if total_images == 0:
         print("No images found in the data directory. Please add CT scan images before training.")
         exit(1)
     
     print(f"\nTotal images found: {total_images}")
-    print("Starting model training...")
-    
-    # Train the model
-    model, history = train_model(data_dir, epochs=30, batch_size=32)
-    
-    # Fine-tune the model
-    print("\nStarting fine-tuning...")
-    model, history_finetune = train_model(data_dir, epochs=15, batch_size=16)
-    
-    # Plot training history
-    plot_training_history(history)
     
-    print("\nTraining completed! Model saved as 'backend/models/kidney_anomaly_model.h5'")
+    # Each phase checkpoints into its own directory
+    head_checkpoint_dir = os.path.join(args.checkpoint_dir, 'head')
+    fine_tune_checkpoint_dir = os.path.join(args.checkpoint_dir, 'fine_tune')
+    if not args.resume and os.path.isdir(args.checkpoint_dir):
+        print(f"Starting over, removing previous checkpoints in {args.checkpoint_dir}")
+        shutil.rmtree(args.checkpoint_dir)
+    
+    # Train the model (skipped when a resumed run already finished this phase)
+    head_checkpoint = PhaseCheckpoint(head_checkpoint_dir)
+    history = None
+    if head_checkpoint.completed:
+        print("First phase already completed, loading its weights...")
+        model = create_model(accumulation_steps=args.accumulation_steps)
+        head_checkpoint.restore_weights(model)
+    elif args.precomputed_features:
+        print("Starting model training...")
+        model, history = train_head_on_features(
+            data_dir,
+            epochs=args.epochs,
+            batch_size=args.batch_size,
+            feature_dir=args.feature_dir,
+            augment_copies=args.feature_augment_copies,
+            accumulation_steps=args.accumulation_steps,
+            checkpoint_dir=head_checkpoint_dir
+        )
+    else:
+        print("Starting model training...")
+        model, history = train_model(
+            data_dir,
+            epochs=args.epochs,
+            batch_size=args.batch_size,
+            accumulation_steps=args.accumulation_steps,
+            checkpoint_dir=head_checkpoint_dir,
+            checkpoint_every=args.checkpoint_every
+        )
+    
+    # Fine-tune the trained model (unless a resumed run already finished that too)
+    history_finetune = None
+    if PhaseCheckpoint(fine_tune_checkpoint_dir).completed:
+        print("\nFine-tuning already completed, models/kidney_anomaly_model_finetuned.h5 is up to date")
+    else:
+        print("\nStarting fine-tuning...")
+        model, history_finetune = fine_tune_model(
+            model,
+            data_dir,
+            epochs=args.fine_tune_epochs,
+            batch_size=args.fine_tune_batch_size,
+            checkpoint_dir=fine_tune_checkpoint_dir,
+            checkpoint_every=args.checkpoint_every
+        )
+    
+    # Plot training history of whichever phase ran
+    plot_training_history(history if history is not None and history.history else history_finetune)
+    
+    print("\nTraining completed! Models saved as 'models/kidney_anomaly_model.h5' and "
+          "'models/kidney_anomaly_model_finetuned.h5'")
     print("You can now run the Flask application.")
@@ -0,0 +1,109 @@
+"""
+Resumable training phases.
+
+``PhaseCheckpoint`` saves the model weights, the full optimizer state (slots,
+iteration count, learning rate) and the epoch counter of one training phase
+with ``tf.train.Checkpoint`` every few epochs. An interrupted phase restores
+the latest checkpoint and continues from the next epoch; a finished phase is
+marked as completed and its final weights are saved on their own, so a
+resumed run can skip straight to the next phase.
+"""
+
+import json
+import os
+
+import tensorflow as tf
+
+STATE_FILE = 'state.json'
+FINAL_WEIGHTS_FILE = 'final.weights.h5'
+
+
+class PhaseCheckpoint(tf.keras.callbacks.Callback):
+    """Keras callback checkpointing one training phase to ``directory``"""
+
+    def __init__(self, directory, every_epochs=1, max_to_keep=2, monitor='val_accuracy'):
+        super().__init__()
+        self.directory = directory
+        self.every_epochs = max(1, every_epochs)
+        self.max_to_keep = max_to_keep
+        self.monitor = monitor
+        self.state = self._load_state()
+        self._epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self._manager = None
+
+    def _load_state(self):
+        try:
+            with open(os.path.join(self.directory, STATE_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'completed': False, 'epoch': 0, 'best': None}
+
+    def _save_state(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, STATE_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    @property
+    def completed(self):
+        return bool(self.state.get('completed'))
+
+    @property
+    def best(self):
+        """Best value of ``monitor`` seen so far in this phase (None before the first epoch)"""
+        return self.state.get('best')
+
+    def _attach(self, model):
+        optimizer = getattr(model, 'optimizer', None)
+        if optimizer is not None and hasattr(optimizer, 'built') and not optimizer.built:
+            # Create the slot variables now so they are restored, not left fresh
+            optimizer.build(model.trainable_variables)
+
+        objects = {'model': model, 'epoch': self._epoch}
+        if optimizer is not None:
+            objects['optimizer'] = optimizer
+        checkpoint = tf.train.Checkpoint(**objects)
+        self._manager = tf.train.CheckpointManager(checkpoint, self.directory, max_to_keep=self.max_to_keep)
+        return checkpoint
+
+    def restore(self, model):
+        """Restore ``model`` (compiled) and its optimizer; returns the epoch to resume from"""
+        checkpoint = self._attach(model)
+        if self._manager.latest_checkpoint is None:
+            return 0
+        checkpoint.restore(self._manager.latest_checkpoint).expect_partial()
+        print(f"Resumed from {self._manager.latest_checkpoint} (epoch {int(self._epoch.numpy())})")
+        return int(self._epoch.numpy())
+
+    def restore_weights(self, model):
+        """Load the final weights of a completed phase into ``model``
+
+        A plain weights file rather than the tf.train checkpoint, whose
+        optimizer state would otherwise be restored into the next phase's
+        optimizer as soon as it is created.
+        """
+        model.load_weights(os.path.join(self.directory, FINAL_WEIGHTS_FILE))
+
+    def save(self, epoch):
+        if self._manager is None:
+            self._attach(self.model)
+        self._epoch.assign(epoch)
+        path = self._manager.save()
+        self.state['epoch'] = epoch
+        self._save_state()
+        return path
+
+    def on_epoch_end(self, epoch, logs=None):
+        value = (logs or {}).get(self.monitor)
+        if value is not None and (self.best is None or value > self.best):
+            self.state['best'] = float(value)
+        if (epoch + 1) % self.every_epochs == 0:
+            self.save(epoch + 1)
+
+    def complete(self, model):
+        """Save the final weights of the phase and mark it as completed"""
+        os.makedirs(self.directory, exist_ok=True)
+        model.save_weights(os.path.join(self.directory, FINAL_WEIGHTS_FILE))
+        self.state['completed'] = True
+        self._save_state()
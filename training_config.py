@@ -0,0 +1,154 @@
+"""
+CPU training configuration: precision, thread pools, oneDNN and gradient accumulation.
+
+``train_model.py`` exposes these as command line flags. oneDNN is toggled
+through ``TF_ENABLE_ONEDNN_OPTS``, which TensorFlow only reads when it is
+imported, so ``ensure_onednn`` restarts the process when the flag disagrees
+with the environment. Everything else must be configured before the first
+TensorFlow op runs, i.e. before the model is built.
+"""
+
+import os
+import sys
+import time
+
+import tensorflow as tf
+
+from inference import configure_threads
+
+PRECISIONS = ('float32', 'mixed_bfloat16', 'auto')
+BF16_CPU_FLAGS = ('avx512_bf16', 'amx_bf16')
+
+
+def cpu_supports_bfloat16():
+    """True when the CPU has native bfloat16 instructions (AVX512-BF16 or AMX)"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return any(flag in flags for flag in BF16_CPU_FLAGS)
+
+
+def ensure_onednn(setting):
+    """Re-execute the process with ``TF_ENABLE_ONEDNN_OPTS`` set for ``setting`` ('on'/'off')
+
+    'default' leaves TensorFlow's own choice alone.
+    """
+    if setting == 'default':
+        return
+    wanted = '1' if setting == 'on' else '0'
+    if os.environ.get('TF_ENABLE_ONEDNN_OPTS') != wanted:
+        os.environ['TF_ENABLE_ONEDNN_OPTS'] = wanted
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+
+def configure_training(precision='float32', intra_op_threads=0, inter_op_threads=0):
+    """Set the Keras precision policy and TensorFlow's thread pools; returns the policy name
+
+    'auto' uses mixed bfloat16 only on CPUs with native bfloat16 support;
+    elsewhere bfloat16 math is emulated and slower than float32.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {PRECISIONS}")
+    if precision == 'auto':
+        precision = 'mixed_bfloat16' if cpu_supports_bfloat16() else 'float32'
+    elif precision == 'mixed_bfloat16' and not cpu_supports_bfloat16():
+        print('Warning: this CPU has no native bfloat16 support, mixed precision will be slow')
+
+    configure_threads(intra_op_threads, inter_op_threads)
+    tf.keras.mixed_precision.set_global_policy(precision)
+    return precision
+
+
+class GradientAccumulationModel(tf.keras.Model):
+    """Functional model that applies the mean gradient of every ``accumulation_steps`` batches
+
+    Emulates a batch ``accumulation_steps`` times larger than the one that
+    fits through the model at once. Accumulators are (re)created on every
+    ``compile``, so recompiling after changing which layers are trainable
+    (as ``fine_tune_model`` does) picks up the new trainable variables.
+    """
+
+    def __init__(self, *args, accumulation_steps=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.accumulation_steps = accumulation_steps
+        self._accumulators = []
+        self._accumulated_batches = None
+
+    def compile(self, *args, **kwargs):
+        super().compile(*args, **kwargs)
+        # Build the optimizer now: its variables can't be created inside tf.cond
+        self.optimizer.build(self.trainable_variables)
+        self._accumulators = [
+            tf.Variable(tf.zeros(variable.shape, dtype=variable.dtype), trainable=False)
+            for variable in self.trainable_variables
+        ]
+        self._accumulated_batches = tf.Variable(0, dtype=tf.int64, trainable=False)
+
+    def train_step(self, data):
+        x, y = data[0], data[1]
+        with tf.GradientTape() as tape:
+            y_pred = self(x, training=True)
+            loss = self.compute_loss(x=x, y=y, y_pred=y_pred)
+        # Keras 3 tracks the loss in train_step rather than in compute_loss
+        loss_tracker = getattr(self, '_loss_tracker', None)
+        if loss_tracker is not None:
+            loss_tracker.update_state(loss)
+        gradients = tape.gradient(loss, self.trainable_variables)
+
+        for accumulator, gradient in zip(self._accumulators, gradients):
+            accumulator.assign_add(tf.cast(gradient, accumulator.dtype) / self.accumulation_steps)
+        self._accumulated_batches.assign_add(1)
+
+        def apply_gradients():
+            self.optimizer.apply_gradients(zip(
+                [accumulator.read_value() for accumulator in self._accumulators],
+                self.trainable_variables
+            ))
+            for accumulator in self._accumulators:
+                accumulator.assign(tf.zeros_like(accumulator))
+            return tf.constant(True)
+
+        tf.cond(
+            self._accumulated_batches % self.accumulation_steps == 0,
+            apply_gradients,
+            lambda: tf.constant(False)
+        )
+        return self.compute_metrics(x, y, y_pred, sample_weight=None)
+
+
+class EpochTimer(tf.keras.callbacks.Callback):
+    """Print and record the wall time and training throughput of every epoch
+
+    Throughput is the number of training batches times ``batch_size`` (capped
+    at ``samples_per_epoch`` when it is known) over the time spent on them,
+    excluding validation.
+    """
+
+    def __init__(self, batch_size, samples_per_epoch=None):
+        super().__init__()
+        self.batch_size = batch_size
+        self.samples_per_epoch = samples_per_epoch
+        self.epochs = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = self._train_end = time.perf_counter()
+        self._batches = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._batches += 1
+        self._train_end = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        seconds = time.perf_counter() - self._start
+        train_seconds = max(self._train_end - self._start, 1e-9)
+        samples = self._batches * self.batch_size
+        if self.samples_per_epoch:
+            samples = min(samples, self.samples_per_epoch)
+        self.epochs.append({
+            'epoch': epoch + 1,
+            'seconds': seconds,
+            'samples_per_sec': samples / train_seconds,
+        })
+        print(f"Epoch {epoch + 1}: {seconds:.1f}s wall time, {samples / train_seconds:.1f} samples/sec")
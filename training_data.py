@@ -0,0 +1,224 @@
+"""
+tf.data input pipelines for training and evaluating the classifier.
+
+Images are listed from ``data_dir/<class>/`` and split into training and
+validation sets per class with a fixed seed, so every run (and every machine)
+sees the same split. Decoding and resizing run in parallel inside tf.data,
+decoded uint8 images are cached after the first epoch, augmentation runs as
+one fused affine transform over whole batches and batches are prefetched
+while the model trains on the previous one.
+
+``data_dir`` may also be a directory of preprocessed shards (see
+``dataset_shards.py``), in which case images are read from memory-mapped
+uint8 arrays instead of being decoded.
+
+Images are scaled to [0, 1], like ``preprocessing.preprocess_image`` does for
+serving. Labels are one-hot and follow ``inference.CLASS_LABELS``.
+"""
+
+import math
+import os
+import random
+
+import tensorflow as tf
+
+from inference import CLASS_LABELS
+
+IMAGE_SIZE = (224, 224)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+AUTOTUNE = tf.data.AUTOTUNE
+
+
+def list_labelled_images(data_dir, class_labels=CLASS_LABELS):
+    """Return ``[(path, label_index)]`` for every image under ``data_dir/<class>/``"""
+    images = []
+    for label_index, class_name in enumerate(class_labels):
+        class_dir = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                images.append((os.path.join(class_dir, name), label_index))
+    return images
+
+
+def open_dataset(data_dir):
+    """Return ``(samples, shards)`` for an image directory or a shard directory
+
+    ``samples`` is ``[(path, label_index)]``; ``shards`` is the
+    ``ShardedDataset`` to read them from, or None for image files.
+    """
+    from dataset_shards import ShardedDataset, is_shard_dir
+
+    if is_shard_dir(data_dir):
+        shards = ShardedDataset(data_dir)
+        return shards.samples, shards
+    return list_labelled_images(data_dir), None
+
+
+def stratified_split(images, validation_split=0.2, seed=42):
+    """Split ``[(path, label)]`` into train and validation lists, class by class
+
+    Each class is shuffled with its own seeded generator and contributes the
+    same fraction of its images to validation, so the split only depends on
+    the file names and ``seed``.
+    """
+    by_class = {}
+    for path, label in sorted(images):
+        by_class.setdefault(label, []).append((path, label))
+
+    train, validation = [], []
+    for label, items in sorted(by_class.items()):
+        random.Random(f"{seed}-{label}").shuffle(items)
+        n_validation = int(round(len(items) * validation_split))
+        # Keep at least one training image for every class
+        n_validation = min(n_validation, len(items) - 1)
+        validation.extend(items[:n_validation])
+        train.extend(items[n_validation:])
+    return train, validation
+
+
+def decode_image(path, image_size=IMAGE_SIZE):
+    """Read, decode and resize one image file to a (height, width, 3) uint8 tensor"""
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, image_size, method='bicubic', antialias=True)
+    return tf.cast(tf.clip_by_value(tf.round(image), 0.0, 255.0), tf.uint8)
+
+
+def augmentation_parameters(batch_size, rotation_range=20.0, shift_range=0.2, zoom_range=0.2,
+                            shear_range=0.2, horizontal_flip=True, seed=None):
+    """Draw independent random transform parameters for ``batch_size`` images
+
+    Returns ``theta``, ``shear`` (radians), ``zoom_x``, ``zoom_y``,
+    ``shift_x``, ``shift_y`` (fractions of the image size) and ``flip``
+    (-1 or 1), each of shape ``[batch_size]``. They are drawn as the columns
+    of one random matrix: separate ``tf.random.uniform`` calls with the same
+    op seed would all return the same sequence.
+    """
+    draws = tf.random.uniform([batch_size, 7], seed=seed)
+
+    def column(index, low, high):
+        return low + (high - low) * draws[:, index]
+
+    theta = math.radians(rotation_range)
+    shear = math.radians(shear_range)
+    parameters = {
+        'theta': column(0, -theta, theta),
+        'shear': column(1, -shear, shear),
+        'zoom_x': column(2, 1.0 - zoom_range, 1.0 + zoom_range),
+        'zoom_y': column(3, 1.0 - zoom_range, 1.0 + zoom_range),
+        'shift_x': column(4, -shift_range, shift_range),
+        'shift_y': column(5, -shift_range, shift_range),
+        'flip': tf.ones([batch_size]),
+    }
+    if horizontal_flip:
+        parameters['flip'] = tf.where(draws[:, 6] < 0.5, -1.0, 1.0)
+    return parameters
+
+
+def augment_batch(images, rotation_range=20.0, shift_range=0.2, zoom_range=0.2,
+                  shear_range=0.2, horizontal_flip=True, seed=None):
+    """Randomly rotate, shift, zoom, shear and flip a (batch, height, width, 3) float tensor
+
+    Uses the same parameters as the old ``ImageDataGenerator`` setup (angles in
+    degrees, shifts as a fraction of the image size, nearest fill). All the
+    transforms of an image are composed into one matrix, so the whole batch is
+    resampled once by a single vectorized op instead of once per transform.
+    """
+    shape = tf.shape(images)
+    batch_size = shape[0]
+    height = tf.cast(shape[1], tf.float32)
+    width = tf.cast(shape[2], tf.float32)
+
+    parameters = augmentation_parameters(
+        batch_size, rotation_range, shift_range, zoom_range, shear_range, horizontal_flip, seed
+    )
+    theta = parameters['theta']
+    shear = parameters['shear']
+    zoom_x = parameters['zoom_x']
+    zoom_y = parameters['zoom_y']
+    shift_x = parameters['shift_x'] * width
+    shift_y = parameters['shift_y'] * height
+    flip = parameters['flip']
+
+    # Output -> input mapping: rotation @ shear @ zoom @ flip, about the image centre
+    a00 = tf.cos(theta) * zoom_x * flip
+    a01 = (-tf.sin(theta) * tf.cos(shear) - tf.cos(theta) * tf.sin(shear)) * zoom_y
+    a10 = tf.sin(theta) * zoom_x * flip
+    a11 = (tf.cos(theta) * tf.cos(shear) - tf.sin(theta) * tf.sin(shear)) * zoom_y
+    center_x = (width - 1.0) / 2.0
+    center_y = (height - 1.0) / 2.0
+    a02 = center_x - a00 * center_x - a01 * center_y + shift_x
+    a12 = center_y - a10 * center_x - a11 * center_y + shift_y
+    zeros = tf.zeros([batch_size])
+    transforms = tf.stack([a00, a01, a02, a10, a11, a12, zeros, zeros], axis=1)
+
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=images,
+        transforms=transforms,
+        output_shape=shape[1:3],
+        fill_value=0.0,
+        interpolation='BILINEAR',
+        fill_mode='NEAREST'
+    )
+
+
+def make_dataset(samples, batch_size=32, training=False, image_size=IMAGE_SIZE,
+                 num_classes=len(CLASS_LABELS), cache=True, seed=42, shards=None):
+    """Build a batched ``tf.data.Dataset`` of ``(images, one_hot_labels)``
+
+    ``samples`` is a list of ``(path, label_index)``. ``cache`` is True to keep
+    decoded images in memory, a file path to cache them on disk, or False.
+    With ``shards`` the images are read from the memory-mapped shards instead
+    (``cache`` is not needed then). Training datasets are reshuffled every
+    epoch and augmented.
+    """
+    if shards is not None:
+        dataset = shards.batches(samples, batch_size, shuffle=training, seed=seed)
+    else:
+        paths = [path for path, _ in samples]
+        labels = [label for _, label in samples]
+
+        dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+        dataset = dataset.map(
+            lambda path, label: (decode_image(path, image_size), label),
+            num_parallel_calls=AUTOTUNE
+        )
+        if cache:
+            # Cached as uint8: a quarter of the memory of float32 images
+            dataset = dataset.cache('' if cache is True else cache)
+        if training:
+            dataset = dataset.shuffle(len(samples), seed=seed, reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size)
+
+    def to_inputs(images, labels):
+        return tf.cast(images, tf.float32) / 255.0, tf.one_hot(labels, num_classes)
+
+    dataset = dataset.map(to_inputs, num_parallel_calls=AUTOTUNE)
+    if training:
+        dataset = dataset.map(
+            lambda images, labels: (augment_batch(images, seed=seed), labels),
+            num_parallel_calls=AUTOTUNE
+        )
+    return dataset.prefetch(AUTOTUNE)
+
+
+def prepare_datasets(data_dir, batch_size=32, validation_split=0.2, seed=42, cache=True):
+    """Return ``(train_dataset, validation_dataset)`` for ``data_dir/<class>/`` images
+
+    ``data_dir`` may be a shard directory. A ``cache`` path is used as a
+    prefix; the two datasets get their own files.
+    """
+    images, shards = open_dataset(data_dir)
+    if not images:
+        raise ValueError(f"No images found under {data_dir}/<class>/")
+
+    train, validation = stratified_split(images, validation_split, seed)
+    print(f"Found {len(train)} training and {len(validation)} validation images")
+
+    def cache_for(name):
+        return cache if isinstance(cache, bool) else f"{cache}_{name}"
+
+    train_dataset = make_dataset(train, batch_size, training=True, cache=cache_for('train'), seed=seed, shards=shards)
+    validation_dataset = make_dataset(validation, batch_size, training=False, cache=cache_for('validation'), seed=seed, shards=shards)
+    return train_dataset, validation_dataset
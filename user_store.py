@@ -0,0 +1,214 @@
+"""
+Persistent user accounts behind a small SQL storage layer.
+
+``open_user_store('sqlite:///users.db')`` returns a ``UserStore`` over a
+``ConnectionPool``: every request thread borrows its own connection, so
+lookups by email (a unique index) never queue behind another thread's query.
+SQLite databases run in WAL mode, where readers don't block each other or the
+writer, so every gunicorn worker can share one database file.
+
+Other SQL databases plug in through ``USER_STORE_BACKENDS``, which maps a URL
+scheme to a DB-API driver module, a connect function and the one bit of DDL
+that differs between them; ``postgresql://`` works when ``psycopg2`` is
+installed. ``open_database`` gives other stores the same choice of databases.
+"""
+
+import importlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class UserExistsError(ValueError):
+    """Raised when registering an email that already has an account"""
+
+
+def connect_sqlite(driver, path):
+    """Open a SQLite connection tuned for many concurrent readers and short writes"""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Pooled connections are handed between threads, one user at a time
+    connection = driver.connect(path, timeout=30, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+
+def connect_url(driver, url):
+    return driver.connect(url)
+
+
+# URL scheme -> (DB-API driver module, connect(driver, target), id column DDL)
+USER_STORE_BACKENDS = {
+    'sqlite': ('sqlite3', connect_sqlite, 'INTEGER PRIMARY KEY'),
+    'postgresql': ('psycopg2', connect_url, 'SERIAL PRIMARY KEY'),
+}
+
+
+class ConnectionPool:
+    """Thread-safe pool of up to ``max_size`` lazily opened DB-API connections
+
+    Connections opened before a fork (e.g. by gunicorn's preloading master)
+    are never used by the children; each process opens its own.
+    """
+
+    def __init__(self, connect, max_size=8, timeout=30):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        if self._pid != os.getpid():
+            self._reset()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.max_size:
+                self._opened += 1
+                try:
+                    return self.connect()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        return self._idle.get(timeout=self.timeout)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commit on success, roll back on error"""
+        connection = self._acquire()
+        pid = self._pid
+        try:
+            yield connection
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            if pid == os.getpid():
+                self._idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class UserStore:
+    """User accounts (email, name, password hash) stored in a SQL database"""
+
+    def __init__(self, pool, integrity_error=sqlite3.IntegrityError, placeholder='?',
+                 id_column='INTEGER PRIMARY KEY'):
+        self.pool = pool
+        self.integrity_error = integrity_error
+        self.placeholder = placeholder
+        self.id_column = id_column
+
+    def _sql(self, statement):
+        return statement.replace('?', self.placeholder)
+
+    def create_schema(self):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS users ("
+                f"id {self.id_column}, "
+                f"email TEXT NOT NULL, "
+                f"name TEXT NOT NULL, "
+                f"password_hash TEXT NOT NULL, "
+                f"created_at DOUBLE PRECISION NOT NULL)"
+            )
+            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users (email)')
+
+    def get(self, email):
+        """Return ``{'email', 'name', 'password'}`` for ``email``, or None"""
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(self._sql('SELECT email, name, password_hash FROM users WHERE email = ?'), (email,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return {'email': row[0], 'name': row[1], 'password': row[2]}
+
+    def add(self, email, name, password_hash):
+        """Create an account; raises UserExistsError if ``email`` is taken"""
+        try:
+            with self.pool.connection() as connection:
+                connection.cursor().execute(
+                    self._sql('INSERT INTO users (email, name, password_hash, created_at) VALUES (?, ?, ?, ?)'),
+                    (email, name, password_hash, time.time())
+                )
+        except self.integrity_error:
+            raise UserExistsError(f"User {email} already exists")
+
+    def update_password(self, email, password_hash):
+        with self.pool.connection() as connection:
+            connection.cursor().execute(
+                self._sql('UPDATE users SET password_hash = ? WHERE email = ?'), (password_hash, email)
+            )
+
+    def __contains__(self, email):
+        return self.get(email) is not None
+
+    def __len__(self):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute('SELECT COUNT(*) FROM users')
+            return cursor.fetchone()[0]
+
+
+def open_database(url, pool_size=8):
+    """Return ``(pool, driver, id_column)`` for the database at ``url``
+
+    ``sqlite:///relative/path.db``, ``sqlite:////absolute/path.db`` and
+    ``sqlite://:memory:`` are accepted; other schemes must be registered in
+    ``USER_STORE_BACKENDS``.
+    """
+    scheme, _, rest = url.partition('://')
+    if scheme not in USER_STORE_BACKENDS:
+        raise ValueError(f"Unknown database '{scheme}', expected one of {tuple(USER_STORE_BACKENDS)}")
+    driver_name, connect, id_column = USER_STORE_BACKENDS[scheme]
+    try:
+        driver = importlib.import_module(driver_name)
+    except ImportError:
+        raise RuntimeError(f"{scheme}:// databases require the {driver_name} package")
+
+    if scheme == 'sqlite':
+        target = rest[1:] if rest.startswith('/') else rest
+        if target == ':memory:':
+            # Every connection to :memory: is a separate database; share one
+            pool_size = 1
+    else:
+        target = url
+
+    return ConnectionPool(lambda: connect(driver, target), max_size=pool_size), driver, id_column
+
+
+def placeholder_for(driver):
+    return '?' if driver.paramstyle == 'qmark' else '%s'
+
+
+def open_user_store(url='sqlite:///users.db', pool_size=8):
+    """Open (creating the schema if needed) the user store at ``url``, see ``open_database``"""
+    pool, driver, id_column = open_database(url, pool_size)
+    store = UserStore(
+        pool,
+        integrity_error=driver.IntegrityError,
+        placeholder=placeholder_for(driver),
+        id_column=id_column,
+    )
+    store.create_schema()
+    return store